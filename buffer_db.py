@@ -0,0 +1,470 @@
+# -----------------------------------------------------------------------
+# buffer_db.py
+# -----------------------------------------------------------------------
+# the module implements the buffer pool which is shared by all the files
+# of the program, i.e. the table files (.dat), the index files (.ind)
+# and the other block files of the tables; the log is written by wal_db.py.
+# Each block in the pool is identified by (file name, block id) and the
+# pool keeps at most BUFFER_POOL_FRAMES blocks in main memory.
+# -----------------------------------------------------------------------
+
+# structure of the buffer pool
+# ---------------------------------------------------
+# frame_0|frame_1|...|frame_n           # each frame holds one block of BLOCK_SIZE bytes
+# page_table                            # (file name, block id) -> frame number
+# file_handles                          # file name -> opened file object
+# ---------------------------------------------------
+# a frame can not be replaced while it is pinned (pin_count > 0)
+# the replacement policy is clock: every access sets the reference bit of
+# the frame, the clock hand clears the bit and chooses the first frame
+# whose bit is already cleared
+# a dirty frame remembers the LSN of the last log record of its changes,
+# the log is flushed up to that LSN before the block is written back (Write-Ahead Logging Rule);
+# for the table files the durable end of the log is then kept as the page LSN of the block (see wal_db.py)
+# and the first log record which made it dirty (rec lsn) is given to the checkpoints (see transaction_db.py)
+# ---------------------------------------------------
+
+import os
+import atexit
+import threading
+from common_db import BLOCK_SIZE, BUFFER_POOL_FRAMES
+import wal_db
+
+
+# --------------------------------------------
+# one frame of the buffer pool
+# --------------------------------------------
+class Frame(object):
+
+    def __init__(self):
+        self.key = None  # (file name, block id) of the block in the frame
+        self.data = bytearray(BLOCK_SIZE)
+        self.pin_count = 0
+        self.dirty = False
+        self.ref_bit = False
+        self.lsn = 0  # the last log record of the changes which are not in the file yet
+        self.rec_lsn = 0  # the first log record of the changes which are not in the file yet
+
+
+# --------------------------------------------
+# the class caches blocks of files in main memory
+# functions include pin, unpin, read, write and flush
+# --------------------------------------------
+class BufferPool(object):
+
+    # ------------------------------
+    # constructor of the class
+    # input:
+    #       num_frames: the maximum number of blocks in main memory
+    # -------------------------------------
+    def __init__(self, num_frames=BUFFER_POOL_FRAMES):
+        self.num_frames = num_frames
+        self.frames = []  # frames are allocated when they are used for the first time
+        self.page_table = {}
+        self.file_handles = {}
+        self.clock_hand = 0
+        self.lock = threading.RLock()
+        self.log = None  # the write-ahead log, see set_log()
+        self.page_lsns = {}  # path -> wal_db.PageLsnMap of the files whose changes are logged
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+
+    # ------------------------------
+    # the key of a file in the pool, bytes and str names of the same file are the same key
+    # -------------------------------------
+    def _file_key(self, file_name):
+        return os.path.abspath(os.fsdecode(file_name))
+
+    # ------------------------------
+    # return the opened handle of the file, the file is created if it does not exist
+    # -------------------------------------
+    def _get_handle(self, path):
+        f_handle = self.file_handles.get(path)
+        if f_handle is None:
+            if os.path.exists(path):
+                f_handle = open(path, 'rb+')
+            else:
+                f_handle = open(path, 'wb+')
+            self.file_handles[path] = f_handle
+        return f_handle
+
+    # ------------------------------
+    # write the block in the frame back to its file
+    # -------------------------------------
+    def _write_back(self, frame):
+        path, block_id = frame.key
+        if frame.lsn and self.log is not None:
+            self.log.flush(frame.lsn)
+        frame.lsn = 0
+        frame.rec_lsn = 0
+        f_handle = self._get_handle(path)
+        f_handle.seek(BLOCK_SIZE * block_id)
+        f_handle.write(frame.data)
+        lsn_map = self.page_lsns.get(path)
+        if lsn_map is not None and self.log is not None:
+            lsn_map.set(block_id, self.log.durable_lsn)  # it is written once the block is on the disk
+        frame.dirty = False
+        self.writes += 1
+
+    # ------------------------------
+    # choose a frame for a new block with the clock policy
+    # output:
+    #       the number of a free frame
+    # -------------------------------------
+    def _choose_victim(self):
+        if len(self.frames) < self.num_frames:
+            self.frames.append(Frame())
+            return len(self.frames) - 1
+
+        for _ in range(2 * len(self.frames)):
+            frame_no = self.clock_hand
+            frame = self.frames[frame_no]
+            self.clock_hand = (self.clock_hand + 1) % len(self.frames)
+            if frame.pin_count > 0:
+                continue
+            if frame.ref_bit:
+                frame.ref_bit = False
+                continue
+
+            if frame.key is None:  # the frame was emptied by close_file
+                return frame_no
+            if frame.dirty:
+                self._write_back(frame)
+            del self.page_table[frame.key]
+            frame.key = None
+            self.evictions += 1
+            return frame_no
+
+        raise RuntimeError('all the frames of the buffer pool are pinned')
+
+    # ------------------------------
+    # to pin a block in the pool, it is read from the file if it is not in the pool
+    # input:
+    #       file_name, block_id
+    # output:
+    #       the bytearray of the frame, which can be modified until unpin is called
+    # -------------------------------------
+    def pin(self, file_name, block_id):
+        with self.lock:
+            key = (self._file_key(file_name), block_id)
+            frame_no = self.page_table.get(key)
+            if frame_no is not None:
+                self.hits += 1
+                frame = self.frames[frame_no]
+            else:
+                self.misses += 1
+                frame_no = self._choose_victim()
+                frame = self.frames[frame_no]
+
+                f_handle = self._get_handle(key[0])
+                f_handle.seek(BLOCK_SIZE * block_id)
+                block = f_handle.read(BLOCK_SIZE)
+                frame.data[:len(block)] = block
+                frame.data[len(block):] = bytes(BLOCK_SIZE - len(block))  # the block is beyond the end of file
+
+                frame.key = key
+                frame.dirty = False
+                frame.lsn = 0
+                frame.rec_lsn = 0
+                self.page_table[key] = frame_no
+
+            frame.pin_count += 1
+            frame.ref_bit = True
+            return frame.data
+
+    # ------------------------------
+    # to unpin a block which was pinned before
+    # input:
+    #       file_name, block_id
+    #       dirty: True if the block has been modified
+    #       lsn: the log record of the modification, 0 if it is not logged
+    # -------------------------------------
+    def unpin(self, file_name, block_id, dirty=False, lsn=0):
+        with self.lock:
+            frame_no = self.page_table.get((self._file_key(file_name), block_id))
+            if frame_no is None:
+                return
+            frame = self.frames[frame_no]
+            if frame.pin_count > 0:
+                frame.pin_count -= 1
+            if dirty:
+                frame.dirty = True
+            if lsn > frame.lsn:
+                frame.lsn = lsn
+            if lsn > 0 and frame.rec_lsn == 0:
+                frame.rec_lsn = lsn
+                lsn_map = self.page_lsns.get(frame.key[0])
+                if lsn_map is not None:
+                    lsn_map.create()  # the recovery reads the floor of the file from it
+
+    # ------------------------------
+    # return a copy of the block
+    # -------------------------------------
+    def read_block(self, file_name, block_id):
+        with self.lock:
+            data = bytes(self.pin(file_name, block_id))
+            self.unpin(file_name, block_id)
+            return data
+
+    # ------------------------------
+    # replace the content of the block, the block is written to the file when it is flushed or replaced
+    # -------------------------------------
+    def write_block(self, file_name, block_id, data):
+        with self.lock:
+            frame_data = self.pin(file_name, block_id)
+            frame_data[:len(data)] = data
+            if len(data) < BLOCK_SIZE:
+                frame_data[len(data):] = bytes(BLOCK_SIZE - len(data))
+            self.unpin(file_name, block_id, dirty=True)
+
+    # ------------------------------
+    # register the write-ahead log, it is flushed before a logged block is written back
+    # input:
+    #       log: a wal_db.WalWriter
+    # -------------------------------------
+    def set_log(self, log):
+        with self.lock:
+            self.log = log
+
+    # ------------------------------
+    # keep the page LSNs of the blocks of a table file, which are written back from now on
+    # output:
+    #       the wal_db.PageLsnMap of the file
+    # -------------------------------------
+    def track_page_lsns(self, file_name):
+        with self.lock:
+            path = self._file_key(file_name)
+            lsn_map = self.page_lsns.get(path)
+            if lsn_map is None:
+                lsn_map = wal_db.PageLsnMap(path, self.log.durable_lsn if self.log is not None else 0)
+                self.page_lsns[path] = lsn_map
+            return lsn_map
+
+    # ------------------------------
+    # stop keeping the page LSNs of a file, e.g. the table is dropped
+    # -------------------------------------
+    def untrack_page_lsns(self, file_name):
+        with self.lock:
+            lsn_map = self.page_lsns.pop(self._file_key(file_name), None)
+            if lsn_map is not None:
+                lsn_map.close()
+
+    # ------------------------------
+    # forget the page LSNs of a file whose blocks are all on the disk, e.g. before the file is rewritten,
+    # so that the older log records are never redone in it
+    # -------------------------------------
+    def reset_page_lsns(self, file_name):
+        with self.lock:
+            lsn_map = self.track_page_lsns(file_name)
+            if self.log is not None:
+                self.log.flush()
+                lsn_map.reset(self.log.durable_lsn)
+
+    # ------------------------------
+    # whether the block is in the pool and pinned by someone
+    # -------------------------------------
+    def is_pinned(self, file_name, block_id):
+        with self.lock:
+            frame_no = self.page_table.get((self._file_key(file_name), block_id))
+            return frame_no is not None and self.frames[frame_no].pin_count > 0
+
+    # ------------------------------
+    # the number of blocks of the file, including the blocks which only exist in the pool
+    # -------------------------------------
+    def num_blocks(self, file_name):
+        with self.lock:
+            path = self._file_key(file_name)
+            if path in self.file_handles:
+                self.file_handles[path].seek(0, os.SEEK_END)
+                size = self.file_handles[path].tell()
+            elif os.path.exists(path):
+                size = os.path.getsize(path)
+            else:
+                size = 0
+            num = (size + BLOCK_SIZE - 1) // BLOCK_SIZE
+            for (key_path, block_id) in self.page_table:
+                if key_path == path and block_id >= num:
+                    num = block_id + 1
+            return num
+
+    # ------------------------------
+    # write the dirty blocks of the file back to the file
+    # input:
+    #       pinned: True if the pinned blocks are written too, e.g. the file is closed; otherwise a block
+    #               which is being changed is left for the next flush, its half-done change is never written
+    # -------------------------------------
+    def flush_file(self, file_name, pinned=False):
+        with self.lock:
+            path = self._file_key(file_name)
+            dirty_frames = [self.frames[frame_no] for (key, frame_no) in self.page_table.items()
+                            if key[0] == path and self.frames[frame_no].dirty
+                            and (pinned or self.frames[frame_no].pin_count == 0)]
+            dirty_frames.sort(key=lambda x: x.key[1])  # sequential writes
+            for frame in dirty_frames:
+                self._write_back(frame)
+            if path in self.file_handles:
+                self.file_handles[path].flush()
+
+    # ------------------------------
+    # write all the dirty blocks in the pool back to their files
+    # -------------------------------------
+    def flush_all(self):
+        with self.lock:
+            for path in set(key[0] for key in self.page_table):
+                self.flush_file(path)
+
+    # ------------------------------
+    # the dirty page table of the checkpoints
+    # output:
+    #       a list of (file name, block id, rec lsn) of the dirty blocks with logged changes
+    # -------------------------------------
+    def dirty_pages(self):
+        with self.lock:
+            return [(frame.key[0], frame.key[1], frame.rec_lsn) for frame in self.frames
+                    if frame.key is not None and frame.dirty and frame.rec_lsn > 0]
+
+    # ------------------------------
+    # write back the unpinned dirty blocks whose first logged change is older than lsn,
+    # the oldest first; it is called by the checkpoint thread so that the log before lsn is no longer needed
+    # input:
+    #       lsn: the oldest LSN the log should keep
+    #       max_blocks: the number of blocks written at most
+    # output:
+    #       the number of written blocks
+    # -------------------------------------
+    def flush_old_pages(self, lsn, max_blocks):
+        with self.lock:
+            old_frames = [frame for frame in self.frames if frame.key is not None and frame.dirty
+                          and 0 < frame.rec_lsn < lsn and frame.pin_count == 0]
+            old_frames.sort(key=lambda x: x.rec_lsn)
+            old_frames = old_frames[:max_blocks]
+            old_frames.sort(key=lambda x: x.key)  # sequential writes
+            for frame in old_frames:
+                self._write_back(frame)
+            return len(old_frames)
+
+    # ------------------------------
+    # write back the unpinned dirty blocks without logged changes, e.g. the blocks of the free space
+    # maps and the zone maps, which the recovery cannot redo from the log
+    # -------------------------------------
+    def flush_unlogged(self):
+        with self.lock:
+            frames = [frame for frame in self.frames if frame.key is not None and frame.dirty
+                      and frame.rec_lsn == 0 and frame.pin_count == 0]
+            frames.sort(key=lambda x: x.key)  # sequential writes
+            for frame in frames:
+                self._write_back(frame)
+
+    # ------------------------------
+    # make the blocks which have been written back durable, i.e. fsync all the opened files,
+    # then write their page LSNs: a page LSN on the disk is never ahead of its block
+    # -------------------------------------
+    def sync_files(self):
+        with self.lock:
+            for f_handle in self.file_handles.values():
+                f_handle.flush()
+                os.fsync(f_handle.fileno())
+            for lsn_map in self.page_lsns.values():
+                lsn_map.sync()
+
+    # ------------------------------
+    # remove all the blocks of the file from the pool and close the file
+    # input:
+    #       file_name
+    #       discard: True if the dirty blocks are thrown away, e.g. the file is to be deleted
+    # -------------------------------------
+    def close_file(self, file_name, discard=False):
+        with self.lock:
+            path = self._file_key(file_name)
+            if not discard:
+                self.flush_file(path, pinned=True)
+            for key in [key for key in self.page_table if key[0] == path]:
+                self._drop_frame(key)
+            f_handle = self.file_handles.pop(path, None)
+            if f_handle is not None:
+                if not discard and path in self.page_lsns:
+                    os.fsync(f_handle.fileno())  # the next checkpoint counts on its blocks being on the disk
+                f_handle.close()
+            if path in self.page_lsns:
+                if discard:  # the blocks written back before may not be on the disk
+                    self.page_lsns[path].drop_pending()
+                else:
+                    self.page_lsns[path].sync()
+
+    # ------------------------------
+    # cut the file after its first num_blocks blocks, the blocks after them are thrown away from the pool
+    # -------------------------------------
+    def truncate_file(self, file_name, num_blocks):
+        with self.lock:
+            path = self._file_key(file_name)
+            for key in [key for key in self.page_table if key[0] == path and key[1] >= num_blocks]:
+                self._drop_frame(key)
+            if os.path.exists(path) and os.path.getsize(path) > num_blocks * BLOCK_SIZE:
+                f_handle = self._get_handle(path)
+                f_handle.flush()
+                f_handle.truncate(num_blocks * BLOCK_SIZE)
+
+    # ------------------------------
+    # empty the frame of the block without writing it back
+    # -------------------------------------
+    def _drop_frame(self, key):
+        frame = self.frames[self.page_table.pop(key)]
+        frame.key = None
+        frame.dirty = False
+        frame.lsn = 0
+        frame.rec_lsn = 0
+        frame.pin_count = 0
+        frame.ref_bit = False
+
+    # ------------------------------
+    # change the number of frames, the blocks in the extra frames are written back and dropped;
+    # nothing is changed if one of them is pinned
+    # -------------------------------------
+    def set_num_frames(self, num_frames):
+        with self.lock:
+            if num_frames < 1:
+                raise ValueError('the buffer pool needs at least one frame')
+            extra_frames = [frame for frame in self.frames[num_frames:] if frame.key is not None]
+            if any(frame.pin_count > 0 for frame in extra_frames):
+                raise RuntimeError('a pinned block can not be dropped from the buffer pool')
+            for frame in extra_frames:
+                if frame.dirty:
+                    self._write_back(frame)
+                self._drop_frame(frame.key)
+            for path in self.file_handles:
+                self.file_handles[path].flush()
+            del self.frames[num_frames:]
+            self.num_frames = num_frames
+            self.clock_hand = 0
+
+    # ------------------------------
+    # return the counters of the pool
+    # -------------------------------------
+    def get_stats(self):
+        with self.lock:
+            accesses = self.hits + self.misses
+            return {
+                'frames': self.num_frames,
+                'used_frames': len(self.page_table),
+                'dirty_frames': sum(1 for frame in self.frames if frame.key is not None and frame.dirty),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / accesses if accesses else 0.0,
+                'evictions': self.evictions,
+                'writes': self.writes,
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.writes = 0
+
+
+# the buffer pool shared by all the modules
+global_buffer_pool = BufferPool()
+atexit.register(global_buffer_pool.flush_all)
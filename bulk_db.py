@@ -0,0 +1,161 @@
+# -----------------------------------------------------------------------
+# bulk_db.py
+# -----------------------------------------------------------------------
+# the module loads the records of a table from a file and writes them to a file
+#       IMPORT table FROM 'file'
+#       EXPORT table TO 'file'
+# the format is chosen by the suffix of the file:
+#       .csv            comma separated values, the first line holds the field names
+#       .jsonl, .json   one JSON list or object (field name -> value) per line
+#       other, e.g .txt the values separated by |, one record per line (see mega_storage.py)
+# the files are read and written as streams, the records are never all kept in main memory;
+# an import is one transaction whose records are written block by block (see Storage.bulk_load())
+# -----------------------------------------------------------------------
+
+import csv
+import json
+import os
+import storage_db
+from buffer_db import global_buffer_pool
+
+FORMAT_CSV = 'csv'
+FORMAT_JSONL = 'jsonl'
+FORMAT_PIPE = 'pipe'
+
+STATEMENTS = ('IMPORT', 'EXPORT')  # the values of the root nodes built by parser_db.py
+
+
+# ------------------------------
+# the format of the file according to its suffix
+# -------------------------------------
+def file_format(path):
+    suffix = os.path.splitext(os.fsdecode(path))[1].lower()
+    if suffix == '.csv':
+        return FORMAT_CSV
+    if suffix in ('.jsonl', '.json'):
+        return FORMAT_JSONL
+    return FORMAT_PIPE
+
+
+# ------------------------------
+# open the shared Storage of an existing table, see storage_db.open_table()
+# input:
+#       table_name: str or bytes
+# -------------------------------------
+def open_table(table_name):
+    table_name = os.fsencode(table_name).strip()
+    if global_buffer_pool.num_blocks(table_name + b'.dat') == 0:
+        raise ValueError(f"table {table_name.decode('utf-8')} does not exist")
+    return storage_db.open_table(table_name)
+
+
+# ------------------------------
+# read the records of a file one by one
+# input:
+#       f_handle: the file opened in text mode
+#       fmt: FORMAT_CSV, FORMAT_JSONL or FORMAT_PIPE
+#       field_names: the names of the fields of the table
+# output:
+#       a generator of lists of field values
+# -------------------------------------
+def read_rows(f_handle, fmt, field_names):
+    if fmt == FORMAT_CSV:
+        reader = csv.reader(f_handle)
+        for (line_no, row) in enumerate(reader):
+            if line_no == 0 and [value.strip() for value in row] == field_names:
+                continue  # the header line
+            if row:
+                yield row
+    elif fmt == FORMAT_JSONL:
+        for line in f_handle:
+            line = line.strip()
+            if not line:
+                continue
+            value = json.loads(line)
+            if isinstance(value, dict):
+                if any(name not in value for name in field_names):
+                    raise ValueError(f"the JSON object misses a field of the table: {line}")
+                value = [value[name] for name in field_names]
+            yield value
+    else:
+        for line in f_handle:
+            line = line.rstrip('\r\n')
+            if line:
+                yield line.split('|')
+
+
+# ------------------------------
+# write the records to a file one by one
+# input:
+#       f_handle: the file opened in text mode
+#       fmt: see read_rows()
+#       field_names: the names of the fields of the table
+#       records: an iterable of tuples of typed values
+# output:
+#       the number of written records
+# -------------------------------------
+def write_rows(f_handle, fmt, field_names, records):
+    written = 0
+    if fmt == FORMAT_CSV:
+        writer = csv.writer(f_handle)
+        writer.writerow(field_names)
+        for record in records:
+            writer.writerow([int(value) if isinstance(value, bool) else value for value in record])
+            written += 1
+    elif fmt == FORMAT_JSONL:
+        for record in records:
+            f_handle.write(json.dumps(dict(zip(field_names, record)), ensure_ascii=False) + '\n')
+            written += 1
+    else:
+        for record in records:
+            values = [str(int(value) if isinstance(value, bool) else value) for value in record]
+            if any('|' in value or '\n' in value for value in values):  # could not be read back
+                raise ValueError(f"the record {record} holds | or a line break, use a .csv or .jsonl file")
+            f_handle.write('|'.join(values) + '\n')
+            written += 1
+    return written
+
+
+# ------------------------------
+# IMPORT table FROM 'file': append the records of the file to the table
+# output:
+#       the number of imported records
+# -------------------------------------
+def import_table(table_name, path, trans_id=None):
+    storage = open_table(table_name)
+    storage.set_transaction(trans_id)
+    field_names = [field[0].decode('utf-8').strip(' \0') for field in storage.getFieldList()]
+    try:
+        with open(path, 'r', encoding='utf-8', newline='') as f_handle:
+            loaded = storage.bulk_load(read_rows(f_handle, file_format(path), field_names))
+    finally:
+        storage.set_transaction(None)  # the handle is shared with the other statements
+    print(f"{loaded} records have been imported into {os.fsdecode(table_name)} from {os.fsdecode(path)}")
+    return loaded
+
+
+# ------------------------------
+# EXPORT table TO 'file': write all the records of the table into the file
+# output:
+#       the number of exported records
+# -------------------------------------
+def export_table(table_name, path):
+    storage = open_table(table_name)
+    field_names = [field[0].decode('utf-8').strip(' \0') for field in storage.getFieldList()]
+    with open(path, 'w', encoding='utf-8', newline='') as f_handle:
+        written = write_rows(f_handle, file_format(path), field_names, storage.scan())
+    print(f"{written} records have been exported from {os.fsdecode(table_name)} to {os.fsdecode(path)}")
+    return written
+
+
+# ------------------------------
+# execute the syntax tree of an IMPORT or EXPORT statement
+# input:
+#       syn_tree: Node('IMPORT' or 'EXPORT', [table name, file name])
+#       trans_id: the active transaction of the user, None for a transaction of its own
+# -------------------------------------
+def execute_statement(syn_tree, trans_id=None):
+    table_name, path = syn_tree.children
+    if syn_tree.value == 'IMPORT':
+        return import_table(table_name, path, trans_id)
+    return export_table(table_name, path)
@@ -0,0 +1,163 @@
+# -----------------------------------------------------------------------
+# codec_db.py
+# -----------------------------------------------------------------------
+# the module turns the content of a record into a tuple of field values and
+# back. Each schema gets one precompiled struct.Struct, so a whole record is
+# packed or unpacked in one call. The codecs are cached by the field list
+# returned by Storage.getFieldList().
+# -----------------------------------------------------------------------
+
+# the content of a record is stored in one of two formats
+# ----------------------------------------------------------
+# text format (the tables created before the binary format)
+#       every value is a space padded string of field_length bytes
+# binary format
+#       0->str,1->varstr   field_length bytes, padded with b'\0'
+#       2->int             8 bytes signed integer
+#       3->bool            1 byte
+# binary format with variable length (the varstr values are not padded)
+#       the values of the other fields, as in the binary format
+#       end_0 ... end_k     # '!H', the end of each varstr value in the varstr area
+#       varstr_0 ... varstr_k
+# ---------------------------------------------------------------
+
+import struct
+
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+VAR_END_FORMAT = 'H'
+
+_codec_cache = {}  # (field list, binary, varlen) -> RecordCodec
+
+
+def _text_to_str(value):
+    return value.decode('utf-8').strip()
+
+
+def _text_to_int(value):
+    return int(value.decode('utf-8').strip())
+
+
+def _text_to_bool(value):
+    return value.decode('utf-8').strip().lower() in ('true', '1', 'yes', 't')
+
+
+# --------------------------------------------
+# the codec of the records of one schema
+# --------------------------------------------
+class RecordCodec(object):
+
+    # ------------------------------
+    # constructor of the class
+    # input:
+    #       field_list: list of (field name, field type, field length)
+    #       binary: True for the binary format, False for the text format
+    #       varlen: True if the varstr values of the binary format are not padded
+    # -------------------------------------
+    def __init__(self, field_list, binary, varlen=False):
+        self.field_list = list(field_list)
+        self.binary = binary
+        self.str_fields = [i for (i, field) in enumerate(self.field_list) if field[1] in (0, 1)]
+        self.var_fields = [i for (i, field) in enumerate(self.field_list) if field[1] == 1] if binary and varlen else []
+        self.varlen = bool(self.var_fields)  # True if the records of the schema have different lengths
+
+        fmt = '!'
+        if binary:
+            for (i, (field_name, field_type, field_length)) in enumerate(self.field_list):
+                if i in self.var_fields:
+                    continue
+                if field_type == 2:
+                    fmt += 'q'
+                elif field_type == 3:
+                    fmt += '?'
+                else:
+                    fmt += str(field_length) + 's'
+        else:
+            fmt += ''.join(str(field[2]) + 's' for field in self.field_list)
+            self.converters = [{2: _text_to_int, 3: _text_to_bool}.get(field[1], _text_to_str)
+                               for field in self.field_list]
+        self.struct = struct.Struct(fmt)  # the fields which are not varstr values of variable length
+        self.size = self.struct.size  # the length of the record content, the largest one if varlen
+
+        if self.varlen:
+            self.fixed_fields = [i for i in range(len(self.field_list)) if i not in self.var_fields]
+            self.fixed_str_fields = [j for (j, i) in enumerate(self.fixed_fields) if i in self.str_fields]
+            self.var_struct = struct.Struct('!' + VAR_END_FORMAT * len(self.var_fields))
+            self.size += self.var_struct.size + sum(self.field_list[i][2] for i in self.var_fields)
+
+    # ------------------------------
+    # decode the record content which begins at offset in buf
+    # output:
+    #       tuple of field values
+    # -------------------------------------
+    def decode(self, buf, offset=0):
+        if self.varlen:
+            return self._decode_varlen(buf, offset)
+        values = self.struct.unpack_from(buf, offset)
+        if not self.binary:
+            return tuple([convert(value) for (convert, value) in zip(self.converters, values)])
+        if not self.str_fields:
+            return values
+        values = list(values)
+        for i in self.str_fields:
+            values[i] = values[i].rstrip(b'\0').decode('utf-8')
+        return tuple(values)
+
+    def _decode_varlen(self, buf, offset):
+        fixed = list(self.struct.unpack_from(buf, offset))
+        for j in self.fixed_str_fields:
+            fixed[j] = fixed[j].rstrip(b'\0').decode('utf-8')
+        var_begin = offset + self.struct.size + self.var_struct.size
+        ends = self.var_struct.unpack_from(buf, offset + self.struct.size)
+
+        values = [None] * len(self.field_list)
+        for (j, i) in enumerate(self.fixed_fields):
+            values[i] = fixed[j]
+        begin = 0
+        for (i, end) in zip(self.var_fields, ends):
+            values[i] = bytes(buf[var_begin + begin:var_begin + end]).decode('utf-8')
+            begin = end
+        return tuple(values)
+
+    # ------------------------------
+    # encode a tuple of field values (str, int or bool) into the record content
+    # -------------------------------------
+    def encode(self, values):
+        if self.varlen:
+            fixed = [values[i] for i in self.fixed_fields]
+            for j in self.fixed_str_fields:
+                fixed[j] = fixed[j].encode('utf-8')
+            var_values = [values[i].encode('utf-8') for i in self.var_fields]
+            ends = []
+            end = 0
+            for value in var_values:
+                end += len(value)
+                ends.append(end)
+            return self.struct.pack(*fixed) + self.var_struct.pack(*ends) + b''.join(var_values)
+
+        if self.binary:
+            values = list(values)
+            for i in self.str_fields:
+                values[i] = values[i].encode('utf-8')
+            return self.struct.pack(*values)
+
+        text = []
+        for (value, field) in zip(values, self.field_list):
+            if field[1] == 3:
+                value = '1' if value else '0'
+            value = str(value).encode('utf-8')
+            text.append(b' ' * (field[2] - len(value)) + value)  # the values are right-justified
+        return self.struct.pack(*text)
+
+
+# ------------------------------
+# return the codec of the field list, it is created only once
+# -------------------------------------
+def get_codec(field_list, binary, varlen=False):
+    key = (tuple(field_list), bool(binary), bool(varlen))
+    codec = _codec_cache.get(key)
+    if codec is None:
+        codec = RecordCodec(field_list, bool(binary), bool(varlen))
+        _codec_cache[key] = codec
+    return codec
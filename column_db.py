@@ -0,0 +1,243 @@
+# -----------------------------------------------------------------------
+# column_db.py
+# -----------------------------------------------------------------------
+# the module keeps the records of a table column by column in main memory
+#       2->int             array('q')
+#       3->bool            bitmap, one bit per record
+#       0->str,1->varstr   one bytearray, every value takes the same number of bytes
+# the executor in query_plan_db.py filters and projects whole columns
+# when common_db.COLUMNAR_EXECUTION is True
+# -----------------------------------------------------------------------
+
+import operator
+from array import array
+from itertools import repeat
+
+# the comparison operators of the conditions
+COMPARE_FUNCS = {
+    '=': operator.eq,
+    'EQX': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge,
+}
+
+
+# --------------------------------------------
+# a column of integers
+# --------------------------------------------
+class IntColumn(object):
+
+    def __init__(self, values=()):
+        self.values = array('q', values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, row):
+        return self.values[row]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def append(self, value):
+        self.values.append(value)
+
+    def take(self, rows):
+        return IntColumn(self.values[row] for row in rows)
+
+    # ------------------------------
+    # compare every value with the constant
+    # output:
+    #       a bytearray with 1 for the rows which satisfy the comparison
+    # -------------------------------------
+    def compare(self, func, constant):
+        return bytearray(map(func, self.values, repeat(constant)))
+
+
+# --------------------------------------------
+# a column of booleans, one bit per value
+# --------------------------------------------
+class BoolColumn(object):
+
+    def __init__(self, values=()):
+        self.bits = bytearray()
+        self.length = 0
+        for value in values:
+            self.append(value)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.length
+        if not 0 <= row < self.length:
+            raise IndexError('row out of range')
+        return bool(self.bits[row >> 3] >> (row & 7) & 1)
+
+    def __iter__(self):
+        bits = self.bits
+        return (bool(bits[row >> 3] >> (row & 7) & 1) for row in range(self.length))
+
+    def append(self, value):
+        if self.length & 7 == 0:
+            self.bits.append(0)
+        if value:
+            self.bits[self.length >> 3] |= 1 << (self.length & 7)
+        self.length += 1
+
+    def take(self, rows):
+        return BoolColumn(self[row] for row in rows)
+
+    def compare(self, func, constant):
+        return bytearray(map(func, self, repeat(constant)))
+
+
+# --------------------------------------------
+# a column of strings, every value takes width bytes of one bytearray
+# --------------------------------------------
+class StrColumn(object):
+
+    def __init__(self, width, values=()):
+        self.width = max(width, 1)
+        self.data = bytearray()
+        self.length = 0
+        for value in values:
+            self.append(value)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.length
+        if not 0 <= row < self.length:
+            raise IndexError('row out of range')
+        begin = row * self.width
+        return self.data[begin:begin + self.width].rstrip(b'\0').decode('utf-8')
+
+    def __iter__(self):
+        data, width = self.data, self.width
+        return (data[begin:begin + width].rstrip(b'\0').decode('utf-8')
+                for begin in range(0, self.length * width, width))
+
+    def append(self, value):
+        value = value.encode('utf-8')
+        if len(value) > self.width:  # a value with multi-byte characters, the column is widened
+            self._widen(len(value))
+        self.data += value + bytes(self.width - len(value))
+        self.length += 1
+
+    def _widen(self, width):
+        old_width, old_data = self.width, self.data
+        self.width = width
+        self.data = bytearray()
+        for begin in range(0, self.length * old_width, old_width):
+            self.data += old_data[begin:begin + old_width] + bytes(width - old_width)
+
+    def take(self, rows):
+        column = StrColumn(self.width)
+        for row in rows:
+            begin = row * self.width
+            column.data += self.data[begin:begin + self.width]
+        column.length = len(rows)
+        return column
+
+    def compare(self, func, constant):
+        if func in (operator.eq, operator.ne):  # the padded bytes are compared without decoding
+            key = constant.encode('utf-8')
+            if len(key) > self.width:
+                return bytearray([func is operator.ne]) * self.length
+            key += bytes(self.width - len(key))
+            data, width = self.data, self.width
+            return bytearray(func(data[begin:begin + width], key)
+                             for begin in range(0, self.length * width, width))
+        return bytearray(map(func, self, repeat(constant)))
+
+
+# ------------------------------
+# the empty column for the field (field name, field type, field length)
+# -------------------------------------
+def new_column(field):
+    if field[1] == 2:
+        return IntColumn()
+    if field[1] == 3:
+        return BoolColumn()
+    return StrColumn(field[2])
+
+
+# --------------------------------------------
+# a table kept column by column
+# iterating over it yields the records as tuples, as Storage.scan() does
+# --------------------------------------------
+class ColumnTable(object):
+
+    # ------------------------------
+    # constructor of the class
+    # input:
+    #       field_list: list of (field name, field type, field length), see Storage.getFieldList()
+    #       records: the records which are appended at first
+    #       columns: the columns of the table, they are used instead of empty columns if given
+    # -------------------------------------
+    def __init__(self, field_list, records=(), columns=None):
+        self.field_list = list(field_list)
+        if columns is None:
+            columns = [new_column(field) for field in self.field_list]
+        self.columns = columns
+        for record in records:
+            self.append(record)
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __iter__(self):
+        return zip(*self.columns)
+
+    def append(self, record):
+        for (column, value) in zip(self.columns, record):
+            column.append(value)
+
+    def row(self, row):
+        return tuple(column[row] for column in self.columns)
+
+    # ------------------------------
+    # the rows whose column value satisfies the comparison
+    # input:
+    #       index: the position of the column
+    #       operator_str: e.g. '=', '>'
+    #       constant: the typed constant
+    # output:
+    #       a bytearray with 1 for the rows which satisfy the comparison
+    # -------------------------------------
+    def compare(self, index, operator_str, constant):
+        func = COMPARE_FUNCS.get(operator_str, COMPARE_FUNCS.get(operator_str.upper()))
+        if func is None:
+            raise ValueError("Unknown operator '%s'" % operator_str)
+        return self.columns[index].compare(func, constant)
+
+    # ------------------------------
+    # a new table with the rows which are 1 in the mask
+    # -------------------------------------
+    def filter(self, mask):
+        rows = [row for (row, selected) in enumerate(mask) if selected]
+        return ColumnTable(self.field_list, columns=[column.take(rows) for column in self.columns])
+
+    # ------------------------------
+    # a new table with the columns at the given positions, the columns are shared
+    # -------------------------------------
+    def project(self, indices):
+        return ColumnTable([self.field_list[i] for i in indices], columns=[self.columns[i] for i in indices])
+
+
+# ------------------------------
+# combine two masks
+# -------------------------------------
+def mask_and(mask_a, mask_b):
+    return bytearray(map(operator.and_, mask_a, mask_b))
+
+
+def mask_or(mask_a, mask_b):
+    return bytearray(map(operator.or_, mask_a, mask_b))
@@ -7,6 +7,24 @@
 # are used for all the program
 #--------------------------------------------------
 BLOCK_SIZE=4096 # the size of one block during reading files
+BUFFER_POOL_FRAMES=256 # the number of blocks the shared buffer pool keeps in main memory (see buffer_db.py)
+COLUMNAR_EXECUTION=False # True if the queries filter and project whole columns (see column_db.py)
+PARALLEL_SCAN_WORKERS=0 # the number of processes which scan a table, 0 or 1 means no parallel scan (see parallel_db.py)
+PARALLEL_SCAN_MIN_BLOCKS=64 # a table with fewer data blocks is scanned in this process
+BACKGROUND_VACUUM=False # True if a background thread gives back the space of deleted records (see vacuum_db.py)
+VACUUM_INTERVAL=1.0 # the seconds the vacuum thread waits before it looks at the deleted tables again
+VACUUM_THROTTLE=0.005 # the seconds the vacuum thread sleeps after each block it has purged
+WAL_BUFFER_SIZE=65536 # the log records are kept in main memory until they reach this size or a transaction commits (see wal_db.py)
+WAL_GROUP_COMMIT_DELAY=0.0 # the seconds the log writer thread waits for other committers to share its fsync
+WAL_BUFFER_LIMIT=1048576 # the transactions wait for the log writer thread when this many log bytes are buffered
+WAL_SEGMENT_SIZE=16777216 # a new log segment is begun when the last one has grown beyond this size
+WAL_COMPRESS_MIN=256 # the payload of a log record with at least this many bytes is compressed with zlib, 0 means never
+CHECKPOINT_LOG_BYTES=16777216 # a checkpoint is taken after the log has grown by this size, 0 means never (see transaction_db.py)
+CHECKPOINT_INTERVAL=60.0 # the seconds after which the checkpoint thread takes a checkpoint anyway, 0 means never
+CHECKPOINT_FLUSH_BLOCKS=64 # the number of old dirty blocks the checkpoint thread writes back at a time
+MVCC_SNAPSHOTS=False # True if the queries read the snapshot of their transaction and updates keep the old versions (see page_db.py)
+LOCK_TIMEOUT=10.0 # the seconds a transaction waits for a lock before it gives up (see lock_db.py)
+LOCK_ESCALATION_ROWS=1000 # the row locks of one table which a transaction holds before they become a table lock
 
 global_lexer=None   # the global lex, which is filled in the moudle lex_db.py
 global_parser=None  # the global yacc, which is filled in the module yacc_db.py
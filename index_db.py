@@ -7,6 +7,7 @@ import struct
 import os
 import common_db # Haomin Wang: Assuming common_db.BLOCK_SIZE is defined
 import ctypes
+from buffer_db import global_buffer_pool # all the blocks of the index file are cached in the shared buffer pool
 
 # The 0 block stores the meta information of the tree
 '''
@@ -120,12 +121,10 @@ class Index(object):
 
         if not os.path.exists(self.index_file_name):
             print (f'Index file {self.index_file_name} does not exist. Creating...')
-            self.f_handle = open(self.index_file_name, 'wb+') # Create if not exists
+            self.open = True # the buffer pool creates the file when the meta block is written
             self._initialize_meta_block()
-            self.open = True
             print (f'{self.index_file_name} has been created and meta block initialized.')
         else:
-            self.f_handle = open(self.index_file_name, 'rb+')
             self.open = True
             self._load_meta_block()
             print (f'Index file {self.index_file_name} has been opened and meta block loaded.')
@@ -141,14 +140,15 @@ class Index(object):
         struct.pack_into(META_BLOCK_HEADER_FORMAT, meta_buf, 0,
                          self.meta_block_id, self.has_root, self.num_of_levels,
                          self.root_node_ptr, self.next_available_block_id)
-        self.f_handle.seek(0)
-        self.f_handle.write(meta_buf)
-        self.f_handle.flush()
+        global_buffer_pool.write_block(self.index_file_name, 0, meta_buf.raw)
+        global_buffer_pool.flush_file(self.index_file_name)
 
     # Haomin Wang: Helper to load meta block
     def _load_meta_block(self):
-        self.f_handle.seek(0)
-        meta_buf = self.f_handle.read(common_db.BLOCK_SIZE)
+        if global_buffer_pool.num_blocks(self.index_file_name) == 0:
+            meta_buf = b''
+        else:
+            meta_buf = global_buffer_pool.read_block(self.index_file_name, 0)
         if len(meta_buf) < struct.calcsize(META_BLOCK_HEADER_FORMAT):
             print("Warning: Meta block is too small. Re-initializing.")
             self._initialize_meta_block() # Re-initialize if corrupt or too small
@@ -158,18 +158,24 @@ class Index(object):
             struct.unpack_from(META_BLOCK_HEADER_FORMAT, meta_buf, 0)
         print(f"Meta loaded: HasRoot={self.has_root}, Levels={self.num_of_levels}, RootPtr={self.root_node_ptr}, NextBlockID={self.next_available_block_id}")
 
+    # the index file is removed when the records of the table are moved, see storage_db.drop_index()
+    def _dropped(self):
+        if self.open and not os.path.exists(self.index_file_name):
+            print(f"Error: Index file {self.index_file_name} has been dropped, the index must be created again.")
+            self.open = False
+        return not self.open
+
     # Haomin Wang: Helper to save meta block
     def _save_meta_block(self):
-        if not self.open:
+        if self._dropped():
             print("Error: Index file not open. Cannot save meta block.")
             return
         meta_buf = ctypes.create_string_buffer(common_db.BLOCK_SIZE)
         struct.pack_into(META_BLOCK_HEADER_FORMAT, meta_buf, 0,
                          self.meta_block_id, self.has_root, self.num_of_levels,
                          self.root_node_ptr, self.next_available_block_id)
-        self.f_handle.seek(0)
-        self.f_handle.write(meta_buf)
-        self.f_handle.flush()
+        global_buffer_pool.write_block(self.index_file_name, 0, meta_buf.raw)
+        global_buffer_pool.flush_file(self.index_file_name)
 
     # Haomin Wang: Allocate a new block for a B-tree node
     def _allocate_new_block_id(self):
@@ -182,8 +188,10 @@ class Index(object):
     def _read_node_block(self, block_id):
         if block_id == SPECIAL_INDEX_BLOCK_PTR or block_id < 1: # Block 0 is meta
             return None
-        self.f_handle.seek(block_id * common_db.BLOCK_SIZE)
-        node_buf = self.f_handle.read(common_db.BLOCK_SIZE)
+        if block_id >= global_buffer_pool.num_blocks(self.index_file_name): # beyond the end of the file
+            node_buf = b''
+        else:
+            node_buf = global_buffer_pool.read_block(self.index_file_name, block_id)
         if len(node_buf) < NODE_HEADER_SIZE:
             print(f"Error: Block {block_id} is too small to be a node.")
             return None
@@ -194,9 +202,8 @@ class Index(object):
         if block_id == SPECIAL_INDEX_BLOCK_PTR or block_id < 1:
             print(f"Error: Cannot write to invalid block_id {block_id}")
             return
-        self.f_handle.seek(block_id * common_db.BLOCK_SIZE)
-        self.f_handle.write(node_buf)
-        self.f_handle.flush()
+        global_buffer_pool.write_block(self.index_file_name, block_id, bytes(node_buf))
+        global_buffer_pool.flush_file(self.index_file_name)
 
     # Haomin Wang: Helper to create a new B-tree node (in memory buffer)
     def _create_new_node_buffer(self, node_block_id, node_type, num_keys=0):
@@ -231,14 +238,12 @@ class Index(object):
     def __del__(self):
         print ("__del__ of ",Index.__name__)
         if self.open:
-            self._save_meta_block() # Haomin Wang: Ensure meta is saved on close
-            self.f_handle.close()
+            self._save_meta_block() # Haomin Wang: Ensure meta is saved on close, the blocks stay in the buffer pool
             self.open = False
 
     #-----------------------------
     # create index for all indexed items in one run
-    # This would typically read all data from the table and insert entries one by one.
-    # For now, this is a placeholder.
+    # all data of the table are read and the entries are inserted one by one
     #-----------------------------------
     def create_index(self, storage_obj, field_to_index_name):
         print (f'create_index for field {field_to_index_name} begins to execute')
@@ -253,34 +258,15 @@ class Index(object):
         if field_idx == -1:
             print(f"Error: Field '{field_to_index_name}' not found in table schema.")
             return
+        if storage_obj.partition_spec is not None:
+            print("Error: the row identifiers of a partitioned table include the partition, it can not be indexed.")
+            return
 
-        # 2. Iterate over all records in the table (via storage_obj)
-        #    For each record, get the value of the field to be indexed.
-        #    And get its location (block_id in .dat file, offset/entry_id in that block)
-        #    This part needs storage_obj to provide record location info if possible,
-        #    or we assume (block_id, offset_in_block) for data records are known.
-        #    For simplicity, let's assume storage_obj.getRecordWithLocation() gives [(record_tuple, (dat_block_id, offset_in_dat_block))]
-
-        # This is a simplified loop assuming records have a fixed structure.
-        # The (data_block_id, record_offset_in_data_block) needs to be systematically obtained.
-        # For now, using a placeholder for data_block_id and record_offset.
-        all_records = storage_obj.getRecord() # list of tuples
-        # We need a way to associate each record with its actual storage location (block, offset)
-        # Let's assume for this example, the 'offset' is just the record's index in the list for simplicity,
-        # and 'block_id' is a placeholder. This needs to be replaced with actual .dat file locations.
-
-        for i, record_tuple in enumerate(all_records):
+        # 2. Iterate over all records in the table together with their row identifiers,
+        #    the (block id, slot) of a record is stored as its data pointer in the leaf
+        for ((data_block_id, slot), record_tuple) in storage_obj.scan_with_rid():
             key_value = record_tuple[field_idx] # Get the value of the indexed field
-            # Placeholder for data location: (dat_file_block_id, offset_of_record_in_that_block)
-            # This needs to be correctly retrieved from how storage_db.py stores records.
-            # If storage_db.py's self.record_Position = [(block_num_in_dat, record_index_in_block_offsets)]
-            # and each block in .dat has its own offsets table.
-            # This is a complex part depending on storage_db.py structure.
-            # For now, let's use (placeholder_block_id=1, placeholder_offset=i)
-            data_block_id_in_dat_file = 1 # Placeholder
-            offset_of_record_in_dat_block = i # Placeholder
-
-            self.insert_index_entry(key_value, data_block_id_in_dat_file, offset_of_record_in_dat_block)
+            self.insert_index_entry(key_value, data_block_id, slot)
 
         print(f"Finished creating index for {field_to_index_name}")
 
@@ -347,6 +333,8 @@ class Index(object):
     #--------------------------------------
     def insert_index_entry(self, key_value, data_block_id, data_offset):
         print(f"insert_index_entry: key='{key_value}', data_loc=({data_block_id},{data_offset})")
+        if self._dropped():
+            return
 
         formatted_key = self._format_key(key_value) # Ensure key is in standard byte format
 
@@ -513,6 +501,8 @@ class Index(object):
     # Haomin Wang: Search for a key, returns list of (data_block_id, data_offset_in_block)
     def search_key(self, key_value):
         print(f"Searching for key: {key_value}")
+        if self._dropped():
+            return []
         if not self.has_root:
             print("Search failed: B-tree is empty.")
             return []
@@ -567,6 +557,18 @@ class Index(object):
         print("Search Error: Reached max tree depth without finding a leaf node (should not happen in a consistent B-tree).")
         return []
 
+    #-----------------------------
+    # search for a key and read the records it points to
+    # input
+    #       storage_obj: the Storage of the indexed table
+    #       key_value: the value of the indexed field
+    # output
+    #       the list of records, only the data blocks which hold them are read
+    #-----------------------------------
+    def fetch_records(self, storage_obj, key_value):
+        rids = self.search_key(key_value)
+        return [record for (rid, record) in storage_obj.fetch_by_rid(rids)]
+
 
 # the following is to test
 if __name__ == '__main__':
@@ -21,6 +21,10 @@ tokens=('SELECT','FROM','WHERE','AND', 'OR', # Haomin Wang: Added OR
         'ASTERISK' # Haomin Wang: Added token for *
         )
 
+# import, export and to are no reserved words: they are lexed as TCNAME and only the parser
+# takes them as keywords at the head of IMPORT and EXPORT statements (see parser_db.py),
+# so that the tables and columns named after them keep working
+
 # the following is to defining rules for each token
 def t_SELECT(t):
     r'select' # Haomin Wang: Made case-insensitive
@@ -58,8 +62,6 @@ def t_TCNAME(t):
     r'[a-zA-Z_][a-zA-Z_0-9]*' # Haomin Wang: More standard identifier rule
     # Haomin Wang: Check for keywords, this is important if keywords can also be identifiers.
     # For this project, assuming SELECT, FROM, WHERE, AND, OR are reserved.
-    # If not, additional logic would be needed here.
-    # t.type = reserved.get(t.value.lower(),'TCNAME') # Example if there was a reserved map
     return t
 
 def t_COMMA(t):
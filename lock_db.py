@@ -0,0 +1,354 @@
+# -----------------------------------------------------------------------
+# lock_db.py
+# -----------------------------------------------------------------------
+# the module implements the lock manager of the transactions (strict two-phase locking).
+# The locks are taken on three levels: a table, a data block (page) of the table
+# and a record (row) of the block; before a page or a row is locked, its table
+# (and page) get the intention lock of the mode, e.g. a row X lock takes IX on
+# its table and page. The locks of a transaction are kept until it commits or aborts.
+#       IS, IX      the transaction reads or writes some records below the resource
+#       S, X        shared and exclusive lock of the resource and everything below it
+#       SIX         S and IX together, e.g. a table which is read whole and partly written
+# A transaction which holds more than LOCK_ESCALATION_ROWS row locks of one table gets
+# one table lock instead of them (lock escalation) if no other transaction is in the way.
+# A request which has to wait adds the edges to the transactions it waits for to the
+# wait-for graph; if the edges close a cycle the requester is chosen as the victim (DeadlockError),
+# and it gives up after LOCK_TIMEOUT seconds (LockTimeoutError); the caller then aborts the transaction.
+# Besides the locks a block which is being changed is latched (see latch()), so that the
+# writers never see the half-changed block of another writer; a latch is held only for the change.
+# -----------------------------------------------------------------------
+
+# structure of the lock table
+# ----------------------------------------
+# resource -> granted                 # trans id -> mode, the transactions which hold the resource
+#          -> queue                   # [(trans id, mode)], the waiting requests in the order of their arrival
+# held: trans id -> {resource: mode}  # the locks of each transaction, they are released together
+# -------------------------------------------
+# a resource is ('T', table), ('P', table, block id) or ('R', table, block id, slot)
+
+import os
+import threading
+import time
+import common_db
+
+LOCK_IS = 'IS'
+LOCK_IX = 'IX'
+LOCK_S = 'S'
+LOCK_SIX = 'SIX'
+LOCK_X = 'X'
+
+# the modes which can be held by two transactions at the same time
+COMPATIBLE = {
+    LOCK_IS: {LOCK_IS, LOCK_IX, LOCK_S, LOCK_SIX},
+    LOCK_IX: {LOCK_IS, LOCK_IX},
+    LOCK_S: {LOCK_IS, LOCK_S},
+    LOCK_SIX: {LOCK_IS},
+    LOCK_X: set(),
+}
+
+# the weakest mode which is at least as strong as both modes, for a transaction which locks a resource again
+SUPREMUM = {
+    (LOCK_IS, LOCK_IS): LOCK_IS, (LOCK_IS, LOCK_IX): LOCK_IX, (LOCK_IS, LOCK_S): LOCK_S,
+    (LOCK_IS, LOCK_SIX): LOCK_SIX, (LOCK_IX, LOCK_IX): LOCK_IX, (LOCK_IX, LOCK_S): LOCK_SIX,
+    (LOCK_IX, LOCK_SIX): LOCK_SIX, (LOCK_S, LOCK_S): LOCK_S, (LOCK_S, LOCK_SIX): LOCK_SIX,
+    (LOCK_SIX, LOCK_SIX): LOCK_SIX,
+}
+
+INTENTION = {LOCK_IS: LOCK_IS, LOCK_S: LOCK_IS, LOCK_IX: LOCK_IX, LOCK_SIX: LOCK_IX, LOCK_X: LOCK_IX}
+
+
+# ------------------------------
+# the mode which covers both modes
+# -------------------------------------
+def supremum(mode_a, mode_b):
+    if LOCK_X in (mode_a, mode_b):
+        return LOCK_X
+    return SUPREMUM.get((mode_a, mode_b)) or SUPREMUM[(mode_b, mode_a)]
+
+
+# ------------------------------
+# whether a resource held in mode held needs no lock of mode wanted below it
+# -------------------------------------
+def covers(held, wanted):
+    return held == LOCK_X or (held in (LOCK_S, LOCK_SIX) and wanted in (LOCK_S, LOCK_IS))
+
+
+# ------------------------------
+# the name of a table in the resources, e.g. 'student.dat'
+# -------------------------------------
+def table_key(file_name):
+    return os.fsdecode(file_name)
+
+
+class DeadlockError(RuntimeError):
+    pass
+
+
+class LockTimeoutError(RuntimeError):
+    pass
+
+
+# --------------------------------------------
+# the lock manager, one object is shared by all the transactions
+# --------------------------------------------
+class LockManager(object):
+
+    # ------------------------------
+    # constructor of the class
+    # input:
+    #       timeout: the seconds a request waits at most, None to wait without limit
+    #       escalation_rows: the number of row locks of one table after which the table is locked instead
+    # -------------------------------------
+    def __init__(self, timeout=common_db.LOCK_TIMEOUT, escalation_rows=common_db.LOCK_ESCALATION_ROWS):
+        self.timeout = timeout
+        self.escalation_rows = escalation_rows
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)  # notified when locks are released or requests give up
+        self.granted = {}  # resource -> {trans id: mode}
+        self.queue = {}  # resource -> [(trans id, mode)]
+        self.held = {}  # trans id -> {resource: mode}
+        self.row_counts = {}  # (trans id, table) -> number of row locks, for the lock escalation
+        self.waiting = {}  # trans id -> (resource, mode) of the request it waits for
+        self.latches = {}  # (table, block id) -> RLock, see latch()
+
+        self.requests = 0
+        self.waits = 0
+        self.deadlocks = 0
+        self.timeouts = 0
+        self.escalations = 0
+
+    # ------------------------------
+    # lock a table
+    # input:
+    #       trans_id, file_name: the transaction and the table file, e.g. b'student.dat'
+    #       mode: LOCK_IS, LOCK_IX, LOCK_S, LOCK_SIX or LOCK_X
+    #       wait: False if the request gives up at once when it would have to wait
+    # output:
+    #       True if the lock is granted, False if wait is False and it is not
+    # -------------------------------------
+    def lock_table(self, trans_id, file_name, mode, wait=True):
+        return self._acquire(trans_id, ('T', table_key(file_name)), mode, wait)
+
+    # ------------------------------
+    # lock a data block, its table gets the intention lock first
+    # -------------------------------------
+    def lock_page(self, trans_id, file_name, block_id, mode, wait=True):
+        table = table_key(file_name)
+        if self._covered(trans_id, [('T', table)], mode):
+            return True
+        return self._acquire(trans_id, ('T', table), INTENTION[mode], wait) and \
+            self._acquire(trans_id, ('P', table, block_id), mode, wait)
+
+    # ------------------------------
+    # lock a record, its table and its page get the intention locks first
+    # -------------------------------------
+    def lock_row(self, trans_id, file_name, block_id, slot, mode, wait=True):
+        table = table_key(file_name)
+        if self._covered(trans_id, [('T', table), ('P', table, block_id)], mode):
+            return True
+        resource = ('R', table, block_id, slot)
+        new_row = resource not in self.held.get(trans_id, {})
+        if not (self._acquire(trans_id, ('T', table), INTENTION[mode], wait) and
+                self._acquire(trans_id, ('P', table, block_id), INTENTION[mode], wait) and
+                self._acquire(trans_id, resource, mode, wait)):
+            return False
+        if new_row:
+            with self.lock:
+                count = self.row_counts.get((trans_id, table), 0) + 1
+                self.row_counts[(trans_id, table)] = count
+            if self.escalation_rows and count > self.escalation_rows:
+                self._escalate(trans_id, table)
+        return True
+
+    # ------------------------------
+    # whether the transaction holds a lock above the resource which covers the mode
+    # -------------------------------------
+    def _covered(self, trans_id, ancestors, mode):
+        with self.lock:
+            held = self.held.get(trans_id, {})
+            return any(covers(held[resource], mode) for resource in ancestors if resource in held)
+
+    # ------------------------------
+    # replace the row and page locks of a table by one table lock, it never waits:
+    # the row locks are kept if another transaction also holds locks of the table
+    # -------------------------------------
+    def _escalate(self, trans_id, table):
+        with self.lock:
+            held = self.held.get(trans_id, {})
+            exclusive = any(resource[0] == 'R' and resource[1] == table and mode == LOCK_X
+                            for (resource, mode) in held.items())
+        if not self._acquire(trans_id, ('T', table), LOCK_X if exclusive else LOCK_S, wait=False):
+            return False
+        with self.lock:
+            held = self.held.get(trans_id, {})
+            for resource in [resource for resource in held if resource[0] in ('P', 'R') and resource[1] == table]:
+                del held[resource]
+                granted = self.granted.get(resource)
+                if granted is not None:
+                    granted.pop(trans_id, None)
+                    if not granted:
+                        del self.granted[resource]
+            self.row_counts.pop((trans_id, table), None)
+            self.escalations += 1
+            self.changed.notify_all()
+        print(f"Locks of transaction {trans_id} on {table} have been escalated to a table lock")
+        return True
+
+    # ------------------------------
+    # grant the lock of one resource or wait until it can be granted
+    # -------------------------------------
+    def _acquire(self, trans_id, resource, mode, wait=True):
+        with self.lock:
+            self.requests += 1
+            held = self.held.setdefault(trans_id, {})
+            if resource in held:
+                mode = supremum(held[resource], mode)
+                if mode == held[resource]:
+                    return True
+            if self._grantable(trans_id, resource, mode):
+                self._grant(trans_id, resource, mode)
+                return True
+            if not wait:
+                return False
+
+            self.waits += 1
+            request = (trans_id, mode)
+            self.queue.setdefault(resource, []).append(request)
+            self.waiting[trans_id] = (resource, mode)
+            deadline = None if self.timeout is None else time.time() + self.timeout
+            try:
+                while True:
+                    if self._grantable(trans_id, resource, mode):
+                        self._grant(trans_id, resource, mode)
+                        return True
+                    if self._in_cycle(trans_id):
+                        self.deadlocks += 1
+                        raise DeadlockError(f"transaction {trans_id} is chosen as the victim of a deadlock "
+                                            f"on {resource}")
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        self.timeouts += 1
+                        raise LockTimeoutError(f"transaction {trans_id} has waited {self.timeout}s "
+                                               f"for the {mode} lock of {resource}")
+                    self.changed.wait(remaining)
+            finally:
+                self.queue[resource].remove(request)
+                if not self.queue[resource]:
+                    del self.queue[resource]
+                del self.waiting[trans_id]
+                self.changed.notify_all()  # the requests behind it may be granted now
+
+    # ------------------------------
+    # whether the mode is compatible with the locks of the other transactions and with
+    # the requests which have waited longer (a transaction which converts its lock does not queue)
+    # -------------------------------------
+    def _grantable(self, trans_id, resource, mode):
+        for (other, other_mode) in self.granted.get(resource, {}).items():
+            if other != trans_id and other_mode not in COMPATIBLE[mode]:
+                return False
+        if resource in self.held.get(trans_id, {}):
+            return True
+        for (other, other_mode) in self.queue.get(resource, []):
+            if other == trans_id:
+                break
+            if other_mode not in COMPATIBLE[mode] or mode not in COMPATIBLE[other_mode]:
+                return False
+        return True
+
+    def _grant(self, trans_id, resource, mode):
+        self.granted.setdefault(resource, {})[trans_id] = mode
+        self.held.setdefault(trans_id, {})[resource] = mode
+
+    # ------------------------------
+    # the transactions the waiting transaction waits for (the edges of the wait-for graph)
+    # -------------------------------------
+    def _waits_for(self, trans_id):
+        resource, mode = self.waiting[trans_id]
+        blockers = set(other for (other, other_mode) in self.granted.get(resource, {}).items()
+                       if other != trans_id and other_mode not in COMPATIBLE[mode])
+        for (other, other_mode) in self.queue.get(resource, []):
+            if other == trans_id:
+                break
+            if other_mode not in COMPATIBLE[mode] or mode not in COMPATIBLE[other_mode]:
+                blockers.add(other)
+        return blockers
+
+    # ------------------------------
+    # whether the waiting transaction is in a cycle of the wait-for graph
+    # -------------------------------------
+    def _in_cycle(self, trans_id):
+        stack = list(self._waits_for(trans_id))
+        visited = set()
+        while stack:
+            other = stack.pop()
+            if other == trans_id:
+                return True
+            if other in visited or other not in self.waiting:
+                continue
+            visited.add(other)
+            stack.extend(self._waits_for(other))
+        return False
+
+    # ------------------------------
+    # release all the locks of the transaction, it has committed or aborted
+    # -------------------------------------
+    def release_all(self, trans_id):
+        with self.lock:
+            for resource in self.held.pop(trans_id, {}):
+                granted = self.granted.get(resource)
+                if granted is not None:
+                    granted.pop(trans_id, None)
+                    if not granted:
+                        del self.granted[resource]
+            for key in [key for key in self.row_counts if key[0] == trans_id]:
+                del self.row_counts[key]
+            self.changed.notify_all()
+
+    # ------------------------------
+    # the latch of a data block, it is held while the block is changed
+    # output:
+    #       a reentrant lock to be used in a with statement
+    # -------------------------------------
+    def latch(self, file_name, block_id):
+        key = (table_key(file_name), block_id)
+        with self.lock:
+            latch = self.latches.get(key)
+            if latch is None:
+                latch = threading.RLock()
+                self.latches[key] = latch
+            return latch
+
+    # ------------------------------
+    # forget the latches of a table, e.g. it is dropped
+    # -------------------------------------
+    def drop_latches(self, file_name):
+        table = table_key(file_name)
+        with self.lock:
+            for key in [key for key in self.latches if key[0] == table]:
+                del self.latches[key]
+
+    # ------------------------------
+    # the locks held by the transaction
+    # -------------------------------------
+    def get_locks(self, trans_id):
+        with self.lock:
+            return dict(self.held.get(trans_id, {}))
+
+    # ------------------------------
+    # return the counters of the lock manager
+    # -------------------------------------
+    def get_stats(self):
+        with self.lock:
+            return {
+                'locks': sum(len(granted) for granted in self.granted.values()),
+                'waiting': len(self.waiting),
+                'requests': self.requests,
+                'waits': self.waits,
+                'deadlocks': self.deadlocks,
+                'timeouts': self.timeouts,
+                'escalations': self.escalations,
+            }
+
+
+# the lock manager shared by all the transactions
+global_lock_manager = LockManager()
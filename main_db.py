@@ -12,6 +12,7 @@ import struct
 import sys
 import ctypes
 import os
+import itertools
 
 import head_db  # the main memory structure of table schema
 import schema_db  # the module to process table schema
@@ -22,13 +23,16 @@ import lex_db  # for lex, where data is stored in binary format
 import parser_db  # for yacc, where ddata is tored in binary format
 import common_db  # the global variables, functions, constants in the program
 import query_plan_db  # construct the query plan and execute it # Haomin Wang: Ensured this is present
+import bulk_db  # IMPORT and EXPORT statements
 import transaction_db
 from transaction_db import global_transaction_manager
+from lock_db import global_lock_manager
+from buffer_db import global_buffer_pool
 
 PROMPT_STR = 'Input your choice  \n1:add a new table structure and data \n2:delete a table structure and data\
 \n3:view a table structure and data \n4:delete all tables and data \n5:select from where clause\
 \n6:delete a row according to field keyword \n7:update a row according to field keyword \n8:transaction management\
-\n. to quit):\n'
+\n9:vacuum a table \n. to quit):\n'
 
 
 # --------------------------
@@ -185,7 +189,7 @@ def main():
                 if schemaObj.find_table(table_name.strip()):
                     schemaObj.viewTableStructure(table_name)  # to be implemented
 
-                    dataObj = storage_db.Storage(table_name)  # create an object for the data of table
+                    dataObj = storage_db.open_table(table_name)  # the shared handle of the table
                     dataObj.show_table_data()  # view all the data of the table
                     del dataObj
                 else:
@@ -214,7 +218,7 @@ def main():
 
         elif choice == '5':  # process SELECT FROM WHERE clause
             print('#        Your Query is to SQL QUERY                  #')
-            sql_str = input('please enter the select from where clause:')
+            sql_str = input('please enter the select from where clause, IMPORT or EXPORT statement:')
             lex_db.set_lex_handle()  # to set the global_lexer in common_db.py
             parser_db.set_handle()  # to set the global_parser in common_db.py
 
@@ -222,8 +226,11 @@ def main():
                 common_db.global_syn_tree = common_db.global_parser.parse(sql_str.strip(),
                                                                           lexer=common_db.global_lexer)  # construct the global_syn_tree
                 # reload(query_plan_db) # Haomin Wang: This was commented out as per readme for Python 3.x
-                query_plan_db.construct_logical_tree()  # Haomin Wang: Construct the logical query plan
-                query_plan_db.execute_logical_tree()  # Haomin Wang: Execute the logical query plan
+                if common_db.global_syn_tree is not None and common_db.global_syn_tree.value in bulk_db.STATEMENTS:
+                    bulk_db.execute_statement(common_db.global_syn_tree, current_transaction_id)  # IMPORT or EXPORT
+                else:
+                    query_plan_db.construct_logical_tree()  # Haomin Wang: Construct the logical query plan
+                    query_plan_db.execute_logical_tree(current_transaction_id)  # Haomin Wang: Execute the logical query plan
             except Exception as e:  # Haomin Wang: Added exception handling to print the error
                 print(f'WRONG SQL INPUT! Error: {e}')
             print('#----------------------------------------------------#')
@@ -298,10 +305,11 @@ def main():
                     try:
                         # 2. 创建存储对象并显示表内容
                         dataObj = storage_db.Storage(table_name)
-                        records = dataObj.getRecord()
+                        records = dataObj.scan()  # the records are read block by block, not kept in a list
                         field_list = dataObj.getFieldList()
 
-                        if not records:
+                        first_record = next(records, None)
+                        if first_record is None:
                             print("Table is empty!")
                             continue
 
@@ -309,8 +317,10 @@ def main():
                         print("\nCurrent records in table:")
                         print("Record #  |  " + "  |  ".join(f.decode('utf-8').strip() for f, _, _ in field_list))
                         print("-" * 80)
-                        for idx, record in enumerate(records):
+                        num_records = 0
+                        for idx, record in enumerate(itertools.chain([first_record], records)):
                             print(f"{idx:<9}|  " + "  |  ".join(str(v) for v in record))
+                            num_records += 1
 
                         # 4. 选择要修改的记录
                         while True:
@@ -318,13 +328,15 @@ def main():
                                 record_idx = int(input('\nEnter the record number to modify (or -1 to cancel): '))
                                 if record_idx == -1:
                                     break
-                                if 0 <= record_idx < len(records):
+                                if 0 <= record_idx < num_records:
+                                    # the chosen record is read again by scanning up to it
+                                    selected_record = next(itertools.islice(dataObj.scan(), record_idx, None))
                                     # 5. 显示选中记录的字段
                                     print("\nSelected record fields:")
                                     for idx, (field_name_bytes, field_type, _) in enumerate(
                                             field_list):  # Haomin Wang: Renamed field_name to field_name_bytes
                                         type_str = ["STRING", "VARSTRING", "INTEGER", "BOOLEAN"][field_type]
-                                        current_value = records[record_idx][idx]
+                                        current_value = selected_record[idx]
                                         print(
                                             f"{idx}. {field_name_bytes.decode('utf-8').strip()} ({type_str}): {current_value}")  # Haomin Wang: Used field_name_bytes
 
@@ -338,7 +350,7 @@ def main():
                                             'utf-8').strip()  # Haomin Wang: Renamed field_name to field_name_to_update
                                         field_type_to_update = field_list[field_idx][
                                             1]  # Haomin Wang: Renamed field_type to field_type_to_update
-                                        old_value = str(records[record_idx][field_idx])
+                                        old_value = str(selected_record[field_idx])
 
                                         # 7. 获取并验证新值
                                         type_str_update = ["STRING", "VARSTRING", "INTEGER", "BOOLEAN"][
@@ -411,9 +423,29 @@ def main():
                 print(f"Current transaction: {current_transaction_id}")
                 print(f"Active transactions: {global_transaction_manager.get_active_transactions()}")
                 print(f"Committed transactions: {global_transaction_manager.get_committed_transactions()}")
+                print(f"Write-ahead log: {global_transaction_manager.get_log_stats()}")
+                print(f"Locks: {global_lock_manager.get_stats()}")
+                print(f"Buffer pool: {global_buffer_pool.get_stats()}")
             
             choice = input(PROMPT_STR)
 
+        elif choice == '9':  # VACUUM table: give back the space of the deleted records
+            table_name = input('Please input the table name: ').encode('utf-8')
+            if schemaObj.find_table(table_name.strip()):
+                dataObj = storage_db.open_table(table_name)  # the shared handle of the table
+                try:
+                    dataObj.set_transaction(current_transaction_id)
+                    dataObj.vacuum()
+                except Exception as e:
+                    print(f'Error during vacuum: {str(e)}')
+                finally:
+                    dataObj.set_transaction(None)
+                    dataObj = None
+            else:
+                print(f'Error: Table "{table_name.decode()}" not found!')
+
+            choice = input(PROMPT_STR)
+
         elif choice == '.':
             # Cleanup: abort any active transaction before exiting
             if current_transaction_id:
@@ -0,0 +1,505 @@
+# -----------------------------------------------------------------------
+# page_db.py
+# -----------------------------------------------------------------------
+# the module manages the records inside one data block (slotted page)
+# and the free space map of a table.
+# the functions work on the frames of the buffer pool, i.e. bytearrays of
+# BLOCK_SIZE bytes; the read-only functions also accept a memory map of
+# the whole file together with the position (base) of the block in it.
+# -----------------------------------------------------------------------
+
+# structure of data block (see also storage_db.py)
+# ----------------------------------------
+# block_id
+# number of slots           # including the free slots
+# slot_0_offset             # offset of record_0 in the block, FREE_SLOT if the record is deleted
+# slot_1_offset
+# ...
+# slot_n_offset
+# free space
+# records                   # packed from the end of the block, in any order
+# -------------------------------------------
+# a deleted record only gets the tombstone bit in the pointer of its head, its space
+# is given back by purge_page() (see vacuum_db.py); the slot numbers of the other records
+# never change, so (block id, slot) identifies a record until the table is vacuumed or rebuilt
+
+# structure of the version of a record, it is kept in the time stamp field of the record head
+# ----------------------------------------
+# creator                   # the transaction which inserted the record, 0 if it was not inserted in a transaction
+# deleter                   # the transaction which set the tombstone bit, 0 if none
+# RECORD_VERSION_MARK       # the records written before the versions have a date here, they are seen by everyone
+# -------------------------------------------
+# a reader with a snapshot (see Snapshot) sees the records whose creator it sees,
+# unless it also sees their deleter; the readers without a snapshot see the records without tombstone bit
+
+# structure of the free space map file <table>.fsm
+# ----------------------------------------
+# free_bytes_of_block_1     # unsigned short, one entry per data block
+# free_bytes_of_block_2
+# ...
+# -------------------------------------------
+
+import struct
+import zlib
+from common_db import BLOCK_SIZE
+from buffer_db import global_buffer_pool
+
+PAGE_HEAD_FORMAT = '!ii'  # block_id, number of slots
+PAGE_HEAD_LEN = struct.calcsize(PAGE_HEAD_FORMAT)
+SLOT_FORMAT = '!i'
+SLOT_LEN = struct.calcsize(SLOT_FORMAT)
+FREE_SLOT = -1
+
+RECORD_HEAD_FORMAT = '!ii10s'  # pointer, length of record content, time stamp
+RECORD_HEAD_LEN = struct.calcsize(RECORD_HEAD_FORMAT)
+RECORD_TOMBSTONE = 0x40000000  # the bit in the pointer of a deleted record
+RECORD_VERSION_FORMAT = '!ii2s'  # creator, deleter, mark; the 10 bytes of the time stamp
+RECORD_VERSION_OFFSET = struct.calcsize('!ii')  # after the pointer and the length of the record
+RECORD_VERSION_MARK = b'MV'
+
+FSM_ENTRY_FORMAT = '!H'
+FSM_ENTRY_LEN = struct.calcsize(FSM_ENTRY_FORMAT)
+FSM_ENTRIES_PER_BLOCK = BLOCK_SIZE // FSM_ENTRY_LEN
+
+
+# ------------------------------
+# the number of slots in the block
+# -------------------------------------
+def num_slots(buf, base=0):
+    return struct.unpack_from('!i', buf, base + struct.calcsize('!i'))[0]
+
+
+# ------------------------------
+# the offset of the record in the slot, FREE_SLOT if the slot is free
+# -------------------------------------
+def slot_offset(buf, slot, base=0):
+    return struct.unpack_from(SLOT_FORMAT, buf, base + PAGE_HEAD_LEN + slot * SLOT_LEN)[0]
+
+
+# ------------------------------
+# the whole length of the record (head and content) which begins at offset
+# -------------------------------------
+def record_len(buf, offset, base=0):
+    return RECORD_HEAD_LEN + struct.unpack_from('!i', buf, base + offset + struct.calcsize('!i'))[0]
+
+
+# ------------------------------
+# whether the record which begins at offset has been deleted
+# -------------------------------------
+def is_tombstone(buf, offset, base=0):
+    return struct.unpack_from('!i', buf, base + offset)[0] & RECORD_TOMBSTONE != 0
+
+
+# ------------------------------
+# the slots of the block which hold a record, including the deleted records
+# output:
+#       a list of (slot, offset)
+# -------------------------------------
+def used_slots(buf, base=0):
+    result = []
+    for slot in range(num_slots(buf, base)):
+        offset = slot_offset(buf, slot, base)
+        if offset != FREE_SLOT:
+            result.append((slot, offset))
+    return result
+
+
+# ------------------------------
+# the slots of the block which hold a record that has not been deleted
+# output:
+#       a list of (slot, offset)
+# -------------------------------------
+def live_slots(buf, base=0):
+    return [(slot, offset) for (slot, offset) in used_slots(buf, base) if not is_tombstone(buf, offset, base)]
+
+
+# ------------------------------
+# the time stamp field of a new record
+# -------------------------------------
+def pack_version(creator, deleter=0):
+    return struct.pack(RECORD_VERSION_FORMAT, creator or 0, deleter or 0, RECORD_VERSION_MARK)
+
+
+# ------------------------------
+# the transactions which created and deleted the record which begins at offset
+# output:
+#       (creator, deleter), (0, 0) for a record without version
+# -------------------------------------
+def record_version(buf, offset, base=0):
+    creator, deleter, mark = struct.unpack_from(RECORD_VERSION_FORMAT, buf, base + offset + RECORD_VERSION_OFFSET)
+    if mark != RECORD_VERSION_MARK:
+        return 0, 0
+    return creator, deleter
+
+
+# ------------------------------
+# the slots of the block which hold a record that the snapshot sees
+# output:
+#       a list of (slot, offset)
+# -------------------------------------
+def visible_slots(buf, snapshot, base=0):
+    result = []
+    for (slot, offset) in used_slots(buf, base):
+        creator, deleter = record_version(buf, offset, base)
+        if not snapshot.sees(creator):
+            continue
+        if is_tombstone(buf, offset, base) and snapshot.sees(deleter):
+            continue
+        result.append((slot, offset))
+    return result
+
+
+# --------------------------------------------
+# the transactions whose records a reader sees, it is taken by the transaction manager
+# (see TransactionManager.get_snapshot()) and also given to the worker processes of a parallel scan
+# --------------------------------------------
+class Snapshot(object):
+
+    # ------------------------------
+    # constructor of the class
+    # input:
+    #       trans_id: the transaction of the reader, it sees its own records; None for a reader without transaction
+    #       next_id: the transactions from this id on have begun after the snapshot
+    #       active: the transactions which were active when the snapshot was taken; an aborted transaction
+    #               has taken back all its records before it was no longer active
+    # -------------------------------------
+    def __init__(self, trans_id, next_id, active):
+        self.trans_id = trans_id
+        self.next_id = next_id
+        self.active = frozenset(active)
+
+    # ------------------------------
+    # whether the changes of the transaction are seen, i.e. it committed before the snapshot
+    # -------------------------------------
+    def sees(self, trans_id):
+        if trans_id == 0 or trans_id == self.trans_id:
+            return True
+        return trans_id < self.next_id and trans_id not in self.active
+
+
+# ------------------------------
+# the number of deleted records whose space has not been given back
+# -------------------------------------
+def num_tombstones(buf, base=0):
+    return sum(1 for (slot, offset) in used_slots(buf, base) if is_tombstone(buf, offset, base))
+
+
+# ------------------------------
+# prepare an empty data block in the frame
+# -------------------------------------
+def init_page(buf, block_id):
+    buf[:] = bytes(BLOCK_SIZE)
+    struct.pack_into(PAGE_HEAD_FORMAT, buf, 0, block_id, 0)
+
+
+# ------------------------------
+# whether a record of the given length fits into a new block together with the records
+# which are already chosen for it (see build_page())
+# input:
+#       num_records, used_bytes: the number and the whole length of the chosen records
+# -------------------------------------
+def page_fits(num_records, used_bytes, length):
+    return PAGE_HEAD_LEN + (num_records + 1) * SLOT_LEN + used_bytes + length <= BLOCK_SIZE
+
+
+# ------------------------------
+# build a data block which holds the records in the slots 0, 1, ... in one pass
+# output:
+#       the bytearray of the block
+# -------------------------------------
+def build_page(block_id, records):
+    buf = bytearray(BLOCK_SIZE)
+    struct.pack_into(PAGE_HEAD_FORMAT, buf, 0, block_id, len(records))
+    data_pos = BLOCK_SIZE
+    for (slot, record) in enumerate(records):
+        data_pos -= len(record)
+        buf[data_pos:data_pos + len(record)] = record
+        struct.pack_into(SLOT_FORMAT, buf, PAGE_HEAD_LEN + slot * SLOT_LEN, data_pos)
+    return buf
+
+
+# ------------------------------
+# the number of bytes which can still be used for records and slots
+# -------------------------------------
+def free_space(buf, base=0):
+    slots = used_slots(buf, base)
+    used = sum(record_len(buf, offset, base) for (slot, offset) in slots)
+    return BLOCK_SIZE - PAGE_HEAD_LEN - num_slots(buf, base) * SLOT_LEN - used
+
+
+# ------------------------------
+# move all the records to the end of the block, so that the free space is in one piece
+# the slot of each record is not changed
+# -------------------------------------
+def compact_page(buf):
+    records = []
+    for (slot, offset) in used_slots(buf):
+        length = record_len(buf, offset)
+        records.append((offset, slot, bytes(buf[offset:offset + length])))
+    records.sort(reverse=True)  # the records keep their order in the block
+
+    data_pos = BLOCK_SIZE
+    for (offset, slot, record) in records:
+        data_pos -= len(record)
+        buf[data_pos:data_pos + len(record)] = record
+        struct.pack_into(SLOT_FORMAT, buf, PAGE_HEAD_LEN + slot * SLOT_LEN, data_pos)
+    dir_end = PAGE_HEAD_LEN + num_slots(buf) * SLOT_LEN
+    buf[dir_end:data_pos] = bytes(data_pos - dir_end)
+
+
+# ------------------------------
+# to insert a record (head and content) into the block
+# output:
+#       the slot of the record, None if there is not enough space
+# -------------------------------------
+def insert_into_page(buf, record):
+    slots = num_slots(buf)
+    slot = None
+    for i in range(slots):
+        if slot_offset(buf, i) == FREE_SLOT:
+            slot = i
+            break
+    new_slots = slots + 1 if slot is None else slots
+    if free_space(buf) - (new_slots - slots) * SLOT_LEN < len(record):
+        return None
+
+    if slot is None:
+        slot = slots
+        _grow_directory(buf, new_slots)
+    _place_record(buf, slot, record)
+    return slot
+
+
+# ------------------------------
+# add free slots to the end of the directory, the block is compacted first
+# if a record begins where the new slots will be
+# -------------------------------------
+def _grow_directory(buf, new_slots):
+    slots = num_slots(buf)
+    data_begin = min([offset for (i, offset) in used_slots(buf)] + [BLOCK_SIZE])
+    if data_begin < PAGE_HEAD_LEN + new_slots * SLOT_LEN:
+        compact_page(buf)
+    for slot in range(slots, new_slots):
+        struct.pack_into(SLOT_FORMAT, buf, PAGE_HEAD_LEN + slot * SLOT_LEN, FREE_SLOT)
+    struct.pack_into('!i', buf, struct.calcsize('!i'), new_slots)
+
+
+# ------------------------------
+# put the record in front of the other records and point the free slot to it,
+# the block is compacted if the free space is not in one piece
+# -------------------------------------
+def _place_record(buf, slot, record):
+    dir_end = PAGE_HEAD_LEN + num_slots(buf) * SLOT_LEN
+    data_begin = min([offset for (i, offset) in used_slots(buf)] + [BLOCK_SIZE])
+    if data_begin - len(record) < dir_end:
+        compact_page(buf)
+        data_begin = min([offset for (i, offset) in used_slots(buf)] + [BLOCK_SIZE])
+
+    offset = data_begin - len(record)
+    buf[offset:offset + len(record)] = record
+    struct.pack_into(SLOT_FORMAT, buf, PAGE_HEAD_LEN + slot * SLOT_LEN, offset)
+
+
+# ------------------------------
+# to delete the record in the slot, the free slots at the end of the directory are removed
+# -------------------------------------
+def delete_from_page(buf, slot):
+    offset = slot_offset(buf, slot)
+    if offset == FREE_SLOT:
+        return False
+    length = record_len(buf, offset)
+    buf[offset:offset + length] = bytes(length)
+    struct.pack_into(SLOT_FORMAT, buf, PAGE_HEAD_LEN + slot * SLOT_LEN, FREE_SLOT)
+
+    slots = num_slots(buf)
+    while slots > 0 and slot_offset(buf, slots - 1) == FREE_SLOT:
+        slots -= 1
+        struct.pack_into(SLOT_FORMAT, buf, PAGE_HEAD_LEN + slots * SLOT_LEN, 0)
+    struct.pack_into('!i', buf, struct.calcsize('!i'), slots)
+    return True
+
+
+# ------------------------------
+# to delete the record in the slot by setting its tombstone bit, the record keeps its space
+# input:
+#       deleter: the transaction which deletes the record, it is kept in the version of the record
+# output:
+#       False if the slot holds no record
+# -------------------------------------
+def mark_deleted(buf, slot, deleter=0):
+    offset = slot_offset(buf, slot)
+    if offset == FREE_SLOT or is_tombstone(buf, offset):
+        return False
+    pointer = struct.unpack_from('!i', buf, offset)[0]
+    struct.pack_into('!i', buf, offset, pointer | RECORD_TOMBSTONE)
+    if deleter and buf[offset + RECORD_HEAD_LEN - len(RECORD_VERSION_MARK):offset + RECORD_HEAD_LEN] == RECORD_VERSION_MARK:
+        struct.pack_into('!i', buf, offset + RECORD_VERSION_OFFSET + struct.calcsize('!i'), deleter)
+    return True
+
+
+# ------------------------------
+# give back the space of the deleted records in the block
+# output:
+#       the number of records which have been removed
+# -------------------------------------
+def purge_page(buf):
+    removed = 0
+    for (slot, offset) in used_slots(buf):
+        if is_tombstone(buf, offset):
+            delete_from_page(buf, slot)
+            removed += 1
+    return removed
+
+
+# ------------------------------
+# to replace the record in the slot by a record of the same length
+# -------------------------------------
+def update_in_page(buf, slot, record):
+    offset = slot_offset(buf, slot)
+    if offset == FREE_SLOT or record_len(buf, offset) != len(record):
+        return False
+    buf[offset:offset + len(record)] = record
+    return True
+
+
+# ------------------------------
+# to replace the record in the slot by a record of any length, the slot is not changed
+# output:
+#       False if the new record does not fit into the block, the block is not changed then
+# -------------------------------------
+def replace_in_page(buf, slot, record):
+    offset = slot_offset(buf, slot)
+    if offset == FREE_SLOT:
+        return False
+    length = record_len(buf, offset)
+    if length == len(record):
+        buf[offset:offset + length] = record
+        return True
+    if free_space(buf) + length < len(record):
+        return False
+
+    buf[offset:offset + length] = bytes(length)
+    struct.pack_into(SLOT_FORMAT, buf, PAGE_HEAD_LEN + slot * SLOT_LEN, FREE_SLOT)
+    _place_record(buf, slot, record)
+    return True
+
+
+# ------------------------------
+# the record (head and content) in the slot, None if the slot is free
+# -------------------------------------
+def record_at(buf, slot, base=0):
+    if slot >= num_slots(buf, base):
+        return None
+    offset = slot_offset(buf, slot, base)
+    if offset == FREE_SLOT:
+        return None
+    return bytes(buf[base + offset:base + offset + record_len(buf, offset, base)])
+
+
+# ------------------------------
+# the slots whose record differs between two images of the same block
+# output:
+#       a list of (slot, record of the slot in old_buf or None)
+# -------------------------------------
+def changed_slots(old_buf, new_buf):
+    result = []
+    for slot in range(max(num_slots(old_buf), num_slots(new_buf))):
+        old_record = record_at(old_buf, slot)
+        if old_record != record_at(new_buf, slot):
+            result.append((slot, old_record))
+    return result
+
+
+# ------------------------------
+# to put the record into the slot, whatever the slot holds now; the slot is freed if
+# record is None. The records of the other slots are not changed (see the undo in transaction_db.py)
+# output:
+#       False if the record does not fit into the block, the block is not changed then
+# -------------------------------------
+def put_record(buf, slot, record):
+    slots = num_slots(buf)
+    if record is None:
+        if slot < slots:
+            delete_from_page(buf, slot)
+        return True
+    if slot < slots and slot_offset(buf, slot) != FREE_SLOT:
+        return replace_in_page(buf, slot, record)
+
+    new_slots = max(slots, slot + 1)
+    if free_space(buf) - (new_slots - slots) * SLOT_LEN < len(record):
+        return False
+    if new_slots > slots:
+        _grow_directory(buf, new_slots)
+    _place_record(buf, slot, record)
+    return True
+
+
+# ------------------------------
+# read and decompress one extent of a compressed table file (see Storage.compress())
+# input:
+#       f_handle: the table file opened in binary mode
+#       position, length: the place of the compressed extent in the file
+# output:
+#       the data blocks of the extent, one after another
+# -------------------------------------
+def read_extent(f_handle, position, length):
+    f_handle.seek(position)
+    return zlib.decompress(f_handle.read(length))
+
+
+# --------------------------------------------
+# the free space map of a table, it records the free bytes of each data block
+# so that an insert finds a block with enough space without reading the blocks
+# --------------------------------------------
+class FreeSpaceMap(object):
+
+    # ------------------------------
+    # constructor of the class
+    # input:
+    #       file_name: the name of the map file, e.g. b'student.fsm'
+    # -------------------------------------
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    def exists(self):
+        return global_buffer_pool.num_blocks(self.file_name) > 0
+
+    def get(self, block_id):
+        fsm_block, offset = divmod((block_id - 1) * FSM_ENTRY_LEN, BLOCK_SIZE)
+        if fsm_block >= global_buffer_pool.num_blocks(self.file_name):
+            return 0
+        fsm_buf = global_buffer_pool.pin(self.file_name, fsm_block)
+        free_bytes = struct.unpack_from(FSM_ENTRY_FORMAT, fsm_buf, offset)[0]
+        global_buffer_pool.unpin(self.file_name, fsm_block)
+        return free_bytes
+
+    def set(self, block_id, free_bytes):
+        fsm_block, offset = divmod((block_id - 1) * FSM_ENTRY_LEN, BLOCK_SIZE)
+        fsm_buf = global_buffer_pool.pin(self.file_name, fsm_block)
+        struct.pack_into(FSM_ENTRY_FORMAT, fsm_buf, offset, max(free_bytes, 0))
+        global_buffer_pool.unpin(self.file_name, fsm_block, dirty=True)
+
+    # ------------------------------
+    # find a data block with at least the given free bytes
+    # input:
+    #       needed: the number of free bytes
+    #       num_data_blocks: the number of data blocks of the table
+    # output:
+    #       the block id, None if no block has enough space
+    # -------------------------------------
+    def find(self, needed, num_data_blocks):
+        num_fsm_blocks = min(global_buffer_pool.num_blocks(self.file_name),
+                             (num_data_blocks + FSM_ENTRIES_PER_BLOCK - 1) // FSM_ENTRIES_PER_BLOCK)
+        for fsm_block in range(num_fsm_blocks):
+            fsm_buf = global_buffer_pool.pin(self.file_name, fsm_block)
+            try:
+                first = fsm_block * FSM_ENTRIES_PER_BLOCK
+                for i in range(min(FSM_ENTRIES_PER_BLOCK, num_data_blocks - first)):
+                    if struct.unpack_from(FSM_ENTRY_FORMAT, fsm_buf, i * FSM_ENTRY_LEN)[0] >= needed:
+                        return first + i + 1
+            finally:
+                global_buffer_pool.unpin(self.file_name, fsm_block)
+        return None
+
+    def flush(self):
+        global_buffer_pool.flush_file(self.file_name)
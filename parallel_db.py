@@ -0,0 +1,146 @@
+# -----------------------------------------------------------------------
+# parallel_db.py
+# -----------------------------------------------------------------------
+# the module scans the data blocks of a table in several processes
+# the blocks are split into ranges, each worker process decodes its ranges
+# from the table file and keeps the records which satisfy the condition,
+# the results are returned in the order of the blocks
+# the workers only import the modules below, they never open the log files
+# -----------------------------------------------------------------------
+
+# structure of a compiled condition (see query_plan_db.compile_condition)
+# ----------------------------------------
+# ('CMP', field index, operator, typed constant)
+# ('AND', condition, condition)
+# ('OR', condition, condition)
+# ('FALSE',)                          # e.g. the column is not found
+# -------------------------------------------
+
+import mmap
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from common_db import BLOCK_SIZE
+import codec_db
+import page_db
+import column_db
+
+RANGES_PER_WORKER = 4  # more ranges than workers, so that a slow range does not keep the others waiting
+
+_executor = None
+_executor_workers = 0
+
+
+# ------------------------------
+# whether the record satisfies the compiled condition
+# -------------------------------------
+def match_condition(condition, record):
+    kind = condition[0]
+    if kind == 'CMP':
+        return column_db.COMPARE_FUNCS[condition[2]](record[condition[1]], condition[3])
+    if kind == 'AND':
+        return match_condition(condition[1], record) and match_condition(condition[2], record)
+    if kind == 'OR':
+        return match_condition(condition[1], record) or match_condition(condition[2], record)
+    return False
+
+
+# ------------------------------
+# the work of one process: decode the blocks and filter their records
+# input:
+#       file_name: the table file, e.g. b'student.dat'
+#       field_list, binary, varlen: the schema and the format of the records, see codec_db.get_codec()
+#       block_ids: the data blocks to be read
+#       condition: a compiled condition or None
+#       extent_blocks, extents: the extent map of a compressed table, see Storage.compress()
+#       snapshot: a page_db.Snapshot, None for the records which are not deleted
+# output:
+#       the list of records in the order of the blocks
+# -------------------------------------
+def scan_blocks(file_name, field_list, binary, varlen, block_ids, condition, extent_blocks=0, extents=None,
+                snapshot=None):
+    codec = codec_db.get_codec(field_list, binary, varlen)
+    content_begin = page_db.RECORD_HEAD_LEN
+    records = []
+    with open(file_name, 'rb') as f_handle:
+        if extents:
+            file_map = None
+            extent_cache = (None, None)
+        else:
+            file_map = mmap.mmap(f_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for block_id in block_ids:
+                if extents:  # the block is in a compressed extent
+                    extent_no, index = divmod(block_id - 1, extent_blocks)
+                    if extent_cache[0] != extent_no:
+                        extent_cache = (extent_no, page_db.read_extent(f_handle, *extents[extent_no]))
+                    buf, base = extent_cache[1], index * BLOCK_SIZE
+                else:
+                    buf, base = file_map, block_id * BLOCK_SIZE
+                if snapshot is None:
+                    used = page_db.live_slots(buf, base)
+                else:
+                    used = page_db.visible_slots(buf, snapshot, base)
+                for (slot, offset) in used:
+                    record = codec.decode(buf, base + offset + content_begin)
+                    if condition is None or match_condition(condition, record):
+                        records.append(record)
+        finally:
+            if file_map is not None:
+                file_map.close()
+    return records
+
+
+# ------------------------------
+# the pool of worker processes, it is created once and kept for the following scans
+# -------------------------------------
+def get_executor(workers):
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers != workers:
+        shutdown()
+        _executor = ProcessPoolExecutor(max_workers=workers)
+        _executor_workers = workers
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+atexit.register(shutdown)
+
+
+# ------------------------------
+# split the blocks into contiguous ranges
+# -------------------------------------
+def split_blocks(block_ids, num_ranges):
+    num_ranges = max(1, min(num_ranges, len(block_ids)))
+    size, extra = divmod(len(block_ids), num_ranges)
+    ranges = []
+    begin = 0
+    for i in range(num_ranges):
+        end = begin + size + (1 if i < extra else 0)
+        ranges.append(block_ids[begin:end])
+        begin = end
+    return ranges
+
+
+# ------------------------------
+# scan the blocks in several processes, the file must have been flushed
+# output:
+#       a generator of the records in the order of the blocks
+# -------------------------------------
+def parallel_scan(file_name, field_list, binary, varlen, block_ids, condition, workers, extent_blocks=0, extents=None,
+                  snapshot=None):
+    if not block_ids:
+        return
+    executor = get_executor(workers)
+    ranges = split_blocks(list(block_ids), workers * RANGES_PER_WORKER)
+    futures = [executor.submit(scan_blocks, file_name, list(field_list), bool(binary), bool(varlen), block_range,
+                               condition, extent_blocks, list(extents or []), snapshot)
+               for block_range in ranges]
+    for future in futures:
+        for record in future.result():
+            yield record
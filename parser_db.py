@@ -20,6 +20,8 @@ from lex_db import tokens
 # Grammar Rules:
 # Query    : SELECT SelList FROM FromList WHERE Cond
 # Query    : SELECT SelList FROM FromList  // Haomin Wang: Added for queries without WHERE
+# Query    : TCNAME TCNAME FROM STRING_CONST    // IMPORT table FROM 'file', see bulk_db.py
+# Query    : TCNAME TCNAME TCNAME STRING_CONST  // EXPORT table TO 'file'
 #
 # SelList  : TCNAME COMMA SelList
 # SelList  : TCNAME
@@ -93,6 +95,30 @@ def p_expr_query_no_where(p):
     check_syn_tree(common_db.global_syn_tree)
     # common_db.show(common_db.global_syn_tree)
 
+#------------------------------
+# construct the node for IMPORT and EXPORT statements
+# the root node is Node('IMPORT' or 'EXPORT', [table name, file name])
+# import, export and to are keywords only at these places, so they are checked here
+# instead of being reserved in lex_db.py
+#--------------------------------------
+def p_expr_import(p):
+    'Query : TCNAME TCNAME FROM STRING_CONST'
+    if is_keyword(p[1], 'import'):
+        p[0] = common_db.Node('IMPORT', [p[2], p[4]])
+    common_db.global_syn_tree = p[0]
+
+def p_expr_export(p):
+    'Query : TCNAME TCNAME TCNAME STRING_CONST'
+    if is_keyword(p[1], 'export') and is_keyword(p[3], 'to'):
+        p[0] = common_db.Node('EXPORT', [p[2], p[4]])
+    common_db.global_syn_tree = p[0]
+
+def is_keyword(word, keyword):
+    if word.lower() == keyword:
+        return True
+    print(f"Syntax error at '{word}', {keyword.upper()} expected")
+    return False
+
 #------------------------------
 #construct the node for select list
 #--------------------------------------
@@ -0,0 +1,155 @@
+# -----------------------------------------------------------------------
+# partition_db.py
+# -----------------------------------------------------------------------
+# the module describes how the records of a partitioned table are spread
+# over its partitions. Each partition is a table file of its own, e.g.
+# b'sensor$p0.dat', b'sensor$p1.dat', ..., with its own free space map and zone map;
+# the file of the table itself only keeps the fields and the partitioning in block 0.
+# a scan reads only the partitions whose records can satisfy the predicates,
+# and a partition is dropped by removing its files (see Storage.drop_partition())
+# -----------------------------------------------------------------------
+
+# structure of the partitioning in block 0, after the table options (see storage_db.py)
+# ----------------------------------------
+# kind                      # PARTITION_RANGE or PARTITION_HASH
+# field index               # the field whose value chooses the partition
+# number of partitions
+# bound_0                   # range only: partition i holds the values in [bound_i-1, bound_i)
+# ...                       # the first partition has no lower bound, the last one no upper bound
+# bound_n-2
+# -------------------------------------------
+
+import bisect
+import struct
+import zlib
+import codec_db
+from zonemap_db import range_may_match
+
+PARTITION_RANGE = 1
+PARTITION_HASH = 2
+PARTITION_KINDS = {'RANGE': PARTITION_RANGE, 'HASH': PARTITION_HASH}
+
+PARTITION_HEAD_FORMAT = '!iii'  # kind, field index, number of partitions
+PARTITION_BOUND_FORMAT = '!q'
+
+
+# ------------------------------
+# the name of the table which holds one partition, e.g. b'sensor$p2'
+# -------------------------------------
+def partition_name(tablename, part_no):
+    return tablename + ('$p%d' % part_no).encode('utf-8')
+
+
+# --------------------------------------------
+# the partitioning of a table
+# --------------------------------------------
+class PartitionSpec(object):
+
+    # ------------------------------
+    # constructor of the class
+    # input:
+    #       kind: PARTITION_RANGE or PARTITION_HASH
+    #       field_index: the field whose value chooses the partition
+    #       num_partitions
+    #       bounds: the sorted upper bounds of the range partitions except the last one
+    # -------------------------------------
+    def __init__(self, kind, field_index, num_partitions, bounds=None):
+        self.kind = kind
+        self.field_index = field_index
+        self.num_partitions = num_partitions
+        self.bounds = list(bounds or [])
+
+    # ------------------------------
+    # the partitioning declared at the creation of a table
+    # input:
+    #       fields: the checked field list of the table
+    #       partition: ('RANGE', field name, [bound, ...]) or ('HASH', field name, number of partitions)
+    # output:
+    #       a PartitionSpec, ValueError if the declaration is wrong
+    # -------------------------------------
+    @classmethod
+    def declare(cls, fields, partition):
+        kind_name, field_name, arg = partition
+        kind = PARTITION_KINDS.get(str(kind_name).upper())
+        if kind is None:
+            raise ValueError("invalid partitioning %r, RANGE or HASH is expected" % (kind_name,))
+        if isinstance(field_name, str):
+            field_name = field_name.encode('utf-8')
+        names = [field[0].strip() for field in fields]
+        if field_name.strip() not in names:
+            raise ValueError("partition field %s is not a field of the table" % field_name.decode('utf-8'))
+        field_index = names.index(field_name.strip())
+
+        if kind == PARTITION_HASH:
+            if int(arg) < 1:
+                raise ValueError("a hash partitioned table needs at least one partition")
+            return cls(kind, field_index, int(arg))
+
+        if fields[field_index][1] != 2:
+            raise ValueError("range partitioning needs an int field")
+        bounds = [int(bound) for bound in arg]
+        if bounds != sorted(set(bounds)) or any(not codec_db.INT_MIN < bound <= codec_db.INT_MAX for bound in bounds):
+            raise ValueError("the bounds of the range partitions must be increasing ints")
+        return cls(kind, field_index, len(bounds) + 1, bounds)
+
+    # ------------------------------
+    # the bytes of the partitioning which are kept in block 0
+    # -------------------------------------
+    def pack(self):
+        return struct.pack(PARTITION_HEAD_FORMAT, self.kind, self.field_index, self.num_partitions) + \
+            b''.join(struct.pack(PARTITION_BOUND_FORMAT, bound) for bound in self.bounds)
+
+    def packed_len(self):
+        return struct.calcsize(PARTITION_HEAD_FORMAT) + len(self.bounds) * struct.calcsize(PARTITION_BOUND_FORMAT)
+
+    @classmethod
+    def unpack(cls, buf, offset):
+        kind, field_index, num_partitions = struct.unpack_from(PARTITION_HEAD_FORMAT, buf, offset)
+        offset += struct.calcsize(PARTITION_HEAD_FORMAT)
+        bounds = []
+        if kind == PARTITION_RANGE:
+            for i in range(num_partitions - 1):
+                bounds.append(struct.unpack_from(PARTITION_BOUND_FORMAT, buf,
+                                                 offset + i * struct.calcsize(PARTITION_BOUND_FORMAT))[0])
+        return cls(kind, field_index, num_partitions, bounds)
+
+    # ------------------------------
+    # the partition of a value of the partition field
+    # -------------------------------------
+    def partition_of_value(self, value):
+        if self.kind == PARTITION_RANGE:
+            return bisect.bisect_right(self.bounds, value)
+        if isinstance(value, str):
+            return zlib.crc32(value.encode('utf-8')) % self.num_partitions  # the same in every process
+        return int(value) % self.num_partitions
+
+    # ------------------------------
+    # the partition of a checked record, see Storage._check_record()
+    # -------------------------------------
+    def partition_of(self, record):
+        return self.partition_of_value(record[self.field_index])
+
+    # ------------------------------
+    # whether a record of the partition can satisfy all the predicates
+    # input:
+    #       predicates: list of (field index, operator, typed constant), they are ANDed
+    # -------------------------------------
+    def may_match(self, part_no, predicates):
+        for (field_index, operator_str, constant) in predicates or []:
+            if field_index != self.field_index:
+                continue
+            if self.kind == PARTITION_HASH:
+                if operator_str in ('=', 'EQX') and self.partition_of_value(constant) != part_no:
+                    return False
+                continue
+            low = self.bounds[part_no - 1] if part_no > 0 else codec_db.INT_MIN
+            high = self.bounds[part_no] - 1 if part_no < len(self.bounds) else codec_db.INT_MAX
+            if not range_may_match(low, high, operator_str, constant):
+                return False
+        return True
+
+    # ------------------------------
+    # the partitions which are read for the predicates
+    # -------------------------------------
+    def matching(self, predicates):
+        return [part_no for part_no in range(self.num_partitions) if self.may_match(part_no, predicates)]
@@ -11,7 +11,9 @@
 
 import common_db
 import storage_db
+import column_db
 import itertools
+from transaction_db import global_transaction_manager
 
 #--------------------------------
 # to import the syntax tree, which is defined in parser_db.py
@@ -195,8 +197,9 @@ def construct_select_node(wf_node, sel_list):
 # to execute the query plan and return the result
 # input
 #       logical_query_plan_tree (the root of the logical query plan)
+#       snapshot: the page_db.Snapshot which the tables are read with, None for the records not deleted now
 #---------------------------------------------
-def execute_logical_tree_recursive(node): # Haomin Wang: Made it recursive and explicit argument
+def execute_logical_tree_recursive(node, snapshot=None): # Haomin Wang: Made it recursive and explicit argument
     if not node:
         return None, None, None # result_data, field_names, field_infos
 
@@ -204,29 +207,13 @@ def execute_logical_tree_recursive(node): # Haomin Wang: Made it recursive and e
 
     if node_type == 'TABLE':
         # Leaf node: represents a table. Load data from storage.
-        table_name = node.children[0] # The table name string
-        print(f"Executing: Accessing table {table_name}")
-        # Haomin Wang: Ensure table_name is bytes for Storage constructor if it expects bytes
-        # If table_name from parser is already string, encode it.
-        if isinstance(table_name, str):
-            table_name_bytes = table_name.encode('utf-8')
-        else:
-            table_name_bytes = table_name # Assuming it might already be bytes from some path
-
-        storage_obj = storage_db.Storage(table_name_bytes) #
-        records = storage_obj.getRecord() #
-        field_infos = storage_obj.getFieldList() # List of (name_bytes, type, length)
-        field_names = [fi[0].decode('utf-8').strip() for fi in field_infos]
-        # Haomin Wang: Qualify field names with table name if not already: table.field
-        qualified_field_names = [f"{table_name}.{fn}" for fn in field_names]
-
-
-        return records, qualified_field_names, field_infos
+        records, field_names, field_infos, filtered = execute_table_node(node, None, snapshot)
+        return records, field_names, field_infos
 
     elif node_type == 'X': # Cross Product
         # Binary operator: two children representing two data sources
-        left_records, left_fields, left_field_infos = execute_logical_tree_recursive(node.children[0])
-        right_records, right_fields, right_field_infos = execute_logical_tree_recursive(node.children[1])
+        left_records, left_fields, left_field_infos = execute_logical_tree_recursive(node.children[0], snapshot)
+        right_records, right_fields, right_field_infos = execute_logical_tree_recursive(node.children[1], snapshot)
 
         if left_records is None or right_records is None:
             print("Error in executing cross product: one operand is None.")
@@ -234,12 +221,8 @@ def execute_logical_tree_recursive(node): # Haomin Wang: Made it recursive and e
 
         print(f"Executing: Cross Product between results for {node.children[0].value} and {node.children[1].value}")
 
-        combined_records = []
-        for lr in left_records:
-            for rr in right_records:
-                # Ensure lr and rr are iterables (tuples or lists)
-                combined_record = list(lr) + list(rr)
-                combined_records.append(tuple(combined_record))
+        # the right operand is read once for every left record, so it is kept in main memory
+        combined_records = cross_product_records(left_records, list(right_records))
 
         combined_fields = left_fields + right_fields
         combined_field_infos = left_field_infos + right_field_infos
@@ -247,8 +230,15 @@ def execute_logical_tree_recursive(node): # Haomin Wang: Made it recursive and e
 
     elif node_type == 'Filter':
         # Unary operator: first child is data source, second child is condition tree
-        source_records, source_fields, source_field_infos = execute_logical_tree_recursive(node.children[0])
         condition_tree = node.children[1] # The root of the condition expression tree
+        if node.children[0].value == 'TABLE':
+            # the blocks of the table which cannot satisfy the condition are skipped by the zone map
+            source_records, source_fields, source_field_infos, filtered = execute_table_node(node.children[0], condition_tree, snapshot)
+            if filtered: # the condition has been checked by the parallel scan
+                print(f"Executing: Filter on results from {node.children[0].value} (in the parallel scan)")
+                return source_records, source_fields, source_field_infos
+        else:
+            source_records, source_fields, source_field_infos = execute_logical_tree_recursive(node.children[0], snapshot)
 
         if source_records is None:
             print("Error in executing filter: source is None.")
@@ -259,19 +249,17 @@ def execute_logical_tree_recursive(node): # Haomin Wang: Made it recursive and e
 
         print(f"Executing: Filter on results from {node.children[0].value}")
 
-        filtered_records = []
-        for record in source_records:
-            # Create a dictionary mapping field names to values for the current record
-            # This makes it easier to evaluate conditions. Field names are qualified.
-            record_dict = dict(zip(source_fields, record))
-            if evaluate_condition(condition_tree, record_dict, source_field_infos, source_fields):
-                filtered_records.append(record)
+        if isinstance(source_records, column_db.ColumnTable):
+            mask = evaluate_condition_columns(condition_tree, source_records, source_field_infos, source_fields)
+            filtered_records = source_records.filter(mask)
+        else:
+            filtered_records = filter_records(source_records, condition_tree, source_field_infos, source_fields)
 
         return filtered_records, source_fields, source_field_infos
 
     elif node_type == 'Proj': # Projection
         # Unary operator: first child is data source. Projected columns are in node.var
-        source_records, source_fields, source_field_infos = execute_logical_tree_recursive(node.children[0])
+        source_records, source_fields, source_field_infos = execute_logical_tree_recursive(node.children[0], snapshot)
         project_columns_requested = node.var # List of column names (or ['*']) to project
 
         if source_records is None:
@@ -286,7 +274,6 @@ def execute_logical_tree_recursive(node): # Haomin Wang: Made it recursive and e
             print("Projection: SELECT * identified.")
             return source_records, source_fields, source_field_infos
 
-        projected_records = []
         projected_field_names = []
         projected_field_infos_final = [] # Haomin Wang: To carry over field info for projected cols
 
@@ -323,9 +310,10 @@ def execute_logical_tree_recursive(node): # Haomin Wang: Made it recursive and e
                 return None, None, None # Column not found error
 
         # Perform the projection
-        for record in source_records:
-            new_record = tuple(record[i] for i in col_indices_to_project)
-            projected_records.append(new_record)
+        if isinstance(source_records, column_db.ColumnTable):
+            projected_records = source_records.project(col_indices_to_project)
+        else:
+            projected_records = (tuple(record[i] for i in col_indices_to_project) for record in source_records)
 
         return projected_records, projected_field_names, projected_field_infos_final
 
@@ -334,6 +322,121 @@ def execute_logical_tree_recursive(node): # Haomin Wang: Made it recursive and e
         return None, None, None
 
 
+# the records of a TABLE node
+# input
+#       node: the TABLE node
+#       condition_tree: the condition of the Filter node above it
+#       snapshot: see execute_logical_tree_recursive()
+# output
+#       records, field names, field infos, True if the records have already been filtered by the condition
+def execute_table_node(node, condition_tree=None, snapshot=None):
+    table_name = node.children[0] # The table name string
+    print(f"Executing: Accessing table {table_name}")
+    # Haomin Wang: Ensure table_name is bytes for Storage constructor if it expects bytes
+    # If table_name from parser is already string, encode it.
+    if isinstance(table_name, str):
+        table_name_bytes = table_name.encode('utf-8')
+    else:
+        table_name_bytes = table_name # Assuming it might already be bytes from some path
+
+    storage_obj = storage_db.open_table(table_name_bytes) # the handle is shared by the queries until the table changes
+    field_infos = storage_obj.getFieldList() # List of (name_bytes, type, length)
+    field_names = [fi[0].decode('utf-8').strip() for fi in field_infos]
+    # Haomin Wang: Qualify field names with table name if not already: table.field
+    qualified_field_names = [f"{table_name}.{fn}" for fn in field_names]
+
+    if common_db.COLUMNAR_EXECUTION:
+        if snapshot is not None: # the columns kept by the handle hold the records not deleted now
+            records = column_db.ColumnTable(field_infos, storage_obj.scan(None, snapshot))
+        else:
+            records = storage_obj.column_table() # the following operators work on whole columns
+        return records, qualified_field_names, field_infos, False
+
+    predicates = zone_map_predicates(condition_tree, field_infos, qualified_field_names)
+    if common_db.PARALLEL_SCAN_WORKERS > 1 and storage_obj.num_data_blocks() >= common_db.PARALLEL_SCAN_MIN_BLOCKS:
+        print(f"Executing: Parallel scan of table {table_name} in {common_db.PARALLEL_SCAN_WORKERS} processes")
+        condition = compile_condition(condition_tree, field_infos, qualified_field_names) if condition_tree else None
+        records = storage_obj.parallel_scan(common_db.PARALLEL_SCAN_WORKERS, predicates, condition, snapshot)
+        return records, qualified_field_names, field_infos, condition is not None
+
+    records = storage_obj.scan(predicates, snapshot) # a generator, the table is decoded block by block while it is consumed
+    return records, qualified_field_names, field_infos, False
+
+
+# turn a condition tree into the tuples of parallel_db, so that worker processes can check it
+def compile_condition(condition_node, field_infos, field_names_qualified):
+    node_type = condition_node.value
+    if node_type == 'CONDITION_AND' or node_type == 'CONDITION_OR':
+        return ('AND' if node_type == 'CONDITION_AND' else 'OR',
+                compile_condition(condition_node.children[0], field_infos, field_names_qualified),
+                compile_condition(condition_node.children[1], field_infos, field_names_qualified))
+    if node_type != 'SIMPLE_CONDITION':
+        print(f"Unknown condition node type: {node_type}")
+        return ('FALSE',)
+
+    column_name_in_cond = condition_node.children[0].children[0]
+    operator_str = condition_node.children[1].children[0]
+    constant_val_from_query_node = condition_node.children[2].children[0]
+
+    qualified_col_name_found = find_condition_column(column_name_in_cond, field_names_qualified)
+    if qualified_col_name_found is None:
+        return ('FALSE',)
+    field_idx = field_names_qualified.index(qualified_col_name_found)
+    try:
+        const_typed = typed_constant(field_infos[field_idx][1], constant_val_from_query_node)
+    except ValueError:
+        print(f"Type mismatch in condition: cannot convert query value '{constant_val_from_query_node}' for column '{qualified_col_name_found}'.")
+        return ('FALSE',)
+    if operator_str not in column_db.COMPARE_FUNCS:
+        if operator_str.upper() not in column_db.COMPARE_FUNCS:
+            print(f"Unknown operator '{operator_str}' in condition.")
+            return ('FALSE',)
+        operator_str = operator_str.upper()
+    return ('CMP', field_idx, operator_str, const_typed)
+
+
+# the simple conditions which must all hold for a record to satisfy the condition tree
+# output: list of (field index, operator, typed constant) for Storage.scan()
+def zone_map_predicates(condition_node, field_infos, field_names_qualified):
+    if not condition_node:
+        return []
+    if condition_node.value == 'CONDITION_AND':
+        return zone_map_predicates(condition_node.children[0], field_infos, field_names_qualified) + \
+               zone_map_predicates(condition_node.children[1], field_infos, field_names_qualified)
+    if condition_node.value != 'SIMPLE_CONDITION':
+        return [] # e.g. an OR, no block can be skipped because of it
+
+    column_name_in_cond = condition_node.children[0].children[0]
+    operator_str = condition_node.children[1].children[0]
+    matches = [i for i, qn in enumerate(field_names_qualified)
+               if qn == column_name_in_cond or qn.split('.')[-1] == column_name_in_cond]
+    if len(matches) != 1:
+        return [] # the error is reported when the records are filtered
+    try:
+        const_typed = typed_constant(field_infos[matches[0]][1], condition_node.children[2].children[0])
+    except ValueError:
+        return []
+    return [(matches[0], operator_str, const_typed)]
+
+
+# the records of the cross product, one record of the left operand at a time
+def cross_product_records(left_records, right_records):
+    for lr in left_records:
+        for rr in right_records:
+            # Ensure lr and rr are iterables (tuples or lists)
+            yield tuple(list(lr) + list(rr))
+
+
+# the records which satisfy the condition, they are checked one by one while they are consumed
+def filter_records(source_records, condition_tree, field_infos, field_names_qualified):
+    for record in source_records:
+        # Create a dictionary mapping field names to values for the current record
+        # This makes it easier to evaluate conditions. Field names are qualified.
+        record_dict = dict(zip(field_names_qualified, record))
+        if evaluate_condition(condition_tree, record_dict, field_infos, field_names_qualified):
+            yield record
+
+
 # Haomin Wang: Helper function to evaluate a condition tree for a given record
 def evaluate_condition(condition_node, record_dict, field_infos, field_names_qualified):
     if not condition_node:
@@ -350,23 +453,10 @@ def evaluate_condition(condition_node, record_dict, field_infos, field_names_qua
         column_name_in_cond = column_name_node.children[0] # Actual string like 'TCNAME' or 'TABLE.TCNAME'
 
 
-        record_value = None
-        qualified_col_name_found = None
-
-        if column_name_in_cond in record_dict: # Directly qualified or unique unqualified already resolved
-            record_value = record_dict[column_name_in_cond]
-            qualified_col_name_found = column_name_in_cond
-        else: # Try to find as unqualified part
-            matches = [qn for qn in record_dict.keys() if qn.split('.')[-1] == column_name_in_cond]
-            if len(matches) == 1:
-                qualified_col_name_found = matches[0]
-                record_value = record_dict[qualified_col_name_found]
-            elif len(matches) > 1:
-                print(f"Ambiguous column '{column_name_in_cond}' in condition.")
-                return False
-            else:
-                print(f"Column '{column_name_in_cond}' not found in record for condition.")
-                return False
+        qualified_col_name_found = find_condition_column(column_name_in_cond, field_names_qualified)
+        if qualified_col_name_found is None:
+            return False
+        record_value = record_dict[qualified_col_name_found]
 
         # Get the type of the column from field_infos
         field_idx = field_names_qualified.index(qualified_col_name_found)
@@ -380,23 +470,8 @@ def evaluate_condition(condition_node, record_dict, field_infos, field_names_qua
 
 
         try:
-            const_typed = None # Haomin Wang: Initialize const_typed
-            # Haomin Wang: Ensure record_value itself is correctly typed before comparison
-            # storage_db.py seems to load them correctly based on schema type.
-            # record_value from record_dict[qualified_col_name_found] should have correct Python type.
-
-            if col_type_code == 2: # INTEGER
-                const_typed = int(constant_val_from_query_node)
-                # record_value should already be int if data loading is correct
-            elif col_type_code == 3: # BOOLEAN
-                if isinstance(constant_val_from_query_node, str):
-                    const_typed = constant_val_from_query_node.lower() in ['true', '1', 't', 'yes'] #
-                else: # Assume it's an int 0 or 1
-                    const_typed = bool(int(constant_val_from_query_node)) # Convert to int then bool
-                # record_value from storage_db is already bool
-            else: # STRING or VARSTRING (types 0, 1)
-                const_typed = str(constant_val_from_query_node)
-                # record_value from storage_db is already str
+            # record_value from storage_db already has the Python type of the column
+            const_typed = typed_constant(col_type_code, constant_val_from_query_node)
         except ValueError:
             print(f"Type mismatch in condition: cannot convert query value '{constant_val_from_query_node}' for column '{qualified_col_name_found}'.")
             return False
@@ -425,24 +500,102 @@ def evaluate_condition(condition_node, record_dict, field_infos, field_names_qua
     return False
 
 
-def execute_logical_tree(): # Haomin Wang: This is the main entry point called by main_db.py
+# the qualified name of the column in a condition, None if it is not found or ambiguous
+def find_condition_column(column_name_in_cond, field_names_qualified):
+    if column_name_in_cond in field_names_qualified: # Directly qualified or unique unqualified already resolved
+        return column_name_in_cond
+    # Try to find as unqualified part
+    matches = [qn for qn in field_names_qualified if qn.split('.')[-1] == column_name_in_cond]
+    if len(matches) == 1:
+        return matches[0]
+    if len(matches) > 1:
+        print(f"Ambiguous column '{column_name_in_cond}' in condition.")
+    else:
+        print(f"Column '{column_name_in_cond}' not found in record for condition.")
+    return None
+
+
+# the constant of a condition converted to the type of the column, ValueError if it cannot be converted
+def typed_constant(col_type_code, constant_val_from_query_node):
+    if col_type_code == 2: # INTEGER
+        return int(constant_val_from_query_node)
+    if col_type_code == 3: # BOOLEAN
+        if isinstance(constant_val_from_query_node, str):
+            return constant_val_from_query_node.lower() in ['true', '1', 't', 'yes']
+        return bool(int(constant_val_from_query_node)) # Assume it's an int 0 or 1
+    return str(constant_val_from_query_node) # STRING or VARSTRING (types 0, 1)
+
+
+# evaluate a condition tree on whole columns
+# output: a bytearray with 1 for the rows of the column table which satisfy the condition
+def evaluate_condition_columns(condition_node, table, field_infos, field_names_qualified):
+    none_selected = bytearray(len(table))
+    if not condition_node:
+        return bytearray(b'\x01') * len(table)
+
+    node_type = condition_node.value
+
+    if node_type == 'SIMPLE_CONDITION':
+        column_name_in_cond = condition_node.children[0].children[0]
+        operator_str = condition_node.children[1].children[0]
+        constant_val_from_query_node = condition_node.children[2].children[0]
+
+        qualified_col_name_found = find_condition_column(column_name_in_cond, field_names_qualified)
+        if qualified_col_name_found is None:
+            return none_selected
+        field_idx = field_names_qualified.index(qualified_col_name_found)
+
+        try:
+            const_typed = typed_constant(field_infos[field_idx][1], constant_val_from_query_node)
+        except ValueError:
+            print(f"Type mismatch in condition: cannot convert query value '{constant_val_from_query_node}' for column '{qualified_col_name_found}'.")
+            return none_selected
+
+        try:
+            return table.compare(field_idx, operator_str, const_typed)
+        except ValueError:
+            print(f"Unknown operator '{operator_str}' in condition.")
+            return none_selected
+
+    elif node_type == 'CONDITION_AND':
+        return column_db.mask_and(evaluate_condition_columns(condition_node.children[0], table, field_infos, field_names_qualified),
+                                  evaluate_condition_columns(condition_node.children[1], table, field_infos, field_names_qualified))
+
+    elif node_type == 'CONDITION_OR':
+        return column_db.mask_or(evaluate_condition_columns(condition_node.children[0], table, field_infos, field_names_qualified),
+                                 evaluate_condition_columns(condition_node.children[1], table, field_infos, field_names_qualified))
+
+    print(f"Unknown condition node type: {node_type}")
+    return none_selected
+
+
+# the tables are read with the snapshot of the transaction, or with a snapshot of its own if there is none,
+# when common_db.MVCC_SNAPSHOTS is True, so the query does not see the changes of unfinished transactions
+def execute_logical_tree(trans_id=None): # Haomin Wang: This is the main entry point called by main_db.py
     if common_db.global_logical_tree:
         print("Executing Logical Query Plan Tree:")
         # common_db.show(common_db.global_logical_tree) # For debugging the plan tree structure
 
-        final_records, final_field_names, _ = execute_logical_tree_recursive(common_db.global_logical_tree)
-
-        if final_records is not None and final_field_names is not None:
-            print("\nQuery Results:")
-            # Print header
-            print(" | ".join(final_field_names))
-            print("-" * (sum(len(str(fn)) for fn in final_field_names) + 3 * (len(final_field_names) -1 if final_field_names else 0))) # Haomin Wang: Dynamic underline, ensure fn is str
-            # Print records
-            for record in final_records:
-                print(" | ".join(str(item) for item in record))
-            print(f"\n{len(final_records)} row(s) returned.")
-        else:
-            print("Query execution failed or returned no results.")
+        snapshot = global_transaction_manager.get_snapshot(trans_id) if common_db.MVCC_SNAPSHOTS else None
+        try:
+            final_records, final_field_names, _ = execute_logical_tree_recursive(common_db.global_logical_tree, snapshot)
+
+            if final_records is not None and final_field_names is not None:
+                print("\nQuery Results:")
+                # Print header
+                print(" | ".join(final_field_names))
+                print("-" * (sum(len(str(fn)) for fn in final_field_names) + 3 * (len(final_field_names) -1 if final_field_names else 0))) # Haomin Wang: Dynamic underline, ensure fn is str
+                # Print records, the records are produced one by one while they are printed
+                row_count = 0
+                for record in final_records:
+                    print(" | ".join(str(item) for item in record))
+                    row_count += 1
+                print(f"\n{row_count} row(s) returned.")
+            else:
+                print("Query execution failed or returned no results.")
+        finally:
+            if snapshot is not None: # the records deleted after the snapshot may be purged now
+                global_transaction_manager.release_snapshot(snapshot)
     else:
         print ('There is no query plan tree for the execution.') #
 
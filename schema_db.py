@@ -12,6 +12,7 @@
 import ctypes
 import struct
 import head_db # it is main memory structure for the table schema
+import storage_db
 
 
 
@@ -63,7 +64,7 @@ BODY_BEGIN_INDEX=META_HEAD_SIZE+TABLE_NAME_HEAD_SIZE            # Intitially, wh
 def fillTableName(tableName): # it should be 10 bytes
     if len(tableName.strip())<MAX_TABLE_NAME_LEN:
         tableName=(' '*(MAX_TABLE_NAME_LEN-len(tableName.strip()))).encode('utf-8')+tableName.strip()
-        return tableName
+    return tableName
 
 
 class Schema(object):
@@ -274,12 +275,10 @@ class Schema(object):
             beginIndex = 0
             for i in range(len(fieldList)):
                 (fieldName,fieldType,fieldLength)=fieldList[i]
-                if len(fieldName.strip())<10:
-                    if isinstance(fieldName,str):
-                        fieldName=fieldName.encode('utf-8')
-                    filledFieldName = (' ' * (MAX_FIELD_LEN - len(fieldName.strip()))).encode('utf-8') + fieldName
-                if isinstance(filledFieldName,str):
-                    filledFieldName=filledFieldName.encode('utf-8')
+                if isinstance(fieldName,str):
+                    fieldName=fieldName.encode('utf-8')
+                # the field name is right-justified in MAX_FIELD_NAME_LEN bytes, as in block 0 of the table file
+                filledFieldName = (' ' * (MAX_FIELD_NAME_LEN - len(fieldName.strip()))).encode('utf-8') + fieldName.strip()
                 struct.pack_into('!10sii', fieldBuff, beginIndex, filledFieldName,int(fieldType),int(fieldLength))
 
                 beginIndex = beginIndex + MAX_FIELD_LEN
@@ -312,6 +311,32 @@ class Schema(object):
             # fieldTuple = tuple(fieldList)
             self.headObj.tableFields[tableName]=fieldList
 
+    # -----------------------------
+    # to create a table without asking for its fields, block 0 of the table file and the entry in all.sch are written
+    # input:
+    #       tableName: e.g. b'student'
+    #       fieldList: the field information list and each element is a tuple(fieldname,fieldtype,fieldlength)
+    #       partition: the partitioning of the table, see Storage.create()
+    # output:
+    #       the Storage object of the new table, ValueError if the table exists or a field is wrong
+    # -------------------------------
+    def create_table(self, tableName, fieldList, partition=None):
+        if isinstance(tableName, str):
+            tableName = tableName.encode('utf-8')
+        tableName = tableName.strip()
+        if len(tableName) == 0 or len(tableName) > MAX_TABLE_NAME_LEN:
+            raise ValueError('tablename is invalid')
+        if self.find_table(tableName):
+            raise ValueError('table %s already exists in all.sch' % tableName.decode('utf-8'))
+        if self.headObj.lenOfTableNum >= MAX_TABLE_NUM:
+            raise ValueError('there are already %d tables in all.sch' % MAX_TABLE_NUM)
+        if self.headObj.offsetOfBody + len(fieldList) * MAX_FIELD_LEN > BODY_BEGIN_INDEX + MAX_FIELD_SECTION_SIZE:
+            raise ValueError('there is no space for the fields in all.sch')
+
+        dataObj = storage_db.Storage.create(tableName, fieldList, partition=partition)
+        self.appendTable(tableName, dataObj.getFieldList())
+        return dataObj
+
     # -------------------------------
     # to determine whether the table named table_name exist, depending on the main memory structures
     # input
@@ -19,7 +19,19 @@ from common_db import BLOCK_SIZE
 # block_id                                # 0
 # number_of_dat_blocks                    # at first it is 0 because there is no data in the table
 # number_of_fields or number_of_records   # the total number of fields for the table
+# field_0_name, field_0_type, field_0_length
+# ...
+# field_n_name, field_n_type, field_n_length
+# table_options_magic                     # TABLE_OPTIONS_MAGIC, 0 in the tables created before the options
+# table_flags                             # TABLE_FLAG_BINARY if the records are stored in binary format
+#                                         # TABLE_FLAG_VARSTR if the varstr values are stored without padding
+#                                         # TABLE_FLAG_COMPRESSED if the data blocks are compressed
+# blocks_per_extent, number_of_extents    # the extent map, only in a compressed table
+# extent_0_position, extent_0_length
+# ...
 # -----------------------------------------------------------------------------------------
+# in a compressed table the data blocks are compressed with zlib in extents of blocks_per_extent
+# blocks, the compressed extents follow block 0 one after another (see compress())
 
 
 # the data type is as follows
@@ -31,8 +43,8 @@ from common_db import BLOCK_SIZE
 # structure of data block, whose block id begins with 1
 # ----------------------------------------
 # block_id       
-# number of records
-# record_0_offset         # it is a pointer to the data of record
+# number of records       # the number of slots, including the slots of deleted records
+# record_0_offset         # it is a pointer to the data of record, -1 if the record is deleted
 # record_1_offset
 # ...
 # record_n_offset
@@ -44,24 +56,219 @@ from common_db import BLOCK_SIZE
 # record_1
 # record_0
 # -------------------------------------------
+# a deleted record only frees its slot, the free bytes of each block are kept in
+# the free space map <table>.fsm so that inserts reuse them (see page_db.py)
+# the bounds of the values in each block are kept in the zone map <table>.zmp (see zonemap_db.py)
 
 # structre of one record
 # -----------------------------
 # pointer                     #offset of table schema in block id 0
 # length of record            # including record head and record content
-# time stamp of last update  # for example,1999-08-22
+# time stamp of last update  # for example,1999-08-22, now the version of the record (see page_db.py)
 # field_0_value
 # field_1_value
 # ...
 # field_n_value
 # -------------------------
+# the record content is encoded and decoded by the codec of the table (see codec_db.py)
 
 
 import struct
 import os
 import ctypes
+import mmap
+import zlib
+import itertools
+import atexit
+import weakref
 import common_db
+import page_db
+import codec_db
+import column_db
+import zonemap_db
+import parallel_db
+import vacuum_db
+import partition_db
 from transaction_db import global_transaction_manager
+from buffer_db import global_buffer_pool
+from lock_db import global_lock_manager, LOCK_IX, LOCK_X
+
+BLOCK_HEAD_LEN = struct.calcsize('!iii')  # block_id, number_of_dat_blocks, number_of_fields
+FIELD_ENTRY_LEN = struct.calcsize('!10sii')
+TABLE_OPTIONS_FORMAT = '!ii'  # magic, flags
+TABLE_OPTIONS_MAGIC = 0x54424f50
+TABLE_FLAG_BINARY = 0x1  # int and bool values are stored in binary instead of text
+TABLE_FLAG_VARSTR = 0x2  # varstr values are not padded, the records have different lengths
+TABLE_FLAG_COMPRESSED = 0x4  # the data blocks are compressed, the table is read-only until it is written
+TABLE_FLAG_PARTITIONED = 0x8  # the records are kept in partition tables, the partitioning follows the options
+NEW_TABLE_FLAGS = TABLE_FLAG_BINARY | TABLE_FLAG_VARSTR  # the options of the tables created now
+
+EXTENT_HEAD_FORMAT = '!ii'  # blocks per extent, number of extents
+EXTENT_ENTRY_FORMAT = '!ii'  # position of the compressed extent in the file, its length
+COMPRESS_EXTENT_BLOCKS = 16  # the number of data blocks which are compressed together
+COMPRESS_LEVEL = 6
+VACUUM_FILL_FACTOR = 0.5  # vacuum empties the blocks which are used less than this part
+
+
+# ------------------------------
+# to check the field list of a new table
+# input:
+#       fields: list of (field name, field type, field length)
+# output:
+#       the list of (field name padded to 10 bytes, field type, field length), ValueError if a field is wrong
+# -------------------------------------
+def check_fields(fields):
+    if not fields:
+        raise ValueError("a table needs at least one field")
+    if BLOCK_HEAD_LEN + len(fields) * FIELD_ENTRY_LEN + struct.calcsize(TABLE_OPTIONS_FORMAT) > BLOCK_SIZE:
+        raise ValueError("too many fields for block 0")
+
+    checked = []
+    for (field_name, field_type, field_length) in fields:
+        if isinstance(field_name, str):
+            field_name = field_name.encode('utf-8')
+        field_name = field_name.strip()
+        if len(field_name) == 0 or len(field_name) > 10:
+            raise ValueError("invalid field name %r" % field_name)
+        if int(field_type) not in [0, 1, 2, 3]:
+            raise ValueError("invalid type %r of field %s" % (field_type, field_name.decode('utf-8')))
+        if int(field_length) <= 0:
+            raise ValueError("invalid length %r of field %s" % (field_length, field_name.decode('utf-8')))
+        checked.append((b' ' * (10 - len(field_name)) + field_name, int(field_type), int(field_length)))
+
+    record_len = page_db.RECORD_HEAD_LEN + codec_db.get_codec(checked, True, True).size  # the longest record
+    if page_db.PAGE_HEAD_LEN + page_db.SLOT_LEN + record_len > BLOCK_SIZE:
+        raise ValueError("Record size too large for block size")
+    return checked
+
+
+# ------------------------------
+# the content of block 0 of a new table
+# input:
+#       fields: list of (field name, field type, field length)
+#       table_flags: e.g. TABLE_FLAG_BINARY
+#       partition_spec: the partition_db.PartitionSpec of a partitioned table
+# -------------------------------------
+def pack_table_head(fields, table_flags, partition_spec=None):
+    dir_buf = ctypes.create_string_buffer(BLOCK_SIZE)
+    struct.pack_into('!iii', dir_buf, 0, 0, 0, len(fields))  # block_id,number_of_data_blocks,number_of_fields
+
+    beginIndex = BLOCK_HEAD_LEN
+    for (field_name, field_type, field_length) in fields:
+        if isinstance(field_name, str):
+            field_name = field_name.encode('utf-8')
+        struct.pack_into('!10sii', dir_buf, beginIndex, field_name, int(field_type), int(field_length))
+        beginIndex = beginIndex + FIELD_ENTRY_LEN
+
+    struct.pack_into(TABLE_OPTIONS_FORMAT, dir_buf, beginIndex, TABLE_OPTIONS_MAGIC, table_flags)
+    if partition_spec is not None:
+        beginIndex = beginIndex + struct.calcsize(TABLE_OPTIONS_FORMAT)
+        if beginIndex + partition_spec.packed_len() > BLOCK_SIZE:
+            raise ValueError("there is no space for the partitioning in block 0")
+        dir_buf[beginIndex:beginIndex + partition_spec.packed_len()] = partition_spec.pack()
+    return dir_buf.raw
+
+
+# ------------------------------
+# remove the files of a table, its blocks in the buffer pool are thrown away
+# input:
+#       tablename: e.g. b'student'
+# -------------------------------------
+def remove_table_files(tablename):
+    global_buffer_pool.untrack_page_lsns(tablename + b'.dat')
+    for suffix in (b'.dat', b'.fsm', b'.zmp', b'.lsn'):
+        global_buffer_pool.close_file(tablename + suffix, discard=True)
+        if os.path.exists(tablename + suffix):
+            os.remove(tablename + suffix)
+    drop_index(tablename)
+
+
+# ------------------------------
+# remove the index of a table, see index_db.py; its entries point to the row identifiers of the records,
+# so it is dropped when the records are moved and must be created again by Index.create_index()
+# output:
+#       True if the table had an index
+# -------------------------------------
+def drop_index(tablename):
+    index_file = tablename + b'.ind'
+    global_buffer_pool.close_file(index_file, discard=True)
+    if not os.path.exists(index_file):
+        return False
+    os.remove(index_file)
+    return True
+
+
+# the handles of the tables shared by the queries of this process, see open_table()
+_table_handles = {}  # table name -> Storage
+_open_tables = weakref.WeakSet()  # all the open Storage objects, they are closed at exit by close_tables()
+_table_versions = {}  # table name -> number of changes of the table
+
+
+# ------------------------------
+# the version of a table, it is increased by every change of the table
+# -------------------------------------
+def table_version(tablename):
+    return _table_versions.get(tablename, 0)
+
+
+def bump_table_version(tablename):
+    _table_versions[tablename] = _table_versions.get(tablename, 0) + 1
+    return _table_versions[tablename]
+
+
+# ------------------------------
+# an aborted transaction has taken back its changes of the tables (see transaction_db.py),
+# the cached handles of them and of the partitioned tables they belong to are out of date;
+# if the number of data blocks has been taken back, the blocks appended by bulk_load() are cut off
+# input:
+#       table_blocks: table file -> the ids of the blocks which have been changed back,
+#                     e.g. {'student.dat': {0, 3}, 'sales$p1.dat': {1}}
+# -------------------------------------
+def _tables_rolled_back(table_blocks):
+    for (file_name, block_ids) in table_blocks.items():
+        if 0 in block_ids:
+            with global_lock_manager.latch(file_name, 0):
+                data_block_num = struct.unpack_from('!ii', global_buffer_pool.read_block(file_name, 0), 0)[1]
+                global_buffer_pool.truncate_file(file_name, data_block_num + 1)
+        tablename = os.fsencode(os.path.splitext(file_name)[0])
+        bump_table_version(tablename)
+        if b'$p' in tablename:  # a partition, see partition_db.partition_name()
+            bump_table_version(tablename.rsplit(b'$p', 1)[0])
+
+
+global_transaction_manager.rollback_listeners.append(_tables_rolled_back)
+
+
+# ------------------------------
+# close all the open tables at exit, before the buffer pool writes its blocks back and closes its files;
+# the exit functions run in the reverse order of registration and buffer_db.py is imported first,
+# so no Storage.__del__() is left to touch a closed file when the interpreter shuts down
+# -------------------------------------
+def close_tables():
+    for storage in list(_open_tables):
+        storage.close()
+    _table_handles.clear()
+
+
+atexit.register(close_tables)
+
+
+# ------------------------------
+# return the Storage of an existing table from the handle cache, so that the file, the fields,
+# the codec and the block count are read only once; the handle is opened again when the table
+# has been changed through another handle since it was cached
+# input:
+#       tablename: e.g. b'student'
+# -------------------------------------
+def open_table(tablename):
+    if isinstance(tablename, str):
+        tablename = tablename.encode('utf-8')
+    tablename = tablename.strip()
+    storage = _table_handles.get(tablename)
+    if storage is None or not storage.open or storage.version != table_version(tablename):
+        storage = Storage(tablename)
+        _table_handles[tablename] = storage
+    return storage
 
 
 # --------------------------------------------
@@ -75,30 +282,51 @@ class Storage(object):
     # constructor of the class
     # input:
     #       tablename
+    #       use_mmap: True if the data blocks are read from a memory map of the file, for read-mostly tables
     # -------------------------------------
-    def __init__(self, tablename):
+    def __init__(self, tablename, use_mmap=False):
         # print "__init__ of ",Storage.__name__,"begins to execute"
         tablename.strip()
 
-        self.record_list = []
-        self.record_Position = []
-
-        if not os.path.exists(tablename + '.dat'.encode('utf-8')):  # the file corresponding to the table does not exist
+        self.use_mmap = use_mmap
+        self._map = None  # the memory map of the file, it is created at the first scan
+        self._map_handle = None
+        self._extent_handle = None  # the file handle from which the compressed extents are read
+        self._extent_cache = None  # (extent number, data blocks of the extent)
+        self.extent_blocks = 0
+        self.extents = []  # (position, length) of each compressed extent
+
+        # the records are decoded when they are used for the first time, see scan() and record_list
+        self._record_list = None
+        self._record_Position = None
+        self._column_table = None  # the records kept column by column, see column_table()
+        self.current_transaction_id = None
+        self._block_images = {}  # block id -> the block before it was acquired, see _acquire_block()
+        self.file_name = tablename + '.dat'.encode('utf-8')
+        self.tablename = tablename.strip()
+        self.version = table_version(self.tablename)  # see open_table()
+        self.partition_spec = None  # the partitioning of a partitioned table, see partition_db.py
+        self._partitions = {}  # partition number -> Storage of the partition
+
+        if not os.path.exists(self.file_name):  # the file corresponding to the table does not exist
             print('table file '.encode('utf-8') + tablename + '.dat does not exists'.encode('utf-8'))
-            self.f_handle = open(tablename + '.dat'.encode('utf-8'), 'wb+')
+            self.f_handle = open(self.file_name, 'wb+')
             self.f_handle.close()
             self.open = False
             print(tablename + '.dat has been created'.encode('utf-8'))
 
-        self.f_handle = open(tablename + '.dat'.encode('utf-8'), 'rb+')
+        # all the blocks of the file are read and written through the buffer pool,
+        # which keeps the page LSNs of the blocks for the recovery (see transaction_db.py)
         print('table file '.encode('utf-8') + tablename + '.dat has been opened'.encode('utf-8'))
         self.open = True
+        _open_tables.add(self)
+        global_buffer_pool.track_page_lsns(self.file_name)
 
-        self.dir_buf = ctypes.create_string_buffer(BLOCK_SIZE)
-        self.f_handle.seek(0)
-        self.dir_buf = self.f_handle.read(BLOCK_SIZE)
+        if global_buffer_pool.num_blocks(self.file_name) == 0:
+            self.dir_buf = b''
+        else:
+            self.dir_buf = global_buffer_pool.read_block(self.file_name, 0)
 
-        self.dir_buf.strip()
         my_len = len(self.dir_buf)
         self.field_name_list = []
         beginIndex = 0
@@ -112,15 +340,10 @@ class Storage(object):
                     "please input the number of feilds in table " + tablename + ":")
             if int(self.num_of_fields) > 0:
 
-                self.dir_buf = ctypes.create_string_buffer(BLOCK_SIZE)
                 self.block_id = 0
                 self.data_block_num = 0
-                struct.pack_into('!iii', self.dir_buf, beginIndex, 0, 0,
-                                 int(self.num_of_fields))  # block_id,number_of_data_blocks,number_of_fields
-
-                beginIndex = beginIndex + struct.calcsize('!iii')
 
-                # the following is to write the field name,field type and field length into the buffer in turn
+                # the following is to read the field name,field type and field length in turn
                 for i in range(int(self.num_of_fields)):
                     field_name = input("please input the name of field " + str(i) + " :")
 
@@ -138,16 +361,12 @@ class Storage(object):
                     field_length = input("please input the length of field " + str(i) + " :")
                     temp_tuple = (field_name, int(field_type), int(field_length))
                     self.field_name_list.append(temp_tuple)
-                    if isinstance(field_name, str):
-                        field_name = field_name.encode('utf-8')
 
-                    struct.pack_into('!10sii', self.dir_buf, beginIndex, field_name, int(field_type),
-                                     int(field_length))
-                    beginIndex = beginIndex + struct.calcsize('!10sii')
-
-                self.f_handle.seek(0)
-                self.f_handle.write(self.dir_buf)
-                self.f_handle.flush()
+                # the new tables store their records in binary format
+                self.table_flags = NEW_TABLE_FLAGS
+                self.dir_buf = pack_table_head(self.field_name_list, self.table_flags)
+                global_buffer_pool.write_block(self.file_name, 0, self.dir_buf)
+                global_buffer_pool.flush_file(self.file_name)
 
         else:  # there is something in the file
 
@@ -166,46 +385,382 @@ class Storage(object):
                 temp_tuple = (field_name, field_type, field_length)
                 self.field_name_list.append(temp_tuple)
                 print("the " + str(i) + "th field information (field name,field type,field length) is ", temp_tuple)
+
+            # the table options follow the fields, the tables created before them have no options
+            beginIndex = beginIndex + self.num_of_fields * struct.calcsize('!10sii')
+            self.table_flags = 0
+            if beginIndex + struct.calcsize(TABLE_OPTIONS_FORMAT) <= BLOCK_SIZE:
+                magic, flags = struct.unpack_from(TABLE_OPTIONS_FORMAT, self.dir_buf, beginIndex)
+                if magic == TABLE_OPTIONS_MAGIC:
+                    self.table_flags = flags
+
+            if self.table_flags & TABLE_FLAG_COMPRESSED:
+                self._read_extent_map()
+            if self.table_flags & TABLE_FLAG_PARTITIONED:
+                self.partition_spec = partition_db.PartitionSpec.unpack(
+                    self.dir_buf, beginIndex + struct.calcsize(TABLE_OPTIONS_FORMAT))
         # print self.field_name_list
-        record_head_len = struct.calcsize('!ii10s')
-        record_content_len = sum(map(lambda x: x[2], self.field_name_list))
-        # print record_content_len
-
-        Flag = 1
-        while Flag <= self.data_block_num:
-            self.f_handle.seek(BLOCK_SIZE * Flag)
-            self.active_data_buf = self.f_handle.read(BLOCK_SIZE)
-            self.block_id, self.Number_of_Records = struct.unpack_from('!ii', self.active_data_buf, 0)
-            print('Block_ID=%s,   Contains %s data' % (self.block_id, self.Number_of_Records))
-            # There exists record
-            if self.Number_of_Records > 0:
-                for i in range(self.Number_of_Records):
-                    self.record_Position.append((Flag, i))
-                    offset = \
-                        struct.unpack_from('!i', self.active_data_buf,
-                                           struct.calcsize('!ii') + i * struct.calcsize('!i'))[
-                            0]
-                    record = struct.unpack_from('!' + str(record_content_len) + 's', self.active_data_buf,
-                                                offset + record_head_len)[0]
-                    tmp = 0
-                    tmpList = []
-                    for field in self.field_name_list:
-                        t = record[tmp:tmp + field[2]].strip()
-                        tmp = tmp + field[2]
-                        if field[1] == 2:  # INTEGER
-                            if isinstance(t, bytes):
-                                t = t.decode('utf-8').strip()
-                            t = int(t)
-                        elif field[1] == 3:  # BOOLEAN
-                            if isinstance(t, bytes):
-                                t = t.decode('utf-8').strip()
-                            t = t.lower() in ('true', '1', 'yes', 't')
-                        else:  # STRING or VARSTRING
-                            if isinstance(t, bytes):
-                                t = t.decode('utf-8').strip()
-                        tmpList.append(t)
-                    self.record_list.append(tuple(tmpList))
-            Flag += 1
+
+        # one precompiled codec encodes and decodes the records of the table
+        table_flags = getattr(self, 'table_flags', 0)
+        self.codec = codec_db.get_codec(self.field_name_list, table_flags & TABLE_FLAG_BINARY,
+                                        table_flags & TABLE_FLAG_VARSTR)
+
+        # the free space map and the zone map (which lets a scan skip the blocks which cannot contain a wanted
+        # record) of a table which has none, e.g. it was created before, are built when it is written,
+        # see _ensure_maps(), so that reading a table creates no file
+        self.fsm = page_db.FreeSpaceMap(tablename + '.fsm'.encode('utf-8'))
+        self.zonemap = zonemap_db.ZoneMap(tablename + '.zmp'.encode('utf-8'), self.field_name_list)
+
+    # ------------------------------
+    # to create a table without asking for its fields
+    # input:
+    #       tablename: e.g. b'student'
+    #       fields: list of (field name, field type, field length), the type is 0->str,1->varstr,2->int,3->bool
+    #       partition: None, ('RANGE', field name, [bound, ...]) or ('HASH', field name, number of partitions),
+    #                  see partition_db.py
+    # output:
+    #       the Storage object of the new table
+    # -------------------------------------
+    @classmethod
+    def create(cls, tablename, fields, use_mmap=False, partition=None):
+        if isinstance(tablename, str):
+            tablename = tablename.encode('utf-8')
+        tablename = tablename.strip()
+        file_name = tablename + '.dat'.encode('utf-8')
+        if global_buffer_pool.num_blocks(file_name) > 0:
+            raise ValueError("table %s already exists" % tablename.decode('utf-8'))
+
+        fields = check_fields(fields)
+        if partition is None:
+            dir_buf = pack_table_head(fields, NEW_TABLE_FLAGS)
+        else:
+            dir_buf = pack_table_head(fields, NEW_TABLE_FLAGS | TABLE_FLAG_PARTITIONED,
+                                      partition_db.PartitionSpec.declare(fields, partition))
+        global_buffer_pool.write_block(file_name, 0, dir_buf)
+        global_buffer_pool.flush_file(file_name)
+        return cls(tablename, use_mmap)
+
+    # ------------------------------
+    # all the records of the table in main memory, they are read from the file at the first use
+    # -------------------------------------
+    @property
+    def record_list(self):
+        if self._record_list is None:
+            self._load_records()
+        return self._record_list
+
+    @record_list.setter
+    def record_list(self, record_list):
+        self._record_list = record_list
+
+    # ------------------------------
+    # the (block id, slot) of each record in record_list
+    # -------------------------------------
+    @property
+    def record_Position(self):
+        if self._record_Position is None:
+            self._load_records()
+        return self._record_Position
+
+    def _load_records(self):
+        self._record_list = []
+        self._record_Position = []
+        for (rid, record) in self.scan_with_rid():
+            self._record_Position.append(rid)
+            self._record_list.append(record)
+
+    # ------------------------------
+    # the records of the table kept column by column, it is built at the first use
+    # output:
+    #       a column_db.ColumnTable
+    # -------------------------------------
+    def column_table(self):
+        if self._column_table is None:
+            self._column_table = column_db.ColumnTable(self.field_name_list, self.scan())
+        return self._column_table
+
+    # ------------------------------
+    # to scan the table block by block
+    # input:
+    #       predicates: list of (field index, operator, typed constant), the blocks in which no record
+    #                   can satisfy all of them are skipped by the zone map, the records read are not checked
+    #       snapshot: a page_db.Snapshot, only the records it sees are read; None for the records
+    #                 which are not deleted now
+    # output:
+    #       a generator of records, only one data block is decoded at a time
+    # -------------------------------------
+    def scan(self, predicates=None, snapshot=None):
+        for (rid, record) in self.scan_with_rid(predicates, snapshot):
+            yield record
+
+    # ------------------------------
+    # to scan the table block by block together with the row identifier of each record
+    # the row identifier (RID) is (block id, slot), it does not change when other records
+    # are deleted; it changes only when update_record() moves the record to another block
+    # or write_block_to_file() rewrites the table
+    # input:
+    #       predicates, snapshot: see scan()
+    # output:
+    #       a generator of (rid, record)
+    # -------------------------------------
+    def scan_with_rid(self, predicates=None, snapshot=None):
+        if self.partition_spec is not None:
+            yield from self._scan_partitions(predicates, snapshot)
+            return
+        if self.use_mmap and self._map is not None:
+            global_buffer_pool.flush_file(self.file_name)  # the blocks changed in the buffer pool must be seen by the map
+        self._extent_cache = None
+        for block_id in range(1, self.data_block_num + 1):
+            if predicates and not self.zonemap.may_match(block_id, predicates):
+                continue
+            for (slot, record) in self._read_block_records(block_id, snapshot=snapshot):
+                yield (block_id, slot), record
+
+    # ------------------------------
+    # to read the records with the given row identifiers
+    # only the blocks which hold one of the records are read, in the order of the blocks
+    # input:
+    #       rids: list of (block id, slot), e.g. from scan_with_rid() or Index.search_key()
+    # output:
+    #       the list of (rid, record) sorted by rid, the rids whose record has been deleted are left out
+    # -------------------------------------
+    def fetch_by_rid(self, rids):
+        if self.partition_spec is not None:
+            return self._fetch_from_partitions(rids)
+        if self.use_mmap and self._map is not None:
+            global_buffer_pool.flush_file(self.file_name)
+        self._extent_cache = None
+        slots_of_block = {}
+        for (block_id, slot) in rids:
+            if 1 <= block_id <= self.data_block_num:
+                slots_of_block.setdefault(block_id, set()).add(slot)
+
+        result = []
+        for block_id in sorted(slots_of_block):
+            slots = slots_of_block[block_id]
+            for (slot, record) in self._read_block_records(block_id, slots):
+                result.append(((block_id, slot), record))
+        return result
+
+    # ------------------------------
+    # to scan the table in several processes, see parallel_db.py
+    # input:
+    #       workers: the number of processes
+    #       predicates: see scan(), the blocks are chosen by the zone map before they are split among the workers
+    #       condition: a compiled condition which the records must satisfy, None for all the records
+    #       snapshot: see scan()
+    # output:
+    #       a generator of records in the order of the blocks
+    # -------------------------------------
+    def parallel_scan(self, workers, predicates=None, condition=None, snapshot=None):
+        if self.partition_spec is not None:
+            return itertools.chain.from_iterable(
+                partition.parallel_scan(workers, predicates, condition, snapshot)
+                for (part_no, partition) in self._matching_partitions(predicates))
+        global_buffer_pool.flush_file(self.file_name)  # the workers read the file, not the buffer pool
+        block_ids = [block_id for block_id in range(1, self.data_block_num + 1)
+                     if not predicates or self.zonemap.may_match(block_id, predicates)]
+        return parallel_db.parallel_scan(self.file_name, self.field_name_list, self.codec.binary, self.codec.varlen,
+                                         block_ids, condition, workers, self.extent_blocks, self.extents, snapshot)
+
+    # ------------------------------
+    # decode all the records of one data block
+    # input:
+    #       block_id
+    #       slots: the set of slots to be decoded, None for all the records of the block
+    #       snapshot: see scan()
+    # output:
+    #       the list of (slot, record) in the block
+    # -------------------------------------
+    def _read_block_records(self, block_id, slots=None, snapshot=None):
+        if self.is_compressed():
+            extent_no, index = divmod(block_id - 1, self.extent_blocks)
+            return self._decode_block(self._read_extent(extent_no), index * BLOCK_SIZE, slots, snapshot)
+        if self.use_mmap:
+            return self._decode_block(self._mapped_buffer(block_id), BLOCK_SIZE * block_id, slots, snapshot)
+
+        block_buf = global_buffer_pool.pin(self.file_name, block_id)
+        try:
+            return self._decode_block(block_buf, 0, slots, snapshot)
+        finally:
+            global_buffer_pool.unpin(self.file_name, block_id)
+
+    # ------------------------------
+    # decode the records of the data block which begins at base in buf
+    # input:
+    #       buf: a frame of the buffer pool or the memory map of the whole file
+    #       base: the position of the block in buf
+    #       slots, snapshot: see _read_block_records()
+    # -------------------------------------
+    def _decode_block(self, buf, base, slots=None, snapshot=None):
+        decode = self.codec.decode
+        content_begin = base + page_db.RECORD_HEAD_LEN
+        if snapshot is None:
+            used = page_db.live_slots(buf, base)
+        else:
+            used = page_db.visible_slots(buf, snapshot, base)
+        return [(slot, decode(buf, content_begin + offset)) for (slot, offset) in used
+                if slots is None or slot in slots]
+
+    # ------------------------------
+    # return the memory map of the file which contains the block
+    # the file is mapped again when it has grown beyond the map
+    # -------------------------------------
+    def _mapped_buffer(self, block_id):
+        if self._map is None or len(self._map) < BLOCK_SIZE * (block_id + 1):
+            global_buffer_pool.flush_file(self.file_name)  # the map only sees what has been written to the file
+            self._close_map()
+            self._map_handle = open(self.file_name, 'rb')
+            self._map = mmap.mmap(self._map_handle.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(self._map) < BLOCK_SIZE * (block_id + 1):
+                raise ValueError('block %d is beyond the end of the table file' % block_id)
+        return self._map
+
+    def _close_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._map_handle is not None:
+            self._map_handle.close()
+            self._map_handle = None
+        if self._extent_handle is not None:
+            self._extent_handle.close()
+            self._extent_handle = None
+        self._extent_cache = None
+
+    # ------------------------------
+    # True if the data blocks of the table are compressed
+    # -------------------------------------
+    def is_compressed(self):
+        return bool(getattr(self, 'table_flags', 0) & TABLE_FLAG_COMPRESSED)
+
+    # ------------------------------
+    # the position of the table options in block 0, the extent map follows them
+    # -------------------------------------
+    def _options_offset(self):
+        return BLOCK_HEAD_LEN + len(self.field_name_list) * FIELD_ENTRY_LEN
+
+    def _read_extent_map(self):
+        offset = self._options_offset() + struct.calcsize(TABLE_OPTIONS_FORMAT)
+        self.extent_blocks, num_extents = struct.unpack_from(EXTENT_HEAD_FORMAT, self.dir_buf, offset)
+        offset += struct.calcsize(EXTENT_HEAD_FORMAT)
+        self.extents = [struct.unpack_from(EXTENT_ENTRY_FORMAT, self.dir_buf, offset + i * struct.calcsize(EXTENT_ENTRY_FORMAT))
+                        for i in range(num_extents)]
+
+    # ------------------------------
+    # the decompressed data blocks of one extent, the last extent read is kept for the next blocks
+    # -------------------------------------
+    def _read_extent(self, extent_no):
+        if self._extent_cache is None or self._extent_cache[0] != extent_no:
+            if self._extent_handle is None:
+                self._extent_handle = open(self.file_name, 'rb')
+            position, length = self.extents[extent_no]
+            self._extent_cache = (extent_no, page_db.read_extent(self._extent_handle, position, length))
+        return self._extent_cache[1]
+
+    # ------------------------------
+    # to compress the data blocks of the table, for the tables which are written once and scanned often
+    # the table stays readable, the first insert, update or delete decompresses it again
+    # input:
+    #       extent_blocks: the number of data blocks which are compressed together,
+    #                      it is raised if the extent map does not fit into block 0
+    # -------------------------------------
+    def compress(self, extent_blocks=COMPRESS_EXTENT_BLOCKS):
+        if self.partition_spec is not None:
+            return all([partition.compress(extent_blocks) for (part_no, partition) in self._matching_partitions(None)])
+        if self.is_compressed():
+            return True
+        self._write_data_block_num()
+        global_buffer_pool.flush_file(self.file_name)
+
+        map_offset = self._options_offset() + struct.calcsize(TABLE_OPTIONS_FORMAT)
+        capacity = (BLOCK_SIZE - map_offset - struct.calcsize(EXTENT_HEAD_FORMAT)) // struct.calcsize(EXTENT_ENTRY_FORMAT)
+        if capacity <= 0:
+            raise ValueError("there is no space for the extent map in block 0")
+        extent_blocks = max(extent_blocks, 1, -(-self.data_block_num // capacity))
+
+        extents = []
+        body = []
+        position = BLOCK_SIZE
+        for first in range(1, self.data_block_num + 1, extent_blocks):
+            data = b''.join(global_buffer_pool.read_block(self.file_name, block_id)
+                            for block_id in range(first, min(first + extent_blocks, self.data_block_num + 1)))
+            packed = zlib.compress(data, COMPRESS_LEVEL)
+            extents.append((position, len(packed)))
+            body.append(packed)
+            position += len(packed)
+
+        dir_buf = bytearray(global_buffer_pool.read_block(self.file_name, 0))
+        struct.pack_into(TABLE_OPTIONS_FORMAT, dir_buf, self._options_offset(), TABLE_OPTIONS_MAGIC,
+                         self.table_flags | TABLE_FLAG_COMPRESSED)
+        struct.pack_into(EXTENT_HEAD_FORMAT, dir_buf, map_offset, extent_blocks, len(extents))
+        for (i, extent) in enumerate(extents):
+            struct.pack_into(EXTENT_ENTRY_FORMAT, dir_buf,
+                             map_offset + struct.calcsize(EXTENT_HEAD_FORMAT) + i * struct.calcsize(EXTENT_ENTRY_FORMAT),
+                             *extent)
+        self._replace_file([bytes(dir_buf)] + body)
+
+        self.table_flags |= TABLE_FLAG_COMPRESSED
+        self.dir_buf = bytes(dir_buf)
+        self.extent_blocks = extent_blocks
+        self.extents = extents
+        self.version = bump_table_version(self.tablename)
+        print(f"{self.data_block_num} data blocks have been compressed into {position - BLOCK_SIZE} bytes")
+        return True
+
+    # ------------------------------
+    # a compressed table is decompressed before it is modified
+    # -------------------------------------
+    def _ensure_writable(self):
+        if not self.is_compressed():
+            self._ensure_maps()
+            return
+        data = b''.join(self._read_extent(extent_no) for extent_no in range(len(self.extents)))
+
+        dir_buf = bytearray(global_buffer_pool.read_block(self.file_name, 0))
+        flags = self.table_flags & ~TABLE_FLAG_COMPRESSED
+        struct.pack_into(TABLE_OPTIONS_FORMAT, dir_buf, self._options_offset(), TABLE_OPTIONS_MAGIC, flags)
+        map_offset = self._options_offset() + struct.calcsize(TABLE_OPTIONS_FORMAT)
+        dir_buf[map_offset:] = bytes(BLOCK_SIZE - map_offset)
+        self._replace_file([bytes(dir_buf), data[:self.data_block_num * BLOCK_SIZE]])
+
+        self.table_flags = flags
+        self.dir_buf = bytes(dir_buf)
+        self.extent_blocks = 0
+        self.extents = []
+        self._rebuild_free_space_map()
+        self._ensure_maps()
+        self.version = bump_table_version(self.tablename)
+        print("the data blocks of the table have been decompressed")
+
+    # ------------------------------
+    # build the free space map and the zone map from the data blocks if the table has none
+    # -------------------------------------
+    def _ensure_maps(self):
+        if getattr(self, 'data_block_num', 0) == 0:
+            return
+        if not self.fsm.exists():
+            self._rebuild_free_space_map()
+        if not self.zonemap.exists():
+            self._rebuild_zone_map()
+
+    # ------------------------------
+    # replace the table file by the given content, the blocks of the old file in the buffer pool are dropped
+    # the new content is written into a temporary file which is then renamed, so the table is never half written;
+    # the log records before it are never redone in the new file
+    # -------------------------------------
+    def _replace_file(self, chunks):
+        self._close_map()
+        global_buffer_pool.reset_page_lsns(self.file_name)
+        temp_name = self.file_name + '.tmp'.encode('utf-8')
+        with open(temp_name, 'wb') as f_handle:
+            for chunk in chunks:
+                f_handle.write(chunk)
+            f_handle.flush()
+            os.fsync(f_handle.fileno())
+        global_buffer_pool.close_file(self.file_name, discard=True)
+        os.replace(temp_name, self.file_name)
 
     # ------------------------------
     # return the record list of the table
@@ -222,6 +777,30 @@ class Storage(object):
     # -------------------------------
     def insert_record(self, insert_record):
         """Insert with transaction logging support"""
+        # example: ['xuyidan','23','123456']
+        return self.insert_many([insert_record])
+
+    # --------------------------------
+    # to insert many records into table, the data blocks are filled in main memory and written once
+    # param rows: list of records, each of which is a list of field values
+    # return: True or False, no record is inserted if one of them is wrong
+    # -------------------------------
+    def insert_many(self, rows):
+        """Insert a batch with one logged change per block"""
+
+        # step 1 : to check every record before anything is written
+        checked_rows = []
+        for row in rows:
+            checked = self._check_record(row)
+            if checked is None:
+                print(f"Error: record {row} does not match the fields of the table")
+                return False
+            checked_rows.append(checked)
+        if not checked_rows:
+            return True
+        if self.partition_spec is not None:
+            return self._insert_into_partitions(checked_rows)
+        self._ensure_writable()
 
         if self.current_transaction_id is None:
             print("Warning: No active transaction. Starting auto-transaction.")
@@ -229,122 +808,295 @@ class Storage(object):
             auto_commit = True
         else:
             auto_commit = False
+        # the records are put into blocks in which other transactions may also write, but not into a table
+        # which is being loaded or vacuumed
+        self._lock_table(auto_commit, LOCK_IX)
+
+        # step 2: put each record into a block with enough free space, the block is found in the free space map;
+        # the block is latched while the records are put into it and each new record is locked until the commit
+        target_block_id = None
+        block_buf = None
+        block_records = []  # the records put into the current block
+        waiting_rows = []  # the new records whose lock is taken after the block has been released
+        try:
+            for tmpRecord in checked_rows:
+                record = self._pack_record(tmpRecord, self.current_transaction_id)
+                slot = None
+                if block_buf is not None:
+                    slot = page_db.insert_into_page(block_buf, record)
+
+                if slot is None:  # the block is full, another one is used
+                    if block_buf is not None:
+                        self._release_block(target_block_id, block_buf, block_records)
+                        block_records = []
+                        block_buf = None
+                    target_block_id = self.fsm.find(len(record) + page_db.SLOT_LEN, self.data_block_num)
+                    if target_block_id is not None:
+                        block_buf = self._acquire_block(target_block_id)
+                        slot = page_db.insert_into_page(block_buf, record)
+                        if slot is None:  # another writer has filled the block in the meantime
+                            self._release_block(target_block_id, block_buf)
+                            block_buf = None
+                    if slot is None:
+                        target_block_id, block_buf = self._allocate_data_block()
+                        slot = page_db.insert_into_page(block_buf, record)
+                        if slot is None:
+                            raise ValueError("Record size too large for block size")
+                block_records.append(tmpRecord)
+                if not global_lock_manager.lock_row(self.current_transaction_id, self.file_name,
+                                                    target_block_id, slot, LOCK_X, wait=False):
+                    waiting_rows.append((target_block_id, slot))  # the slot of a record deleted by another one
+
+                if self._record_list is not None:
+                    self._record_list.append(tmpRecord)
+                if self._record_Position is not None:
+                    self._record_Position.append((target_block_id, slot))
+                if self._column_table is not None:
+                    self._column_table.append(tmpRecord)
+
+            if block_buf is not None:
+                self._release_block(target_block_id, block_buf, block_records)
+                block_buf = None
+            for (block_id, slot) in waiting_rows:
+                global_lock_manager.lock_row(self.current_transaction_id, self.file_name, block_id, slot, LOCK_X)
+        except Exception:
+            if block_buf is not None:
+                self._release_block(target_block_id, block_buf, block_records)
+            if auto_commit:
+                global_transaction_manager.abort_transaction(self.current_transaction_id)
+                self.current_transaction_id = None
+            raise
 
-        # example: ['xuyidan','23','123456']
+        # step 3: data_block_num has been written when a block was added, every block is written once when the file is flushed;
+        # the maps are written before the data blocks, a zone map may be wider than its blocks but never narrower
+        self.fsm.flush()
+        self.zonemap.flush()
+        global_buffer_pool.flush_file(self.file_name)
+        self.version = bump_table_version(self.tablename)
+
+        # Auto-commit if we started the transaction
+        if auto_commit:
+            global_transaction_manager.commit_transaction(self.current_transaction_id)
+            self.current_transaction_id = None
+
+        return True
+
+    # --------------------------------
+    # to load many records at the end of the table, e.g. from a file (see bulk_db.py)
+    # the new blocks are filled in main memory and written one at a time, the records are not
+    # logged one by one: only the change of block 0 is logged, it holds the old number of
+    # data blocks, so an abort takes the number back and cuts the appended blocks off again
+    # (see _tables_rolled_back()); the table file is fsynced before the transaction can commit
+    # param rows: an iterable of records, each of which is a list of field values
+    # return: the number of loaded records, ValueError if a record is wrong (nothing is loaded then)
+    # -------------------------------
+    def bulk_load(self, rows):
+        if self.partition_spec is not None:
+            return self._bulk_load_partitions(rows)
+        self._ensure_writable()
+        if self.current_transaction_id is None:
+            self.current_transaction_id = global_transaction_manager.begin_transaction()
+            auto_commit = True
+        else:
+            auto_commit = False
+        # the blocks are appended without latches, no other transaction writes the table meanwhile
+        self._lock_table(auto_commit)
+        self._refresh_data_block_num()
+
+        old_block_num = self.data_block_num
+        loaded = 0
+        packed = []  # the records of the next block
+        block_records = []
+        used_bytes = 0
+        try:
+            for row in rows:
+                checked = self._check_record(row)
+                if checked is None:
+                    raise ValueError(f"record {loaded + 1} does not match the fields of the table: {row}")
+                record = self._pack_record(checked, self.current_transaction_id)
+                if not page_db.page_fits(len(packed), used_bytes, len(record)):
+                    if not packed:
+                        raise ValueError("Record size too large for block size")
+                    self._write_loaded_block(packed, block_records)
+                    packed = []
+                    block_records = []
+                    used_bytes = 0
+                packed.append(record)
+                block_records.append(checked)
+                used_bytes += len(record)
+                loaded += 1
+            if packed:
+                self._write_loaded_block(packed, block_records)
+        except Exception:
+            self.data_block_num = old_block_num
+            self._write_data_block_num()
+            if auto_commit:
+                global_transaction_manager.abort_transaction(self.current_transaction_id)
+                self.current_transaction_id = None
+            raise
+
+        self._write_data_block_num()
+        self.fsm.flush()
+        self.zonemap.flush()  # before the data blocks, see insert_many()
+        global_buffer_pool.flush_file(self.file_name)
+        global_buffer_pool.sync_files()  # the appended blocks are not in the log
+        if auto_commit:
+            global_transaction_manager.commit_transaction(self.current_transaction_id)
+            self.current_transaction_id = None
+
+        self._table_changed()  # the records are read again when they are needed
+        return loaded
+
+    # --------------------------------
+    # append a data block with the packed records for bulk_load() and record its free space and zone map entry
+    # -------------------------------
+    def _write_loaded_block(self, packed, block_records):
+        self.data_block_num += 1
+        block_id = self.data_block_num
+        block_buf = page_db.build_page(block_id, packed)
+        global_buffer_pool.write_block(self.file_name, block_id, block_buf)
+        self.fsm.set(block_id, page_db.free_space(block_buf))
+        self.zonemap.set_empty(block_id)
+        self.zonemap.extend(block_id, block_records)
+
+    # --------------------------------
+    # to check one record and convert its field values
+    # param insert_record: list of field values
+    # return: tuple of typed values or None if the record is wrong
+    # -------------------------------
+    def _check_record(self, insert_record):
+        if len(insert_record) != len(self.field_name_list):
+            return None
 
-        # step 1 : to check the insert_record is True or False
         # 同时进行对输入数据进行最终的类型转换
-        
         tmpRecord = []
         for idx in range(len(self.field_name_list)):
-            insert_record[idx] = insert_record[idx].strip()
-            if self.field_name_list[idx][1] == 0 or self.field_name_list[idx][1] == 1:
-                if len(insert_record[idx]) > self.field_name_list[idx][2]:
-                    return False
-                tmpRecord.append(insert_record[idx])
-            if self.field_name_list[idx][1] == 2:
-                try:
-                    tmpRecord.append(int(insert_record[idx]))
-                except:
-                    return False
-            if self.field_name_list[idx][1] == 3:
+            value = insert_record[idx]
+            if isinstance(value, bool):  # e.g. the decoded value of a record which is updated
+                value = '1' if value else '0'
+            if not isinstance(value, str):
+                value = str(value)
+            value = value.strip()
+            field_type, field_length = self.field_name_list[idx][1:]
+            if field_type == 0 or field_type == 1:
+                if len(value.encode('utf-8')) > field_length:
+                    return None  # both formats keep field_length bytes
+                tmpRecord.append(value)
+            elif field_type == 2:
                 try:
-                    tmpRecord.append(bool(insert_record[idx]))
-                except:
-                    return False
-            insert_record[idx] = ' ' * (self.field_name_list[idx][2] - len(insert_record[idx])) + insert_record[idx]
-
-        # step2: Add tmpRecord to record_list ; change insert_record into inputstr
-        inputstr = ''.join(insert_record)
-
-        self.record_list.append(tuple(tmpRecord))
+                    tmpRecord.append(int(value))
+                except ValueError:
+                    return None
+                if not codec_db.INT_MIN <= tmpRecord[-1] <= codec_db.INT_MAX:
+                    return None  # the binary format packs 8 bytes, whatever the field length is
+                if not self.codec.binary and len(str(tmpRecord[-1])) > field_length:
+                    return None  # the text format keeps field_length characters
+            elif field_type == 3:
+                tmpRecord.append(value.lower() in ('true', '1', 'yes', 't'))  # one byte in both formats
 
-        # Step3: To calculate MaxNum in each Data Blocks
-        record_content_len = len(inputstr)
-        record_head_len = struct.calcsize('!ii10s')
-        record_len = record_head_len + record_content_len
-        MAX_RECORD_NUM = (BLOCK_SIZE - struct.calcsize('!i') - struct.calcsize('!ii')) / (
-                record_len + struct.calcsize('!i'))
+        return tuple(tmpRecord)
 
-        # Step4: To calculate new record Position
-        if not len(self.record_Position):
-            self.data_block_num += 1
-            self.record_Position.append((1, 0))
-        else:
-            last_Position = self.record_Position[-1]
-            if last_Position[1] == MAX_RECORD_NUM - 1:
-                self.record_Position.append((last_Position[0] + 1, 0))
-                self.data_block_num += 1
-            else:
-                self.record_Position.append((last_Position[0], last_Position[1] + 1))
+    # --------------------------------
+    # the bytes of one record, namely the record head and the record content
+    # param creator: the transaction which writes the record, 0 if every snapshot sees it
+    # -------------------------------
+    def _pack_record(self, values, creator=0):
+        record_schema_address = struct.calcsize('!iii')
+        content = self.codec.encode(values)
+        return struct.pack(page_db.RECORD_HEAD_FORMAT, record_schema_address, len(content),
+                           page_db.pack_version(creator)) + content
 
-        last_Position = self.record_Position[-1]
-        target_block_id = last_Position[0]
+    # --------------------------------
+    # latch and pin a data block which is to be modified, its content is kept until the change is logged
+    # -------------------------------
+    def _acquire_block(self, block_id):
+        global_lock_manager.latch(self.file_name, block_id).acquire()
+        block_buf = global_buffer_pool.pin(self.file_name, block_id)
+        self._block_images[block_id] = bytes(block_buf)
+        return block_buf
 
-        # Write-Ahead Logging Rule: Log before-image first
-        self.f_handle.seek(BLOCK_SIZE * target_block_id)
-        old_block_data = self.f_handle.read(BLOCK_SIZE)
-        
-        # Log before-image
-        global_transaction_manager.log_before_image(
+    # --------------------------------
+    # log the change of a modified data block, record its free space and unpin it,
+    # only the changed bytes are logged and the block is written back after the log record is on the disk
+    # new_records are the records which have been put into the block, they widen its zone map entry
+    # -------------------------------
+    def _release_block(self, block_id, block_buf, new_records=None):
+        lsn = global_transaction_manager.log_page_update(
             self.current_transaction_id,
-            self.f_handle.name,
-            target_block_id,
-            old_block_data
+            os.fsdecode(self.file_name),
+            block_id,
+            self._block_images.pop(block_id),
+            block_buf
         )
+        self.fsm.set(block_id, page_db.free_space(block_buf))
+        if new_records:
+            self.zonemap.extend(block_id, new_records)
+        global_buffer_pool.unpin(self.file_name, block_id, dirty=True, lsn=lsn or 0)
+        global_lock_manager.latch(self.file_name, block_id).release()
 
-        # Perform the actual write operations
-        # Update data_block_num
-        self.f_handle.seek(0)
-        self.buf = ctypes.create_string_buffer(struct.calcsize('!ii'))
-        struct.pack_into('!ii', self.buf, 0, 0, self.data_block_num)
-        self.f_handle.write(self.buf)
-        self.f_handle.flush()
-
-        # Update data block head
-        self.f_handle.seek(BLOCK_SIZE * last_Position[0])
-        self.buf = ctypes.create_string_buffer(struct.calcsize('!ii'))
-        struct.pack_into('!ii', self.buf, 0, last_Position[0], last_Position[1] + 1)
-        self.f_handle.write(self.buf)
-        self.f_handle.flush()
-
-        # Update data offset
-        offset = struct.calcsize('!ii') + last_Position[1] * struct.calcsize('!i')
-        beginIndex = BLOCK_SIZE - (last_Position[1] + 1) * record_len
-        self.f_handle.seek(BLOCK_SIZE * last_Position[0] + offset)
-        self.buf = ctypes.create_string_buffer(struct.calcsize('!i'))
-        struct.pack_into('!i', self.buf, 0, beginIndex)
-        self.f_handle.write(self.buf)
-        self.f_handle.flush()
-
-        # Update data
-        record_schema_address = struct.calcsize('!iii')
-        update_time = '2016-11-16'  # update time
-        self.f_handle.seek(BLOCK_SIZE * last_Position[0] + beginIndex)
-        self.buf = ctypes.create_string_buffer(record_len)
-        struct.pack_into('!ii10s', self.buf, 0, record_schema_address, record_content_len, update_time.encode('utf-8'))
-        struct.pack_into('!' + str(record_content_len) + 's', self.buf, record_head_len, inputstr.encode('utf-8'))
-        self.f_handle.write(self.buf.raw)
-        self.f_handle.flush()
-
-        # Read the new block data for after-image
-        self.f_handle.seek(BLOCK_SIZE * target_block_id)
-        new_block_data = self.f_handle.read(BLOCK_SIZE)
-        
-        # Log after-image
-        global_transaction_manager.log_after_image(
-            self.current_transaction_id,
-            self.f_handle.name,
-            target_block_id,
-            new_block_data
-        )
+    # --------------------------------
+    # lock the whole table for the transaction until it ends, exclusively by default (see lock_db.py),
+    # the auto-transaction of the caller is aborted if the lock is not granted
+    # -------------------------------
+    def _lock_table(self, auto_commit, mode=LOCK_X):
+        try:
+            global_lock_manager.lock_table(self.current_transaction_id, self.file_name, mode)
+        except RuntimeError:
+            if auto_commit:
+                global_transaction_manager.abort_transaction(self.current_transaction_id)
+                self.current_transaction_id = None
+            raise
 
-        # Auto-commit if we started the transaction
-        if auto_commit:
-            global_transaction_manager.commit_transaction(self.current_transaction_id)
-            self.current_transaction_id = None
+    # --------------------------------
+    # add an empty data block at the end of the table, the number of data blocks is read from block 0
+    # and written back under its latch, so that the writers of other handles never add the same block;
+    # the new number and the empty block are never undone, the blocks added later by other transactions
+    # stay in the table and an undo never brings back what the file held after its end before
+    # output:
+    #       (block id, frame) of the new block, which is latched and pinned as by _acquire_block()
+    # -------------------------------
+    def _allocate_data_block(self):
+        with global_lock_manager.latch(self.file_name, 0):
+            self._refresh_data_block_num()
+            self.data_block_num += 1
+            self._write_data_block_num(redo_only=True)
+            block_id = self.data_block_num
+        block_buf = self._acquire_block(block_id)
+        page_db.init_page(block_buf, block_id)
+        lsn = global_transaction_manager.log_page_update(self.current_transaction_id, os.fsdecode(self.file_name),
+                                                         block_id, self._block_images[block_id], block_buf,
+                                                         redo_only=True)
+        global_buffer_pool.unpin(self.file_name, block_id, dirty=True, lsn=lsn or 0)  # the first change of the block
+        block_buf = global_buffer_pool.pin(self.file_name, block_id)
+        self._block_images[block_id] = bytes(block_buf)
+        self.zonemap.set_empty(block_id)
+        return block_id, block_buf
 
-        return True
+    # --------------------------------
+    # take the number of data blocks from block 0, another handle of the table may have added blocks
+    # or an abort may have taken them back
+    # -------------------------------
+    def _refresh_data_block_num(self):
+        dir_buf = global_buffer_pool.read_block(self.file_name, 0)
+        self.data_block_num = struct.unpack_from('!ii', dir_buf, 0)[1]
+
+    # --------------------------------
+    # compute the free space map from the data blocks
+    # -------------------------------
+    def _rebuild_free_space_map(self):
+        for block_id in range(1, self.data_block_num + 1):
+            block_buf = global_buffer_pool.pin(self.file_name, block_id)
+            self.fsm.set(block_id, page_db.free_space(block_buf))
+            global_buffer_pool.unpin(self.file_name, block_id)
+        self.fsm.flush()
+
+    # --------------------------------
+    # compute the zone map from the data blocks
+    # -------------------------------
+    def _rebuild_zone_map(self):
+        for block_id in range(1, self.data_block_num + 1):
+            self.zonemap.rebuild(block_id, [record for (slot, record) in self._read_block_records(block_id)])
+        self.zonemap.flush()
 
     # ------------------------------
     # show the data structure and its data
@@ -356,7 +1108,7 @@ class Storage(object):
         print('|    '.join(map(lambda x: x[0].decode('utf-8').strip(), self.field_name_list)))  # show the structure
 
         # the following is to show the data of the table
-        for record in self.record_list:
+        for record in self.scan():
             print(record)
 
     # --------------------------------
@@ -368,15 +1120,19 @@ class Storage(object):
     # -----------------------------------
     def delete_table_data(self, tableName):
 
-        # step 1: identify whether the file is still open
+        # step 1: identify whether the file is still open, its blocks in the buffer pool are useless now
         if self.open == True:
-            self.f_handle.close()
+            self._close_map()
             self.open = False
+        bump_table_version(tableName.strip())
+        _table_handles.pop(tableName.strip(), None)
+        if self.partition_spec is not None:
+            for part_no in range(self.partition_spec.num_partitions):
+                self.drop_partition(part_no)
 
-        # step 2: remove the file from os   
-        tableName.strip()
-        if os.path.exists(tableName + '.dat'.encode('utf-8')):
-            os.remove(tableName + '.dat'.encode('utf-8'))
+        # step 2: remove the file from os
+        remove_table_files(tableName.strip())
+        global_lock_manager.drop_latches(self.file_name)
 
         return True
 
@@ -389,18 +1145,63 @@ class Storage(object):
     def getFieldList(self):
         return self.field_name_list
 
+    # ----------------------------------------
+    # close the table: the mapped file is closed and the dirty blocks of the table are written back;
+    # the number of data blocks is already in block 0 (see _allocate_data_block()), so nothing else is written
+    # ------------------------------------------------
+    def close(self):
+        if self.open == True and hasattr(self, 'data_block_num'):
+            self._close_map()
+            self.open = False
+            _open_tables.discard(self)
+            global_buffer_pool.flush_file(self.file_name)
+
     # ----------------------------------------
     # destructor
     # ------------------------------------------------
-    def __del__(self):  # write the metahead information in head object to file
+    def __del__(self):
+        self.close()
 
-        if self.open == True:
-            self.f_handle.seek(0)
-            self.buf = ctypes.create_string_buffer(struct.calcsize('!ii'))
-            struct.pack_into('!ii', self.buf, 0, 0, self.data_block_num)
-            self.f_handle.write(self.buf)
-            self.f_handle.flush()
-            self.f_handle.close()
+    # ----------------------------------------
+    # write block_id and data_block_num into the head of block 0 in the buffer pool, the change is logged in a transaction
+    # redo_only: True if the change is kept when the transaction is undone (see log_page_update())
+    # ------------------------------------------------
+    def _write_data_block_num(self, redo_only=False):
+        with global_lock_manager.latch(self.file_name, 0):
+            dir_buf = global_buffer_pool.pin(self.file_name, 0)
+            old_head = bytes(dir_buf[:struct.calcsize('!ii')])
+            struct.pack_into('!ii', dir_buf, 0, 0, self.data_block_num)
+            lsn = 0
+            if global_transaction_manager.is_transaction_active(self.current_transaction_id) and \
+                    old_head != dir_buf[:len(old_head)]:  # the change is logged like the changes of the data blocks
+                lsn = global_transaction_manager.log_page_update(self.current_transaction_id,
+                                                                 os.fsdecode(self.file_name),
+                                                                 0, old_head, dir_buf[:len(old_head)], redo_only)
+            global_buffer_pool.unpin(self.file_name, 0, dirty=True, lsn=lsn or 0)
+
+    # ----------------------------------------
+    # the table has been changed by this object: the records kept in main memory are read again when
+    # they are needed, and the other handles of the table in the handle cache are out of date
+    # ------------------------------------------------
+    def _table_changed(self):
+        self._record_list = None
+        self._record_Position = None
+        self._column_table = None
+        self.version = bump_table_version(self.tablename)
+
+    # ----------------------------------------
+    # the records of the table have got other row identifiers, the index which points to the old ones is dropped
+    # ------------------------------------------------
+    def _records_moved(self):
+        if drop_index(self.tablename):
+            print(f"the index of table {self.tablename.decode('utf-8')} has been dropped "
+                  f"since its records have been moved, it must be created again")
+
+    # ----------------------------------------
+    # set the transaction to which the following insert, delete and update belong
+    # ------------------------------------------------
+    def set_transaction(self, trans_id):
+        self.current_transaction_id = trans_id
 
 
 # ----------------------------------------
@@ -410,6 +1211,9 @@ class Storage(object):
     # Fei Yuan: 更新记录中指定字段的值.该函数实现了按字段值更新记录的功能，支持所有数据类型(STRING, VARSTRING, INTEGER, BOOLEAN)。会对字段类型进行验证并进行相应的类型转换。
     def update_record(self, field_name, old_value, new_value):
         """Update with transaction logging support"""
+        if self.partition_spec is not None:
+            return self._update_partitions(field_name, old_value, new_value)
+        self._ensure_writable()
         if self.current_transaction_id is None:
             print("Warning: No active transaction. Starting auto-transaction.")
             self.current_transaction_id = global_transaction_manager.begin_transaction()
@@ -450,59 +1254,77 @@ class Storage(object):
                 if len(new_value) > field_length:
                     raise ValueError(f"New value exceeds maximum length of {field_length}")
 
-            # Log before-image of entire file state before any changes
-            current_pos = self.f_handle.tell()
-            self.f_handle.seek(0)
-            entire_file_before = self.f_handle.read()
-            self.f_handle.seek(current_pos)
-            
-            global_transaction_manager.log_before_image(
-                self.current_transaction_id,
-                self.f_handle.name,
-                0,  # Using 0 as a special block_id for entire file
-                entire_file_before
-            )
-
-            # Update matching records
+            # Update matching records in place, only the blocks which contain them are logged and written;
+            # with MVCC_SNAPSHOTS the old records are deleted and the new versions are inserted
             updated = False
-            for i in range(len(self.record_list)):
-                record = list(self.record_list[i])
-                current_value = record[field_index]
-                
-                if field_type in [0, 1]:  # STRING or VARSTRING
-                    if isinstance(current_value, bytes):
-                        current_value = current_value.decode('utf-8').strip()
-                    if isinstance(old_value, bytes):
-                        old_value = old_value.decode('utf-8').strip()
-                        
-                    if current_value == old_value:
-                        padded_new_value = new_value.ljust(field_length)
-                        record[field_index] = padded_new_value
-                        self.record_list[i] = tuple(record)
-                        updated = True
-                        
-                else:  # INTEGER or BOOLEAN
-                    if current_value == old_value:
-                        record[field_index] = new_value
-                        self.record_list[i] = tuple(record)
-                        updated = True
+            moved_records = []
+            # each block is read and changed under its latch, a record which is locked by another
+            # transaction is waited for without the latch and the block is read again
+            block_id = 1
+            while block_id <= self.data_block_num:
+                locked_slot = None
+                with global_lock_manager.latch(self.file_name, block_id):
+                    block_buf = global_buffer_pool.pin(self.file_name, block_id)
+                    touched = False
+                    new_records = []
+                    try:
+                        for (slot, record) in self._decode_block(block_buf, 0):
+                            record = list(record)
+                            current_value = record[field_index]
+
+                            if field_type in [0, 1]:  # STRING or VARSTRING
+                                if isinstance(current_value, bytes):
+                                    current_value = current_value.decode('utf-8').strip()
+                                if isinstance(old_value, bytes):
+                                    old_value = old_value.decode('utf-8').strip()
+
+                            if current_value != old_value:
+                                continue
+                            if not global_lock_manager.lock_row(self.current_transaction_id, self.file_name,
+                                                                block_id, slot, LOCK_X, wait=False):
+                                locked_slot = slot
+                                break
+
+                            record[field_index] = new_value
+                            checked = self._check_record(record)
+                            if checked is None:
+                                raise ValueError(f"Invalid value '{new_value}' for field '{field_name}'")
+                            if not touched:
+                                self._acquire_block(block_id)  # keep the block before any changes
+                                touched = True
+                            new_record = self._pack_record(checked, self.current_transaction_id)
+                            old_length = page_db.record_len(block_buf, page_db.slot_offset(block_buf, slot))
+                            if common_db.MVCC_SNAPSHOTS:  # the old version is kept for the snapshots which see it
+                                page_db.mark_deleted(block_buf, slot, self.current_transaction_id)
+                                moved_records.append(checked)
+                            elif len(new_record) >= old_length and \
+                                    page_db.replace_in_page(block_buf, slot, new_record):
+                                new_records.append(checked)
+                            else:  # the old record keeps its space until the commit, an undo may need it again;
+                                # the new record is inserted like a longer one which does not fit into the block
+                                page_db.mark_deleted(block_buf, slot, self.current_transaction_id)
+                                moved_records.append(checked)
+                            updated = True
+                    finally:
+                        if touched:
+                            self._release_block(block_id, block_buf, new_records)  # Log the change
+                        global_buffer_pool.unpin(self.file_name, block_id)
+                if locked_slot is not None:
+                    global_lock_manager.lock_row(self.current_transaction_id, self.file_name,
+                                                 block_id, locked_slot, LOCK_X)
+                    continue
+                block_id += 1
+
+            if moved_records:
+                self.insert_many(moved_records)
+                self._records_moved()
 
             if updated:
-                self.write_block_to_file()
-                
-                # Log after-image
-                current_pos = self.f_handle.tell()
-                self.f_handle.seek(0)
-                entire_file_after = self.f_handle.read()
-                self.f_handle.seek(current_pos)
-                
-                global_transaction_manager.log_after_image(
-                    self.current_transaction_id,
-                    self.f_handle.name,
-                    0,
-                    entire_file_after
-                )
-                
+                self.fsm.flush()
+                self.zonemap.flush()  # before the data blocks, see insert_many()
+                global_buffer_pool.flush_file(self.file_name)
+                self._table_changed()  # the records are read again when they are needed
+
                 print(f"Successfully updated records where {field_name}='{old_value}' to '{new_value}'")
             else:
                 print(f"No records found with {field_name}='{old_value}'")
@@ -521,62 +1343,37 @@ class Storage(object):
     # Fei Yuan: 将当前记录列表写入文件，动态计算块大小和记录分布。
     def write_block_to_file(self):
         """Write block to file with existing logic"""
+        if self.partition_spec is not None:
+            self._call_partitions('write_block_to_file')
+            return
         try:
-            # Calculate record size
-            record_content_len = sum(field[2] for field in self.field_name_list)
-            record_head_len = struct.calcsize('!ii10s')
-            record_len = record_head_len + record_content_len
-            
-            max_records_per_block = (BLOCK_SIZE - struct.calcsize('!ii')) // (record_len + struct.calcsize('!i'))
-            if max_records_per_block < 1:
-                raise ValueError("Record size too large for block size")
-            
-            num_blocks = (len(self.record_list) + max_records_per_block - 1) // max_records_per_block
-            
+            records = self.record_list  # the records are read before a compressed file is replaced
+            self._ensure_writable()
+            # the records have different lengths if the table has varstr fields, so the blocks are
+            # filled one after another until the next record does not fit
+            num_blocks = 0
+            block_buf = None
+            for record in records:
+                record = self._pack_record(record)
+                if block_buf is None or page_db.insert_into_page(block_buf, record) is None:
+                    if block_buf is not None:
+                        global_buffer_pool.write_block(self.file_name, num_blocks, bytes(block_buf))
+                    num_blocks += 1
+                    block_buf = bytearray(BLOCK_SIZE)
+                    page_db.init_page(block_buf, num_blocks)
+                    if page_db.insert_into_page(block_buf, record) is None:
+                        raise ValueError("Record size too large for block size")
+            if block_buf is not None:
+                global_buffer_pool.write_block(self.file_name, num_blocks, bytes(block_buf))
+
             self.data_block_num = num_blocks
-            self.f_handle.seek(struct.calcsize('!i'))
-            self.f_handle.write(struct.pack('!i', self.data_block_num))
-            
-            for block_num in range(num_blocks):
-                block_buf = ctypes.create_string_buffer(BLOCK_SIZE)
-                
-                start_idx = block_num * max_records_per_block
-                end_idx = min(start_idx + max_records_per_block, len(self.record_list))
-                records_in_block = end_idx - start_idx
-                
-                struct.pack_into('!ii', block_buf, 0, block_num + 1, records_in_block)
-                
-                offset_pos = struct.calcsize('!ii')
-                data_pos = BLOCK_SIZE
-                
-                for i in range(start_idx, end_idx):
-                    record = self.record_list[i]
-                    data_pos -= record_len
-                    
-                    struct.pack_into('!i', block_buf, offset_pos, data_pos)
-                    offset_pos += struct.calcsize('!i')
-                    
-                    record_str = ''
-                    for j, value in enumerate(record):
-                        field_length = self.field_name_list[j][2]
-                        if isinstance(value, str):
-                            padded_value = value.ljust(field_length)[:field_length]
-                        else:
-                            padded_value = str(value).ljust(field_length)[:field_length]
-                        record_str += padded_value
-                    
-                    struct.pack_into('!ii10s' + str(record_content_len) + 's',
-                                   block_buf,
-                                   data_pos,
-                                   0,
-                                   record_content_len,
-                                   b'timestamp',
-                                   record_str.encode('utf-8'))
-                
-                self.f_handle.seek(BLOCK_SIZE * (block_num + 1))
-                self.f_handle.write(block_buf)
-            
-            self.f_handle.flush()
+            self._write_data_block_num()
+            global_buffer_pool.flush_file(self.file_name)
+            self._rebuild_free_space_map()
+            self._rebuild_zone_map()
+            self._record_Position = None  # the records have been moved, the positions are read again when needed
+            self.version = bump_table_version(self.tablename)
+            self._records_moved()
             
         except Exception as e:
             print(f"Error writing to file: {str(e)}")
@@ -584,6 +1381,9 @@ class Storage(object):
     # Yuan Fei: 删除符合条件的记录
     def del_one_record(self, field_name, field_value, field_list):
         """Delete with transaction logging support"""
+        if self.partition_spec is not None:
+            return self._call_partitions('del_one_record', field_name, field_value, field_list)
+        self._ensure_writable()
         if self.current_transaction_id is None:
             print("Warning: No active transaction. Starting auto-transaction.")
             self.current_transaction_id = global_transaction_manager.begin_transaction()
@@ -592,19 +1392,6 @@ class Storage(object):
             auto_commit = False
 
         try:
-            # Log before-image
-            current_pos = self.f_handle.tell()
-            self.f_handle.seek(0)
-            entire_file_before = self.f_handle.read()
-            self.f_handle.seek(current_pos)
-            
-            global_transaction_manager.log_before_image(
-                self.current_transaction_id,
-                self.f_handle.name,
-                0,
-                entire_file_before
-            )
-
             # Existing delete logic
             field_name = field_name.decode('utf-8').strip()
             field_index = -1
@@ -631,39 +1418,50 @@ class Storage(object):
             except ValueError:
                 raise ValueError(f"Invalid value format for field type {field_type}")
             
-            new_record_list = []
+            # the matching records only get their tombstone bit, their space is given back by vacuum
             deleted = False
-            
-            for record in self.record_list:
-                current_value = record[field_index]
-                if field_type in [0, 1]:
-                    if isinstance(current_value, bytes):
-                        current_value = current_value.decode('utf-8').strip()
-                    if isinstance(match_value, bytes):
-                        match_value = match_value.decode('utf-8').strip()
-                    
-                if str(current_value) != str(match_value):
-                    new_record_list.append(record)
-                else:
-                    deleted = True
-            
+            # the blocks are latched and the records are locked as in update_record()
+            block_id = 1
+            while block_id <= self.data_block_num:
+                locked_slot = None
+                with global_lock_manager.latch(self.file_name, block_id):
+                    block_buf = global_buffer_pool.pin(self.file_name, block_id)
+                    touched = False
+                    try:
+                        for (slot, record) in self._decode_block(block_buf, 0):
+                            current_value = record[field_index]
+                            if field_type in [0, 1]:
+                                if isinstance(current_value, bytes):
+                                    current_value = current_value.decode('utf-8').strip()
+                                if isinstance(match_value, bytes):
+                                    match_value = match_value.decode('utf-8').strip()
+
+                            if str(current_value) == str(match_value):
+                                if not global_lock_manager.lock_row(self.current_transaction_id, self.file_name,
+                                                                    block_id, slot, LOCK_X, wait=False):
+                                    locked_slot = slot
+                                    break
+                                if not touched:
+                                    self._acquire_block(block_id)  # keep the block before the change
+                                    touched = True
+                                page_db.mark_deleted(block_buf, slot, self.current_transaction_id)
+                                deleted = True
+                    finally:
+                        if touched:
+                            self._release_block(block_id, block_buf)  # Log the change
+                        global_buffer_pool.unpin(self.file_name, block_id)
+                if locked_slot is not None:
+                    global_lock_manager.lock_row(self.current_transaction_id, self.file_name,
+                                                 block_id, locked_slot, LOCK_X)
+                    continue
+                block_id += 1
+
             if deleted:
-                self.record_list = new_record_list
-                self.write_block_to_file()
-                
-                # Log after-image
-                current_pos = self.f_handle.tell()
-                self.f_handle.seek(0)
-                entire_file_after = self.f_handle.read()
-                self.f_handle.seek(current_pos)
-                
-                global_transaction_manager.log_after_image(
-                    self.current_transaction_id,
-                    self.f_handle.name,
-                    0,
-                    entire_file_after
-                )
-                
+                self.fsm.flush()
+                global_buffer_pool.flush_file(self.file_name)
+                self._table_changed()  # the records are read again when they are needed
+                vacuum_db.notify(self.file_name)
+
                 print(f"Successfully deleted records where {field_name}='{field_value}'")
             else:
                 print(f"No records found with {field_name}='{field_value}'")
@@ -678,3 +1476,333 @@ class Storage(object):
             if auto_commit and self.current_transaction_id:
                 global_transaction_manager.abort_transaction(self.current_transaction_id)
                 self.current_transaction_id = None
+
+    # ------------------------------
+    # VACUUM table: give back the space of the deleted records, move the records of the
+    # half-empty blocks into the blocks before them and cut the empty blocks at the end of the table
+    # the moved records get new row identifiers, so the index of the table is dropped, see drop_index()
+    # it runs in a transaction of its own, like the background vacuum it is put off while
+    # another transaction or a query may still read the deleted records with its snapshot
+    # input:
+    #       fill_factor: the blocks which are used less than this part are emptied if possible
+    # output:
+    #       (number of removed records, number of moved records)
+    # -------------------------------------
+    def vacuum(self, fill_factor=VACUUM_FILL_FACTOR):
+        if self.current_transaction_id is not None:  # the file is cut at once, an abort could not give it back
+            raise ValueError('VACUUM cannot run inside a transaction')
+        if self.partition_spec is not None:  # each partition in a transaction of its own
+            results = [partition.vacuum(fill_factor) for (part_no, partition) in self._matching_partitions(None)]
+            self._table_changed()  # the records are read again when they are needed
+            return sum(result[0] for result in results), sum(result[1] for result in results)
+        self._ensure_writable()
+        self.current_transaction_id = global_transaction_manager.begin_transaction()
+        auto_commit = True
+
+        # the records are moved to other blocks, no other transaction may hold one of them,
+        # and no reader without locks may see a snapshot in which a purged record is not deleted yet
+        self._lock_table(auto_commit)
+        if global_transaction_manager.has_snapshot_readers(exclude=self.current_transaction_id):
+            global_transaction_manager.abort_transaction(self.current_transaction_id)
+            self.current_transaction_id = None
+            print(f"vacuum of {self.tablename.decode('utf-8')} is put off, other transactions or queries "
+                  f"may still read its deleted records")
+            return 0, 0
+
+        # step 1: purge the deleted records inside each block
+        removed = 0
+        for block_id in range(1, self.data_block_num + 1):
+            block_buf = global_buffer_pool.pin(self.file_name, block_id)
+            try:
+                if page_db.num_tombstones(block_buf):
+                    self._acquire_block(block_id)
+                    removed += page_db.purge_page(block_buf)
+                    self._release_block(block_id, block_buf)
+            finally:
+                global_buffer_pool.unpin(self.file_name, block_id)
+
+        # step 2: move the records of the half-empty blocks, from the last block on, into the blocks before them
+        moved = 0
+        usable = BLOCK_SIZE - page_db.PAGE_HEAD_LEN
+        for block_id in range(self.data_block_num, 1, -1):
+            block_buf = global_buffer_pool.pin(self.file_name, block_id)
+            try:
+                used = usable - page_db.free_space(block_buf)
+                if used == 0 or used >= fill_factor * usable:
+                    continue
+                self._acquire_block(block_id)
+                target_block_id = None
+                target_buf = None
+                target_records = []
+                for (slot, record) in self._decode_block(block_buf, 0):
+                    offset = page_db.slot_offset(block_buf, slot)
+                    raw = bytes(block_buf[offset:offset + page_db.record_len(block_buf, offset)])
+                    if target_buf is None or page_db.insert_into_page(target_buf, raw) is None:
+                        if target_buf is not None:
+                            self._release_block(target_block_id, target_buf, target_records)
+                            target_buf = None
+                            target_records = []
+                        target_block_id = self.fsm.find(len(raw) + page_db.SLOT_LEN, block_id - 1)
+                        if target_block_id is None:
+                            break  # the other records stay in the block
+                        target_buf = self._acquire_block(target_block_id)
+                        if page_db.insert_into_page(target_buf, raw) is None:  # the free space map was out of date
+                            self._release_block(target_block_id, target_buf)
+                            target_buf = None
+                            break
+                    target_records.append(record)
+                    page_db.delete_from_page(block_buf, slot)
+                    moved += 1
+                if target_buf is not None:
+                    self._release_block(target_block_id, target_buf, target_records)
+                if page_db.num_slots(block_buf) == 0:
+                    self.zonemap.set_empty(block_id)
+                self._release_block(block_id, block_buf)
+            finally:
+                global_buffer_pool.unpin(self.file_name, block_id)
+
+        # step 3: cut the empty blocks at the end of the table
+        old_block_num = self.data_block_num
+        while self.data_block_num > 0:
+            block_buf = global_buffer_pool.pin(self.file_name, self.data_block_num)
+            empty = page_db.num_slots(block_buf) == 0
+            global_buffer_pool.unpin(self.file_name, self.data_block_num)
+            if not empty:
+                break
+            self.data_block_num -= 1
+        self._write_data_block_num()
+        self.fsm.flush()
+        self.zonemap.flush()  # before the data blocks, see insert_many()
+        global_buffer_pool.flush_file(self.file_name)
+
+        if auto_commit:
+            global_transaction_manager.commit_transaction(self.current_transaction_id)
+            self.current_transaction_id = None
+
+        if self.data_block_num < old_block_num:
+            self._close_map()
+            global_buffer_pool.close_file(self.file_name)
+            global_buffer_pool.reset_page_lsns(self.file_name)  # the cut blocks start again from empty blocks
+            os.truncate(self.file_name, (self.data_block_num + 1) * BLOCK_SIZE)
+        self._table_changed()  # the records are read again when they are needed
+        if moved:
+            self._records_moved()
+        print(f"vacuum removed {removed} deleted records and moved {moved} records, "
+              f"the table has {self.data_block_num} of {old_block_num} data blocks now")
+        return removed, moved
+
+    # ------------------------------
+    # the number of data blocks of the table, including the blocks of its partitions
+    # -------------------------------------
+    def num_data_blocks(self):
+        if self.partition_spec is None:
+            return self.data_block_num
+        return sum(partition.data_block_num for (part_no, partition) in self._matching_partitions(None))
+
+    # ------------------------------
+    # the Storage of one partition of a partitioned table, it is opened at the first use
+    # input:
+    #       part_no: the number of the partition
+    #       create: True if the partition table is created when it does not exist,
+    #               i.e. no record has been put into it yet or it has been dropped
+    # output:
+    #       the Storage, None if the partition does not exist and create is False
+    # -------------------------------------
+    def _partition(self, part_no, create=False):
+        partition = self._partitions.get(part_no)
+        if partition is None:
+            name = partition_db.partition_name(self.tablename, part_no)
+            if global_buffer_pool.num_blocks(name + b'.dat') > 0:
+                partition = Storage(name, self.use_mmap)
+            elif create:
+                partition = Storage.create(name, self.field_name_list, self.use_mmap)
+            else:
+                return None
+            self._partitions[part_no] = partition
+        partition.set_transaction(self.current_transaction_id)
+        return partition
+
+    # ------------------------------
+    # the existing partitions whose records can satisfy the predicates, see partition_db.PartitionSpec.may_match()
+    # output:
+    #       a list of (partition number, Storage of the partition)
+    # -------------------------------------
+    def _matching_partitions(self, predicates):
+        part_nos = self.partition_spec.matching(predicates)
+        partitions = [(part_no, self._partition(part_no)) for part_no in part_nos]
+        return [(part_no, partition) for (part_no, partition) in partitions if partition is not None]
+
+    # ------------------------------
+    # scan_with_rid() of a partitioned table, the row identifier is (partition number, block id, slot)
+    # -------------------------------------
+    def _scan_partitions(self, predicates, snapshot=None):
+        for (part_no, partition) in self._matching_partitions(predicates):
+            for (rid, record) in partition.scan_with_rid(predicates, snapshot):
+                yield (part_no,) + rid, record
+
+    def _fetch_from_partitions(self, rids):
+        rids_of_partition = {}
+        for rid in rids:
+            rids_of_partition.setdefault(rid[0], []).append(rid[1:])
+        result = []
+        for part_no in sorted(rids_of_partition):
+            partition = self._partition(part_no) if 0 <= part_no < self.partition_spec.num_partitions else None
+            if partition is not None:
+                result.extend(((part_no,) + rid, record)
+                              for (rid, record) in partition.fetch_by_rid(rids_of_partition[part_no]))
+        return result
+
+    # ------------------------------
+    # call the method of every existing partition, all the calls belong to one transaction
+    # output:
+    #       the list of the results of the calls
+    # -------------------------------------
+    def _call_partitions(self, method_name, *args):
+        auto_commit = self.current_transaction_id is None
+        if auto_commit:
+            self.current_transaction_id = global_transaction_manager.begin_transaction()
+        try:
+            results = [getattr(partition, method_name)(*args) for (part_no, partition) in self._matching_partitions(None)]
+        except Exception:
+            if auto_commit:
+                global_transaction_manager.abort_transaction(self.current_transaction_id)
+                self.current_transaction_id = None
+            raise
+        if auto_commit:
+            global_transaction_manager.commit_transaction(self.current_transaction_id)
+            self.current_transaction_id = None
+        self._table_changed()  # the records are read again when they are needed
+        return results
+
+    # ------------------------------
+    # insert_many() of a partitioned table, each partition gets its records in one call
+    # input:
+    #       checked_rows: the records checked by _check_record()
+    # -------------------------------------
+    def _insert_into_partitions(self, checked_rows):
+        rows_of_partition = {}
+        for row in checked_rows:
+            rows_of_partition.setdefault(self.partition_spec.partition_of(row), []).append(row)
+
+        auto_commit = self.current_transaction_id is None
+        if auto_commit:
+            self.current_transaction_id = global_transaction_manager.begin_transaction()
+        try:
+            inserted = all(self._partition(part_no, create=True).insert_many(rows)
+                           for (part_no, rows) in sorted(rows_of_partition.items()))
+        except Exception:
+            if auto_commit:
+                global_transaction_manager.abort_transaction(self.current_transaction_id)
+                self.current_transaction_id = None
+            raise
+        if auto_commit:  # the records of all the partitions are inserted or none of them
+            if inserted:
+                global_transaction_manager.commit_transaction(self.current_transaction_id)
+            else:
+                global_transaction_manager.abort_transaction(self.current_transaction_id)
+            self.current_transaction_id = None
+        self._table_changed()  # the records are read again when they are needed
+        return inserted
+
+    # ------------------------------
+    # bulk_load() of a partitioned table, the records are routed to the partitions in batches
+    # -------------------------------------
+    def _bulk_load_partitions(self, rows, batch_rows=10000):
+        auto_commit = self.current_transaction_id is None
+        if auto_commit:
+            self.current_transaction_id = global_transaction_manager.begin_transaction()
+        loaded = 0
+        batches = {}
+        try:
+            for (row_no, row) in enumerate(rows):
+                checked = self._check_record(row)
+                if checked is None:
+                    raise ValueError(f"record {row_no + 1} does not match the fields of the table: {row}")
+                part_no = self.partition_spec.partition_of(checked)
+                batch = batches.setdefault(part_no, [])
+                batch.append(checked)
+                if len(batch) >= batch_rows:
+                    loaded += self._partition(part_no, create=True).bulk_load(batch)
+                    batches[part_no] = []
+            for (part_no, batch) in sorted(batches.items()):
+                if batch:
+                    loaded += self._partition(part_no, create=True).bulk_load(batch)
+        except Exception:
+            if auto_commit:
+                global_transaction_manager.abort_transaction(self.current_transaction_id)
+                self.current_transaction_id = None
+            raise
+        if auto_commit:
+            global_transaction_manager.commit_transaction(self.current_transaction_id)
+            self.current_transaction_id = None
+        self._table_changed()  # the records are read again when they are needed
+        return loaded
+
+    # ------------------------------
+    # update_record() of a partitioned table
+    # a record whose partition field changes may belong to another partition, so it is deleted and inserted again
+    # -------------------------------------
+    def _update_partitions(self, field_name, old_value, new_value):
+        field_index = self.partition_spec.field_index
+        if self.field_name_list[field_index][0].decode('utf-8').strip() != field_name:
+            return self._call_partitions('update_record', field_name, old_value, new_value)
+
+        field_type = self.field_name_list[field_index][1]
+        if field_type == 2:  # INTEGER
+            try:
+                key = int(old_value)
+            except ValueError:
+                raise ValueError("Invalid integer format")
+        elif field_type == 3:  # BOOLEAN
+            key = old_value.lower() in ('true', '1', 'yes')
+        else:
+            key = old_value
+        # the moved records are checked with the new value before any of them is deleted
+        moved = []
+        for record in self.scan():
+            if record[field_index] == key:
+                record = list(record)
+                record[field_index] = new_value
+                checked = self._check_record(record)
+                if checked is None:
+                    print(f"Error: record {record} does not match the fields of the table")
+                    return False
+                moved.append(checked)
+
+        auto_commit = self.current_transaction_id is None
+        if auto_commit:
+            self.current_transaction_id = global_transaction_manager.begin_transaction()
+        try:
+            self._call_partitions('del_one_record', field_name.encode('utf-8'), old_value, self.field_name_list)
+            updated = self._insert_into_partitions(moved) if moved else True
+        except Exception:
+            if auto_commit:
+                global_transaction_manager.abort_transaction(self.current_transaction_id)
+                self.current_transaction_id = None
+            raise
+        if auto_commit:  # the old records are deleted only if the new ones are inserted
+            if updated:
+                global_transaction_manager.commit_transaction(self.current_transaction_id)
+            else:
+                global_transaction_manager.abort_transaction(self.current_transaction_id)
+            self.current_transaction_id = None
+        if updated:
+            print(f"{len(moved)} records have been moved to the partition of {new_value}")
+        return updated
+
+    # ------------------------------
+    # drop a partition of a partitioned table at once by removing its files, its records are gone
+    # the partition is created again when a record of its range is inserted
+    # -------------------------------------
+    def drop_partition(self, part_no):
+        if self.partition_spec is None:
+            raise ValueError("table %s is not partitioned" % self.tablename.decode('utf-8'))
+        if not 0 <= part_no < self.partition_spec.num_partitions:
+            raise ValueError("table %s has no partition %d" % (self.tablename.decode('utf-8'), part_no))
+        partition = self._partitions.pop(part_no, None)
+        if partition is not None:
+            partition._close_map()
+            partition.open = False
+        remove_table_files(partition_db.partition_name(self.tablename, part_no))
+        bump_table_version(partition_db.partition_name(self.tablename, part_no))
+        self._table_changed()  # the records are read again when they are needed
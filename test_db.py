@@ -1,3 +1,11 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
 
 
 
@@ -24,3 +32,696 @@ def test_dict():
 
 test_dict()
 
+
+# ------------------------------
+# run a script in a new process whose current directory is work_dir, the modules
+# create their log files and tables there; a crash is simulated by os._exit()
+# output:
+#       the lines printed by the script which begin with 'RESULT '
+# -------------------------------------
+def run_script(work_dir, script):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    result = subprocess.run([sys.executable, '-c', textwrap.dedent(script)], cwd=str(work_dir), env=env,
+                            capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert 'Exception ignored' not in result.stderr, result.stderr  # e.g. a destructor running at exit
+    return [line[len('RESULT '):] for line in result.stdout.splitlines() if line.startswith('RESULT ')]
+
+
+def test_recovery_keeps_committed_rows_of_a_shared_block(tmp_path):
+    run_script(tmp_path, '''
+        import storage_db
+        storage_db.Storage.create(b't', [('id', 2, 8), ('name', 0, 10)]).insert_many([[1, 'a'], [2, 'b']])
+    ''')
+    # T1 inserts and updates in block 1 without committing, T2 inserts into block 1 and commits, then the crash
+    run_script(tmp_path, '''
+        import os
+        import storage_db
+        from transaction_db import global_transaction_manager
+        t1 = storage_db.Storage(b't')
+        t1.set_transaction(global_transaction_manager.begin_transaction())
+        t1.insert_many([[3, 'x']])
+        t1.update_record('name', 'b', 'y')
+        storage_db.Storage(b't').insert_many([[900, 'c']])
+        os._exit(0)
+    ''')
+    assert run_script(tmp_path, '''
+        import storage_db
+        print('RESULT', sorted(storage_db.Storage(b't').scan()))
+    ''') == ["[(1, 'a'), (2, 'b'), (900, 'c')]"]
+
+
+def test_recovery_keeps_blocks_added_after_an_unfinished_transaction(tmp_path):
+    run_script(tmp_path, '''
+        import storage_db
+        storage_db.Storage.create(b't', [('id', 2, 8), ('name', 0, 10)])
+    ''')
+    run_script(tmp_path, '''
+        import os
+        import storage_db
+        from transaction_db import global_transaction_manager
+        t1 = storage_db.Storage(b't')
+        t1.set_transaction(global_transaction_manager.begin_transaction())
+        t1.insert_many([[i, 'lost'] for i in range(300)])
+        storage_db.Storage(b't').insert_many([[1000 + i, 'kept'] for i in range(300)])
+        os._exit(0)
+    ''')
+    assert run_script(tmp_path, '''
+        import storage_db
+        records = list(storage_db.Storage(b't').scan())
+        print('RESULT', len(records), sorted(set(name for (i, name) in records)))
+    ''') == ["300 ['kept']"]
+
+
+def test_abort_takes_back_the_changes_of_the_transaction(tmp_path):
+    result = run_script(tmp_path, '''
+        import storage_db
+        from transaction_db import global_transaction_manager
+        table = storage_db.Storage.create(b't', [('id', 2, 8), ('name', 0, 10)])
+        table.insert_many([[1, 'a'], [2, 'b']])
+        trans_id = global_transaction_manager.begin_transaction()
+        table.set_transaction(trans_id)
+        table.insert_many([[3, 'c']])
+        table.del_one_record(b'id', '1', None)
+        table.update_record('name', 'b', 'bb')
+        global_transaction_manager.abort_transaction(trans_id)
+        table.set_transaction(None)
+        print('RESULT', sorted(storage_db.Storage(b't').scan()))
+        storage_db.Storage(b't').insert_many([[4, 'd']])  # the space of the aborted insert is used again
+        print('RESULT', sorted(storage_db.Storage(b't').scan()))
+    ''')
+    assert result == ["[(1, 'a'), (2, 'b')]", "[(1, 'a'), (2, 'b'), (4, 'd')]"]
+    # the recovery neither redoes the aborted changes nor undoes them again
+    assert run_script(tmp_path, '''
+        import storage_db
+        print('RESULT', sorted(storage_db.Storage(b't').scan()))
+    ''') == ["[(1, 'a'), (2, 'b'), (4, 'd')]"]
+
+
+def test_buffer_pool_leaves_pinned_blocks_and_page_lsns_until_sync(tmp_path):
+    import buffer_db
+    import wal_db
+    wal = wal_db.WalWriter(str(tmp_path / 'wal.log'))
+    pool = buffer_db.BufferPool(4)
+    pool.set_log(wal)
+    file_name = str(tmp_path / 't.dat')
+    lsn_map = pool.track_page_lsns(file_name)
+    try:
+        block_buf = pool.pin(file_name, 1)
+        block_buf[:5] = b'first'
+        pool.unpin(file_name, 1, dirty=True, lsn=wal.append(6, 1, 0, b'first'))
+        block_buf = pool.pin(file_name, 1)
+        block_buf[:4] = b'half'  # a change in progress is never written
+        pool.flush_file(file_name)
+        assert os.path.getsize(file_name) == 0
+        pool.unpin(file_name, 1, dirty=True, lsn=wal.append(6, 1, 0, b'half'))
+
+        pool.flush_file(file_name)
+        with open(file_name, 'rb') as f_handle:
+            assert f_handle.read(buffer_db.BLOCK_SIZE * 2)[buffer_db.BLOCK_SIZE:][:5] == b'halft'
+        # the page LSN reaches its file only after the block has been fsynced
+        assert os.path.getsize(wal_db.page_lsn_file(file_name)) == wal_db.PAGE_LSN_LEN
+        assert lsn_map.get(1) == wal.durable_lsn
+        pool.sync_files()
+        assert os.path.getsize(wal_db.page_lsn_file(file_name)) == 3 * wal_db.PAGE_LSN_LEN
+        assert wal_db.PageLsnMap(file_name).get(1) == wal.durable_lsn
+    finally:
+        pool.close_file(file_name)
+        pool.untrack_page_lsns(file_name)
+        wal.close()
+
+
+def test_abort_cuts_off_the_blocks_of_a_bulk_load(tmp_path):
+    result = run_script(tmp_path, '''
+        import os
+        import storage_db
+        from transaction_db import global_transaction_manager
+        storage_db.Storage.create(b't', [('id', 2, 8), ('name', 0, 10)]).insert_many([[1, 'a']])
+        size = os.path.getsize('t.dat')
+        table = storage_db.Storage(b't')
+        trans_id = global_transaction_manager.begin_transaction()
+        table.set_transaction(trans_id)
+        print('RESULT', table.bulk_load([[i, 'b'] for i in range(1000)]))
+        global_transaction_manager.abort_transaction(trans_id)
+        table = storage_db.Storage(b't')
+        print('RESULT', len(list(table.scan())), os.path.getsize('t.dat') == size)
+        table.insert_many([[2, 'c']])
+        del table
+        print('RESULT', sorted(storage_db.Storage(b't').scan()))
+    ''')
+    assert result == ['1000', '1 True', "[(1, 'a'), (2, 'c')]"]
+
+
+def test_insert_checks_the_width_of_the_stored_values(tmp_path):
+    result = run_script(tmp_path, '''
+        import storage_db
+        table = storage_db.Storage.create(b't', [('id', 2, 2), ('name', 0, 3), ('flag', 3, 1)])
+        print('RESULT', table.insert_many([[1, 'a', 'true'], [123456789, 'abc', 'false']]))
+        print('RESULT', table.insert_many([[2, 'abcd', 'true']]), table.insert_many([[2, 'né', 'true']]),
+              table.insert_many([[2 ** 63, 'a', 'true']]))
+        print('RESULT', sorted(storage_db.Storage(b't').scan()))
+    ''')
+    assert result == ['True', 'False True False', "[(1, 'a', True), (2, 'né', True), (123456789, 'abc', False)]"]
+
+
+def test_export_and_import_round_trip(tmp_path):
+    result = run_script(tmp_path, '''
+        import bulk_db
+        import common_db
+        import lex_db
+        import parser_db
+        import storage_db
+        lex_db.set_lex_handle()
+        parser_db.set_handle()
+        fields = [('id', 2, 4), ('flag', 3, 1), ('to', 0, 5)]
+        table = storage_db.Storage.create(b'import', fields)
+        table.insert_many([[1, 'true', 'a'], [-20, 'false', 'bcd'], [300, 'true', 'é,x']])
+        for suffix in ('csv', 'jsonl', 'txt'):
+            storage_db.Storage.create(b'copy_' + suffix.encode(), fields)
+            export_tree = common_db.global_parser.parse(f"EXPORT import TO 't.{suffix}'", lexer=common_db.global_lexer)
+            import_tree = common_db.global_parser.parse(f"IMPORT copy_{suffix} from 't.{suffix}'",
+                                                        lexer=common_db.global_lexer)
+            bulk_db.execute_statement(export_tree)
+            bulk_db.execute_statement(import_tree)
+            print('RESULT', sorted(storage_db.Storage(b'copy_' + suffix.encode()).scan()))
+        select_tree = common_db.global_parser.parse("select to from import where to = 'a'", lexer=common_db.global_lexer)
+        print('RESULT', select_tree.value, common_db.global_parser.parse("export import INTO 't.csv'",
+                                                                         lexer=common_db.global_lexer))
+    ''')
+    rows = "[(-20, False, 'bcd'), (1, True, 'a'), (300, True, 'é,x')]"
+    assert result == [rows, rows, rows, 'QUERY None']
+
+
+def test_tables_are_closed_before_the_buffer_pool_at_exit(tmp_path):
+    run_script(tmp_path, '''
+        import storage_db
+        table = storage_db.Storage.create(b't', [('id', 2, 4)])
+        table.insert_many([[i] for i in range(500)])
+        cached = storage_db.open_table(b't')
+    ''')
+    result = run_script(tmp_path, '''
+        import storage_db
+        print('RESULT', sorted(storage_db.open_table(b't').scan()) == [(i,) for i in range(500)])
+    ''')
+    assert result == ['True']
+
+
+def test_recovery_builds_the_zone_map_again_when_the_blocks_are_newer(tmp_path):
+    run_script(tmp_path, '''
+        import storage_db
+        storage_db.Storage.create(b't', [('id', 2, 8)]).insert_many([[i] for i in range(10)])
+    ''')
+    old_map = (tmp_path / 't.zmp').read_bytes()
+    # the block with the new record and its page LSN reach the disk, the zone map does not
+    run_script(tmp_path, '''
+        import os
+        import storage_db
+        from buffer_db import global_buffer_pool
+        storage_db.Storage(b't').insert_many([[1000]])
+        global_buffer_pool.sync_files()
+        os._exit(0)
+    ''')
+    (tmp_path / 't.zmp').write_bytes(old_map)
+    assert run_script(tmp_path, '''
+        import storage_db
+        print('RESULT', (1000,) in storage_db.Storage(b't').scan([(0, '>', 500)]))  # the block is not skipped
+    ''') == ['True']
+
+
+def test_vacuum_is_put_off_while_a_snapshot_may_read_the_deleted_records(tmp_path):
+    result = run_script(tmp_path, '''
+        import storage_db
+        from transaction_db import global_transaction_manager
+        table = storage_db.Storage.create(b't', [('id', 2, 4), ('name', 0, 10)])
+        table.insert_many([[i, 'x' if i % 2 else 'y'] for i in range(100)])
+        table.del_one_record(b'name', 'x', table.getFieldList())
+        reader = global_transaction_manager.begin_transaction()
+        print('RESULT', table.vacuum())
+        table.set_transaction(reader)
+        try:
+            table.vacuum()
+        except ValueError as e:
+            print('RESULT', e)
+        table.set_transaction(None)
+        global_transaction_manager.commit_transaction(reader)
+        snapshot = global_transaction_manager.get_snapshot()
+        print('RESULT', table.vacuum())
+        global_transaction_manager.release_snapshot(snapshot)
+        print('RESULT', table.vacuum()[0], sorted(table.scan()) == [(i, 'y') for i in range(0, 100, 2)])
+    ''')
+    assert result == ['(0, 0)', 'VACUUM cannot run inside a transaction', '(0, 0)', '50 True']
+
+
+def test_aborted_transactions_are_not_kept_by_the_checkpoints(tmp_path):
+    result = run_script(tmp_path, '''
+        import storage_db
+        import transaction_db
+        import wal_db
+        from transaction_db import global_transaction_manager
+        table = storage_db.Storage.create(b't', [('id', 2, 4)])
+        for i in range(3):
+            table.set_transaction(global_transaction_manager.begin_transaction())
+            table.insert_many([[i]])
+            global_transaction_manager.abort_transaction(table.current_transaction_id)
+            table.set_transaction(None)
+        global_transaction_manager.checkpoint()
+        checkpoints = [transaction_db.unpack_checkpoint(payload) for (lsn, log_type, trans_id, prev_lsn, payload, end)
+                       in wal_db.read_records(global_transaction_manager.wal.file_name)
+                       if log_type == transaction_db.LOG_CHECKPOINT]
+        snapshot = global_transaction_manager.get_snapshot()
+        print('RESULT', checkpoints[-1][4], list(table.scan(snapshot=snapshot)))
+        global_transaction_manager.release_snapshot(snapshot)
+    ''')
+    assert result == ['[] []']
+
+
+def test_a_bad_crc_ends_the_log_only_in_its_last_record(tmp_path):
+    import pytest
+    import wal_db
+    file_name = str(tmp_path / 'wal.log')
+    wal = wal_db.WalWriter(file_name, segment_size=200)
+    lsns = []
+    for i in range(20):
+        lsns.append(wal.append(6, 1, 0, b'record %d' % i))
+        wal.flush()  # the segment is full after a few writes
+    wal.close()
+    segments = wal_db.list_segments(file_name)
+    assert len(segments) > 2
+    assert [record[0] for record in wal_db.read_records(file_name)] == lsns
+
+    def flip(path, position):
+        with open(path, 'r+b') as f_handle:
+            f_handle.seek(position)
+            byte = f_handle.read(1)
+            f_handle.seek(position)
+            f_handle.write(bytes([byte[0] ^ 0xff]))
+
+    flip(segments[-1][1], os.path.getsize(segments[-1][1]) - 1)  # the torn end of the log
+    assert [record[0] for record in wal_db.read_records(file_name)] == lsns[:-1]
+    flip(segments[-1][1], wal_db.WAL_SEGMENT_HEAD_LEN + wal_db.WAL_RECORD_HEAD_LEN)
+    with pytest.raises(ValueError):
+        list(wal_db.read_records(file_name))
+    flip(segments[-1][1], wal_db.WAL_SEGMENT_HEAD_LEN + wal_db.WAL_RECORD_HEAD_LEN)
+    flip(segments[0][1], os.path.getsize(segments[0][1]) - 1)  # the last record of an older segment
+    with pytest.raises(ValueError):
+        list(wal_db.read_records(file_name))
+
+
+def test_buffer_pool_evicts_with_the_clock_and_counts_its_work(tmp_path):
+    import buffer_db
+    pool = buffer_db.BufferPool(2)
+    file_name = str(tmp_path / 'b.dat')
+    try:
+        for block_id in range(3):
+            block_buf = pool.pin(file_name, block_id)
+            block_buf[:6] = b'block%d' % block_id
+            pool.unpin(file_name, block_id, dirty=True)
+        assert pool.read_block(file_name, 2)[:6] == b'block2'  # still in the pool
+        assert pool.read_block(file_name, 0)[:6] == b'block0'  # evicted, written back and read again
+        stats = pool.get_stats()
+        assert (stats['used_frames'], stats['hits'], stats['misses']) == (2, 1, 4)
+        assert stats['evictions'] == 2 and stats['writes'] >= 1
+        pool.flush_all()
+        with open(file_name, 'rb') as f_handle:
+            data = f_handle.read()
+        assert [data[i * buffer_db.BLOCK_SIZE:][:6] for i in range(3)] == [b'block0', b'block1', b'block2']
+    finally:
+        pool.close_file(file_name)
+
+
+def test_buffer_pool_shrinks_only_when_no_dropped_block_is_pinned(tmp_path):
+    import buffer_db
+    pool = buffer_db.BufferPool(4)
+    file_name = str(tmp_path / 'b.dat')
+    try:
+        for block_id in range(4):
+            pool.pin(file_name, block_id)[:6] = b'block%d' % block_id
+            if block_id < 3:
+                pool.unpin(file_name, block_id, dirty=True)
+        try:
+            pool.set_num_frames(1)
+            assert False, 'the pinned block 3 has been dropped'
+        except RuntimeError:
+            pass
+        assert pool.get_stats()['used_frames'] == 4  # nothing has been dropped
+        assert [pool.read_block(file_name, i)[:6] for i in range(3)] == [b'block0', b'block1', b'block2']
+        pool.unpin(file_name, 3, dirty=True)
+        pool.set_num_frames(1)
+        assert pool.get_stats()['used_frames'] == 1
+        assert [pool.read_block(file_name, i)[:6] for i in range(4)] == [b'block0', b'block1', b'block2', b'block3']
+    finally:
+        pool.close_file(file_name)
+
+
+def test_wal_writer_compresses_large_records_and_reads_them_back(tmp_path):
+    import threading
+    import wal_db
+    file_name = str(tmp_path / 'wal.log')
+    wal = wal_db.WalWriter(file_name, compress_min=64)
+    payloads = [b'small', b'x' * 4000, bytes(range(256))]
+    lsns = [wal.append(6, 1, 0, payload) for payload in payloads]
+
+    def commit(trans_id):  # each waits until its record is durable
+        wal.flush(wal.append(3, trans_id, 0, b''))
+
+    committers = [threading.Thread(target=commit, args=(trans_id,)) for trans_id in range(2, 10)]
+    for committer in committers:
+        committer.start()
+    for committer in committers:
+        committer.join()
+    stats = wal.get_stats()
+    wal.close()
+    assert stats['durable_lsn'] == stats['end_lsn']
+    assert stats['stored_payload_bytes'] < stats['payload_bytes']
+    assert 1 <= stats['fsyncs'] <= len(committers)
+    records = list(wal_db.read_records(file_name))
+    assert [record[4] for record in records[:3]] == payloads
+    assert sorted(record[2] for record in records[3:]) == list(range(2, 10))
+    assert wal_db.read_record(file_name, lsns[1]) == (6, 1, 0, payloads[1])
+
+
+def test_wal_writer_begins_new_segments_and_recycles_the_old_ones(tmp_path):
+    import wal_db
+    file_name = str(tmp_path / 'wal.log')
+    wal = wal_db.WalWriter(file_name, segment_size=1000)
+    lsns = []
+    for trans_id in range(1, 13):
+        lsns.append(wal.append(6, trans_id, 0, os.urandom(300)))
+        wal.flush(lsns[-1])
+    segments = wal_db.list_segments(file_name)
+    assert len(segments) >= 3 and all(os.path.basename(path).startswith('wal.') for (start, path) in segments)
+    oldest_lsn = lsns[6]
+    removed = wal.recycle(oldest_lsn)
+    stats = wal.get_stats()
+    wal.close()
+    assert removed > 0 and stats['recycled_segments'] == removed
+    left = wal_db.list_segments(file_name)
+    assert len(left) == len(segments) - removed and left[0][0] <= oldest_lsn
+    assert [record[0] for record in wal_db.read_records(file_name)] == [lsn for lsn in lsns if lsn >= left[0][0]]
+    assert wal_db.read_record(file_name, lsns[-1])[1] == 12
+    try:
+        wal_db.read_record(file_name, lsns[0])
+        assert False, 'the first record has not been recycled'
+    except ValueError:
+        pass
+
+
+def test_lock_manager_grants_compatible_modes_and_breaks_a_deadlock():
+    import threading
+    import time
+    import lock_db
+    manager = lock_db.LockManager(timeout=10)
+    file_name = b't.dat'
+    assert manager.lock_table(1, file_name, lock_db.LOCK_IS) and manager.lock_table(2, file_name, lock_db.LOCK_IX)
+    assert not manager.lock_table(3, file_name, lock_db.LOCK_S, wait=False)  # S conflicts with IX
+    manager.release_all(2)
+    assert manager.lock_table(3, file_name, lock_db.LOCK_S, wait=False)
+    assert not manager.lock_row(1, file_name, 1, 0, lock_db.LOCK_X, wait=False)  # it needs IX on the table
+    manager.release_all(1)
+    manager.release_all(3)
+
+    # 1 holds row a and waits for row b, 2 holds row b and asks for row a
+    assert manager.lock_row(1, file_name, 1, 0, lock_db.LOCK_X)
+    assert manager.lock_row(2, file_name, 1, 1, lock_db.LOCK_X)
+    granted = []
+    waiter = threading.Thread(target=lambda: granted.append(manager.lock_row(1, file_name, 1, 1, lock_db.LOCK_X)))
+    waiter.start()
+    deadline = time.time() + 5
+    while not manager.get_stats()['waiting'] and time.time() < deadline:
+        time.sleep(0.01)
+    try:
+        manager.lock_row(2, file_name, 1, 0, lock_db.LOCK_X)
+        assert False, 'the deadlock has not been found'
+    except lock_db.DeadlockError:
+        manager.release_all(2)  # the victim aborts
+    waiter.join()
+    assert granted == [True] and manager.get_stats()['deadlocks'] == 1
+    manager.release_all(1)
+    assert manager.get_stats()['locks'] == 0
+
+
+def test_snapshot_keeps_seeing_the_table_as_it_was_at_its_begin(tmp_path):
+    result = run_script(tmp_path, '''
+        import common_db
+        common_db.MVCC_SNAPSHOTS = True
+        import storage_db
+        from transaction_db import global_transaction_manager
+        table = storage_db.Storage.create(b't', [('id', 2, 4), ('name', 0, 10)])
+        table.insert_many([[1, 'a'], [2, 'b']])
+        reader = global_transaction_manager.begin_transaction()
+        snapshot = global_transaction_manager.get_snapshot(reader)
+        writer = storage_db.Storage(b't')
+        writer.set_transaction(global_transaction_manager.begin_transaction())
+        writer.insert_many([[3, 'c']])
+        writer.del_one_record(b'id', '1', writer.getFieldList())
+        print('RESULT', sorted(table.scan(snapshot=snapshot)))  # the writer has not committed yet
+        global_transaction_manager.commit_transaction(writer.current_transaction_id)
+        print('RESULT', sorted(table.scan(snapshot=snapshot)))  # nor before the snapshot was taken
+        global_transaction_manager.commit_transaction(reader)
+        snapshot = global_transaction_manager.get_snapshot()
+        print('RESULT', sorted(storage_db.Storage(b't').scan(snapshot=snapshot)))
+        global_transaction_manager.release_snapshot(snapshot)
+    ''')
+    assert result == ["[(1, 'a'), (2, 'b')]", "[(1, 'a'), (2, 'b')]", "[(2, 'b'), (3, 'c')]"]
+
+
+def test_partitions_take_their_records_and_are_skipped_by_the_predicates(tmp_path):
+    result = run_script(tmp_path, '''
+        import os
+        import storage_db
+        table = storage_db.Storage.create(b'r', [('id', 2, 4), ('name', 0, 10)], partition=('RANGE', 'id', [10, 20]))
+        table.insert_many([[i, 'n%d' % i] for i in range(30)])
+        print('RESULT', [os.path.exists('r$p%d.dat' % part_no) for part_no in range(3)], table.num_data_blocks())
+        print('RESULT', sorted(record[0] for record in table.scan([(0, '<', 5)])) == list(range(10)))
+        table.drop_partition(0)
+        print('RESULT', sorted(record[0] for record in storage_db.Storage(b'r').scan()) == list(range(10, 30)))
+        hashed = storage_db.Storage.create(b'h', [('id', 2, 4)], partition=('HASH', 'id', 4))
+        hashed.insert_many([[i] for i in range(100)])
+        print('RESULT', sorted(storage_db.Storage(b'h').scan()) == [(i,) for i in range(100)],
+              sum(os.path.exists('h$p%d.dat' % part_no) for part_no in range(4)))
+    ''')
+    assert result == ['[True, True, True] 3', 'True', 'True', 'True 4']
+
+
+def test_update_of_the_partition_key_keeps_the_records_when_the_new_value_is_wrong(tmp_path):
+    result = run_script(tmp_path, '''
+        import storage_db
+        from transaction_db import global_transaction_manager
+        table = storage_db.Storage.create(b'r', [('id', 2, 4), ('name', 0, 10)], partition=('RANGE', 'id', [10]))
+        table.insert_many([[1, 'a'], [2, 'b'], [15, 'c']])
+        print('RESULT', table.update_record('id', '1', '123456789012345678901234'), table.update_record('id', '2', '12'))
+        print('RESULT', sorted(storage_db.Storage(b'r').scan()), global_transaction_manager.get_active_transactions())
+    ''')
+    assert result == ['False True', "[(1, 'a'), (12, 'b'), (15, 'c')] []"]
+
+
+def test_recovery_redoes_the_changes_after_a_background_purge(tmp_path):
+    run_script(tmp_path, '''
+        import storage_db
+        table = storage_db.Storage.create(b't', [('id', 2, 4), ('name', 1, 200)])
+        table.insert_many([[i, 'n' * (i % 7 * 9)] for i in range(60)])
+    ''')
+    # the purged block and the records inserted after it are lost, only the log has them
+    run_script(tmp_path, '''
+        import os
+        import shutil
+        import storage_db
+        import vacuum_db
+        from buffer_db import global_buffer_pool
+        table = storage_db.Storage(b't')
+        for i in range(0, 60, 2):
+            table.del_one_record(b'id', str(i), table.getFieldList())
+        global_buffer_pool.sync_files()
+        for suffix in ('.dat', '.lsn'):
+            shutil.copy('t' + suffix, 't.snap' + suffix)
+        print('RESULT', vacuum_db.purge_table(b't.dat'))
+        storage_db.Storage(b't').insert_many([[100 + i, 'w' * 60] for i in range(20)])
+        for suffix in ('.dat', '.lsn'):
+            shutil.copy('t.snap' + suffix, 't' + suffix)
+        os._exit(0)
+    ''')
+    assert run_script(tmp_path, '''
+        import storage_db
+        print('RESULT', sorted(record[0] for record in storage_db.Storage(b't').scan()))
+    ''') == [str(list(range(1, 60, 2)) + list(range(100, 120)))]
+
+
+def test_reading_a_table_creates_no_map_files(tmp_path):
+    (tmp_path / 'Student.dat').write_bytes(open(os.path.join(REPO_DIR, 'Student.dat'), 'rb').read())
+    result = run_script(tmp_path, '''
+        import storage_db
+        table = storage_db.open_table(b'Student')
+        first = next(table.scan())
+        print('RESULT', first in table.scan([(0, '=', first[0])]))
+    ''')
+    assert result == ['True']
+    assert sorted(name for name in os.listdir(tmp_path) if not name.startswith('wal.')) == ['Student.dat']
+    # the maps are built when the table is written
+    run_script(tmp_path, '''
+        import storage_db
+        table = storage_db.open_table(b'Student')
+        table.insert_many([list(next(table.scan()))])
+    ''')
+    assert {'Student.fsm', 'Student.zmp'} <= set(os.listdir(tmp_path))
+
+
+def test_the_cached_handle_is_opened_again_after_a_change_through_another_handle(tmp_path):
+    (tmp_path / 'rows.csv').write_text('id\n2000\n2001\n')
+    result = run_script(tmp_path, '''
+        import bulk_db
+        import storage_db
+        storage_db.Storage.create(b't', [('id', 2, 8)]).insert_many([[i] for i in range(10)])
+        cached = storage_db.open_table(b't')
+        print('RESULT', storage_db.open_table(b't ') is cached, (1000,) in cached.scan())
+        storage_db.Storage(b't').insert_many([[1000]])
+        reopened = storage_db.open_table(b't')
+        print('RESULT', reopened is cached, (1000,) in reopened.scan())
+        bulk_db.import_table('t', 'rows.csv')
+        shared = storage_db.open_table(b't')
+        print('RESULT', (2001,) in shared.scan(), shared.current_transaction_id)
+    ''')
+    assert result == ['True False', 'False True', 'True None']
+
+
+def test_the_index_reads_the_records_by_rid_and_is_dropped_when_they_move(tmp_path):
+    result = run_script(tmp_path, '''
+        import os
+        import index_db
+        import storage_db
+        table = storage_db.Storage.create(b't', [('id', 2, 8), ('name', 0, 10)])
+        table.insert_many([[i, 'x' if i < 180 else 'n%d' % i] for i in range(200)])
+        rids = dict((record[0], rid) for (rid, record) in table.scan_with_rid())
+        print('RESULT', [record for (rid, record) in table.fetch_by_rid([rids[185], rids[5]])])
+        index = index_db.Index('t')
+        index.create_index(table, 'name')
+        print('RESULT', index.fetch_records(table, 'n190'))
+        table.del_one_record(b'name', 'x', table.getFieldList())
+        print('RESULT', table.fetch_by_rid([rids[5]]), table.vacuum()[1] > 0, os.path.exists('t.ind'))
+        print('RESULT', index.fetch_records(table, 'n190'))
+        index = index_db.Index('t')
+        index.create_index(table, 'name')
+        print('RESULT', index.fetch_records(table, 'n190'))
+    ''')
+    assert result == ["[(5, 'x'), (185, 'n185')]", "[(190, 'n190')]", '[] True False', '[]', "[(190, 'n190')]"]
+
+
+def test_varstr_values_are_stored_without_padding(tmp_path):
+    import codec_db
+    fields = [(b'id', 2, 8), (b'name', 1, 20), (b'tag', 0, 4), (b'note', 1, 10)]
+    codec = codec_db.get_codec(fields, True, True)
+    assert codec_db.get_codec(fields, True, True) is codec
+    record = (7, 'abc', 'xy', '')
+    content = codec.encode(record)
+    assert len(content) == 8 + 4 + 2 * 2 + 3  # the fixed fields, the ends of the varstr values and 'abc'
+    assert codec.decode(b'\0' * 5 + content, 5) == record
+    padded = codec_db.get_codec(fields, True)
+    assert len(padded.encode(record)) == 8 + 20 + 4 + 10 and padded.decode(padded.encode(record)) == record
+
+    result = run_script(tmp_path, '''
+        import storage_db
+        table = storage_db.Storage.create(b't', [('id', 2, 8), ('name', 1, 200)])
+        table.insert_many([[i, 'n%d' % i] for i in range(100)])
+        print('RESULT', table.data_block_num, sorted(storage_db.Storage(b't').scan()) == [(i, 'n%d' % i) for i in range(100)])
+    ''')
+    assert result == ['1 True']  # 100 padded records would need 5 blocks
+
+
+def test_a_mapped_table_sees_the_blocks_changed_in_the_buffer_pool(tmp_path):
+    result = run_script(tmp_path, '''
+        import storage_db
+        table = storage_db.Storage.create(b't', [('id', 2, 8)], use_mmap=True)
+        table.insert_many([[i] for i in range(500)])
+        print('RESULT', sorted(table.scan()) == [(i,) for i in range(500)], table._map is not None)
+        table.insert_many([[i] for i in range(500, 1000)])  # the file grows, the map is made again
+        table.del_one_record(b'id', '3', table.getFieldList())
+        records = sorted(table.scan())
+        print('RESULT', len(records), (3,) in records, (999,) in records)
+        rids = [rid for (rid, record) in table.scan_with_rid() if record[0] in (10, 990)]
+        print('RESULT', [record for (rid, record) in table.fetch_by_rid(rids)])
+    ''')
+    assert result == ['True True', '999 False True', '[(10,), (990,)]']
+
+
+def test_column_table_filters_and_projects_whole_columns(tmp_path):
+    import column_db
+    fields = [(b'id', 2, 8), (b'name', 1, 10), (b'ok', 3, 1)]
+    records = [(i, 'n%d' % i, i % 3 == 0) for i in range(20)]
+    table = column_db.ColumnTable(fields, records)
+    assert len(table) == 20 and list(table) == records and table.row(4) == (4, 'n4', False)
+    mask = column_db.mask_and(table.compare(0, '>=', 5), table.compare(2, '=', True))
+    assert list(table.filter(mask)) == [record for record in records if record[0] >= 5 and record[2]]
+    mask = column_db.mask_or(table.compare(1, '=', 'n1'), table.compare(0, '>', 17))
+    assert list(table.filter(mask).project([1])) == [('n1',), ('n18',), ('n19',)]
+
+    result = run_script(tmp_path, '''
+        import storage_db
+        table = storage_db.Storage.create(b't', [('id', 2, 8)])
+        table.insert_many([[i] for i in range(5)])
+        print('RESULT', len(table.column_table()))
+        table.insert_many([[5]])  # the columns are built again at the next use
+        print('RESULT', len(table.column_table()))
+    ''')
+    assert result == ['5', '6']
+
+
+def test_parallel_scan_returns_the_records_of_the_scan_in_their_order(tmp_path):
+    import parallel_db
+    assert parallel_db.split_blocks([1, 2, 3, 4, 5], 2) == [[1, 2, 3], [4, 5]]
+    assert parallel_db.split_blocks([1, 2], 8) == [[1], [2]]
+
+    result = run_script(tmp_path, '''
+        import storage_db
+        table = storage_db.Storage.create(b't', [('id', 2, 8), ('name', 1, 10)])
+        table.insert_many([[i, 'n%d' % (i % 10)] for i in range(3000)])
+        table.del_one_record(b'id', '7', table.getFieldList())
+        print('RESULT', table.data_block_num > 8, list(table.parallel_scan(2)) == list(table.scan()))
+        condition = ('AND', ('CMP', 0, '>', 2900), ('CMP', 1, '=', 'n5'))
+        print('RESULT', list(table.parallel_scan(2, [(0, '>', 2900)], condition)))
+    ''')
+    assert result == ['True True', str([(i, 'n5') for i in range(2905, 3000, 10)])]
+
+
+def test_a_compressed_table_is_read_by_extent_and_decompressed_by_a_write(tmp_path):
+    assert run_script(tmp_path, '''
+        import storage_db
+        table = storage_db.Storage.create(b't', [('id', 2, 8), ('name', 0, 10)])
+        table.insert_many([[i, 'n%d' % (i % 10)] for i in range(3000)])
+        print('RESULT', table.compress(extent_blocks=4))
+    ''') == ['True']
+    data_blocks = run_script(tmp_path, '''
+        import storage_db
+        print('RESULT', storage_db.Storage(b't').data_block_num)
+    ''')
+    assert os.path.getsize(tmp_path / 't.dat') < int(data_blocks[0]) * 4096 // 2
+    result = run_script(tmp_path, '''
+        import storage_db
+        table = storage_db.Storage(b't')
+        records = list(table.scan())
+        print('RESULT', table.is_compressed(), records == [(i, 'n%d' % (i % 10)) for i in range(3000)])
+        rids = [rid for (rid, record) in table.scan_with_rid() if record[0] in (5, 2999)]
+        print('RESULT', [record for (rid, record) in table.fetch_by_rid(rids)], list(table.parallel_scan(2)) == records)
+        table.insert_many([[3000, 'n0']])
+        print('RESULT', table.is_compressed(), list(storage_db.Storage(b't').scan()) == records + [(3000, 'n0')])
+    ''')
+    assert result == ['True True', "[(5, 'n5'), (2999, 'n9')] True", 'False True']
+
+
+def test_a_checkpoint_recycles_the_log_segments_before_its_redo_lsn(tmp_path):
+    result = run_script(tmp_path, '''
+        import common_db
+        common_db.WAL_SEGMENT_SIZE = 4096  # before the log is opened
+        import wal_db
+        import storage_db
+        from transaction_db import global_transaction_manager
+        table = storage_db.Storage.create(b't', [('id', 2, 8)])
+        for i in range(20):
+            table.insert_many([[i * 100 + j] for j in range(100)])
+        before = len(wal_db.list_segments())
+        global_transaction_manager.checkpoint()
+        print('RESULT', before > 2, len(wal_db.list_segments()) < before)
+    ''')
+    assert result == ['True True']
+    assert run_script(tmp_path, '''
+        import storage_db
+        print('RESULT', sorted(storage_db.Storage(b't').scan()) == [(i,) for i in range(2000)])
+    ''') == ['True']
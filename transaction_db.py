@@ -3,14 +3,60 @@
 # Author: Implementation for transaction durability
 # -----------------------------------------------------------------------
 # This module implements transaction durability through logging
-# with before-images, after-images, active and committed transaction tables
+# of block changes, active and committed transaction tables.
+# A change of a block is logged as the byte ranges which differ between the
+# block before and after the change, so the log grows with the size of the change.
+# The change of a data block also keeps the records of the slots it changed: the byte ranges
+# redo the change, but the undo only puts back the records of those slots, so the records
+# which other transactions have put into the same block meanwhile are kept.
+# All the log records are appended to one write-ahead log (see wal_db.py),
+# a commit waits until its commit record is on the disk (group commit).
+# When the manager is created, the tables are recovered from the log (ARIES):
+#       analysis: the transactions which have neither committed nor aborted are found
+#       redo: every change whose block on the disk is older than it is applied again,
+#             the blocks of one file are read in order and the file is written once
+#       undo: the changes of the unfinished transactions are taken back from the last one on,
+#             each undone change is logged as a compensation record, then the transaction is aborted
+# An abort takes back the changes of its transaction in the same way before the abort record is logged.
+# A fuzzy checkpoint is taken by a background thread whenever the log has grown by CHECKPOINT_LOG_BYTES
+# or CHECKPOINT_INTERVAL has passed: the thread first writes back the blocks which have been dirty since
+# the last checkpoint, then logs the active transaction table and the dirty page table without stopping
+# the transactions. The recovery begins its redo at the oldest LSN of the last checkpoint (redo lsn),
+# the log segments before it are removed, so the log and the recovery time stay bounded.
+# Each transaction gets a snapshot at BEGIN: the transactions which were active then and the ones
+# which begin later are not seen by it (see page_db.Snapshot); the records keep the transactions which
+# created and deleted them, so a scan with the snapshot reads the table as it was committed at BEGIN.
 # -----------------------------------------------------------------------
 
-import struct
-import ctypes
+# payload of the log records (see wal_db.py for the record head)
+# ----------------------------------------
+# LOG_BEGIN                         # empty
+# LOG_UPDATE                        # length of table name, table name, block id, number of ranges,
+#                                   # then offset, length, old bytes, new bytes of each range
+# LOG_SLOT_UPDATE                   # the payload of LOG_UPDATE, then number of slots and
+#                                   # slot, length of the old record (-1 if the slot was free), old record of each changed slot
+# LOG_COMMIT, LOG_ABORT             # time
+# LOG_CLR                           # undo next lsn, then the payload of LOG_UPDATE which takes the change back
+# LOG_CHECKPOINT                    # next transaction id, redo lsn, number of active transactions,
+#                                   # number of dirty blocks, number of aborted transactions, then
+#                                   # trans id, first lsn, last lsn of each active transaction,
+#                                   # table name, block id, rec lsn of each dirty block and the aborted trans ids;
+#                                   # an abort takes back all the changes, so the number of aborted transactions
+#                                   # is written as 0, the ids of older checkpoints are read and ignored
+# -------------------------------------------
+
 import os
+import heapq
+import struct
+import threading
 import time
-from common_db import BLOCK_SIZE
+import atexit
+import multiprocessing
+import common_db
+import page_db
+from buffer_db import global_buffer_pool
+from lock_db import global_lock_manager
+import wal_db
 
 # Transaction states
 TRANS_ACTIVE = 1
@@ -19,47 +65,477 @@ TRANS_ABORTED = 3
 
 # Log record types
 LOG_BEGIN = 1
-LOG_BEFORE_IMAGE = 2
-LOG_AFTER_IMAGE = 3
 LOG_COMMIT = 4
 LOG_ABORT = 5
+LOG_UPDATE = 6  # the changed byte ranges of one block, they replace the before-images and after-images (2, 3)
+LOG_CLR = 7  # compensation record: an undone change, it is redone but never undone
+LOG_CHECKPOINT = 8  # the active transaction table and the dirty page table, written by trans id 0
+LOG_SLOT_UPDATE = 9  # the change of a data block, it is undone slot by slot
+
+LOG_NAME_LEN_FORMAT = '!H'  # length of the table name, followed by the name
+LOG_UPDATE_HEAD_FORMAT = '!iH'  # block id, number of ranges
+LOG_RANGE_FORMAT = '!HH'  # offset, length
+LOG_SLOTS_HEAD_FORMAT = '!i'  # number of changed slots
+LOG_SLOT_FORMAT = '!ii'  # slot, length of the old record
+LOG_TIME_FORMAT = '!d'
+LOG_UNDO_NEXT_FORMAT = '!q'
+LOG_CHECKPOINT_HEAD_FORMAT = '!iqiii'  # next transaction id, redo lsn, number of active, dirty, aborted entries
+LOG_ACTIVE_FORMAT = '!iqq'  # trans id, first lsn, last lsn
+LOG_DIRTY_FORMAT = '!iq'  # block id, rec lsn, after the table name
+LOG_ABORTED_FORMAT = '!i'
+DELTA_CHUNK = 32  # the blocks are compared in chunks of this size before the ranges are cut to the changed bytes
+
+
+def page_delta(old_data, new_data):
+    """The byte ranges in which two versions of a block differ: [(offset, old bytes, new bytes), ...]"""
+    size = max(len(old_data), len(new_data))
+    old_data = bytes(old_data).ljust(size, b'\0')
+    new_data = bytes(new_data).ljust(size, b'\0')
+    ranges = []
+    begin = end = None
+    for offset in range(0, size, DELTA_CHUNK):
+        if old_data[offset:offset + DELTA_CHUNK] != new_data[offset:offset + DELTA_CHUNK]:
+            if begin is None:
+                begin = offset
+            end = min(offset + DELTA_CHUNK, size)
+            continue
+        if begin is not None:
+            ranges.append(_cut_range(old_data, new_data, begin, end))
+            begin = None
+    if begin is not None:
+        ranges.append(_cut_range(old_data, new_data, begin, end))
+    return ranges
+
+
+def _cut_range(old_data, new_data, begin, end):
+    """Cut the equal bytes off both ends of a changed range"""
+    while old_data[begin] == new_data[begin]:
+        begin += 1
+    while old_data[end - 1] == new_data[end - 1]:
+        end -= 1
+    return (begin, old_data[begin:end], new_data[begin:end])
+
+
+def apply_delta(buf, ranges, undo=False):
+    """Put the new bytes (redo) or the old bytes (undo) of the ranges into the block"""
+    for (offset, old_bytes, new_bytes) in ranges:
+        data = old_bytes if undo else new_bytes
+        buf[offset:offset + len(data)] = data
+
+
+def pack_update(table_name, block_id, ranges):
+    """Payload of an update record"""
+    name = table_name.encode('utf-8')
+    parts = [struct.pack(LOG_NAME_LEN_FORMAT, len(name)), name,
+             struct.pack(LOG_UPDATE_HEAD_FORMAT, block_id, len(ranges))]
+    for (offset, old_bytes, new_bytes) in ranges:
+        parts.append(struct.pack(LOG_RANGE_FORMAT, offset, len(old_bytes)))
+        parts.append(old_bytes)
+        parts.append(new_bytes)
+    return b''.join(parts)
+
+
+def unpack_update(payload):
+    """(table name, block id, ranges) of an update record"""
+    return _unpack_update_from(payload)[:3]
+
+
+def _unpack_update_from(payload):
+    """(table name, block id, ranges, offset of the bytes after them) of an update record"""
+    name_len = struct.unpack_from(LOG_NAME_LEN_FORMAT, payload, 0)[0]
+    offset = struct.calcsize(LOG_NAME_LEN_FORMAT)
+    table_name = payload[offset:offset + name_len].decode('utf-8')
+    offset += name_len
+    block_id, num_ranges = struct.unpack_from(LOG_UPDATE_HEAD_FORMAT, payload, offset)
+    offset += struct.calcsize(LOG_UPDATE_HEAD_FORMAT)
+    ranges = []
+    for _ in range(num_ranges):
+        range_offset, length = struct.unpack_from(LOG_RANGE_FORMAT, payload, offset)
+        offset += struct.calcsize(LOG_RANGE_FORMAT)
+        ranges.append((range_offset, payload[offset:offset + length], payload[offset + length:offset + 2 * length]))
+        offset += 2 * length
+    return table_name, block_id, ranges, offset
+
+
+def pack_slot_update(table_name, block_id, ranges, slots):
+    """Payload of a slot update record, slots: [(slot, old record or None)]"""
+    parts = [pack_update(table_name, block_id, ranges), struct.pack(LOG_SLOTS_HEAD_FORMAT, len(slots))]
+    for (slot, record) in slots:
+        parts.append(struct.pack(LOG_SLOT_FORMAT, slot, -1 if record is None else len(record)))
+        if record is not None:
+            parts.append(record)
+    return b''.join(parts)
+
+
+def unpack_slot_update(payload):
+    """(table name, block id, ranges, slots) of a slot update record"""
+    table_name, block_id, ranges, offset = _unpack_update_from(payload)
+    num_slots = struct.unpack_from(LOG_SLOTS_HEAD_FORMAT, payload, offset)[0]
+    offset += struct.calcsize(LOG_SLOTS_HEAD_FORMAT)
+    slots = []
+    for _ in range(num_slots):
+        slot, length = struct.unpack_from(LOG_SLOT_FORMAT, payload, offset)
+        offset += struct.calcsize(LOG_SLOT_FORMAT)
+        if length < 0:
+            slots.append((slot, None))
+            continue
+        slots.append((slot, payload[offset:offset + length]))
+        offset += length
+    return table_name, block_id, ranges, slots
+
+
+def undo_slots(buf, block_id, slots):
+    """Put the old records back into their slots, the slots which give space back come first"""
+    def growth(entry):
+        old_record = page_db.record_at(buf, entry[0])
+        return len(entry[1] or b'') - len(old_record or b'')
+
+    for (slot, record) in sorted(slots, key=growth):
+        if not page_db.put_record(buf, slot, record):
+            raise ValueError(f"the record of slot {slot} does not fit into block {block_id} any more")
+
+
+def pack_clr(undo_next_lsn, table_name, block_id, ranges):
+    """Payload of a compensation record, ranges are the ranges which the undo has changed"""
+    return struct.pack(LOG_UNDO_NEXT_FORMAT, undo_next_lsn) + pack_update(table_name, block_id, ranges)
+
+
+def unpack_clr(payload):
+    """(undo next lsn, table name, block id, ranges) of a compensation record"""
+    undo_next_lsn = struct.unpack_from(LOG_UNDO_NEXT_FORMAT, payload, 0)[0]
+    return (undo_next_lsn,) + unpack_update(payload[struct.calcsize(LOG_UNDO_NEXT_FORMAT):])
+
+
+def pack_checkpoint(next_trans_id, redo_lsn, active, dirty, aborted=()):
+    """Payload of a checkpoint record, active: [(trans id, first lsn, last lsn)], dirty: [(table name, block id, rec lsn)]"""
+    parts = [struct.pack(LOG_CHECKPOINT_HEAD_FORMAT, next_trans_id, redo_lsn, len(active), len(dirty), len(aborted))]
+    for entry in active:
+        parts.append(struct.pack(LOG_ACTIVE_FORMAT, *entry))
+    for (table_name, block_id, rec_lsn) in dirty:
+        name = table_name.encode('utf-8')
+        parts.append(struct.pack(LOG_NAME_LEN_FORMAT, len(name)) + name)
+        parts.append(struct.pack(LOG_DIRTY_FORMAT, block_id, rec_lsn))
+    for trans_id in sorted(aborted):
+        parts.append(struct.pack(LOG_ABORTED_FORMAT, trans_id))
+    return b''.join(parts)
+
+
+def unpack_checkpoint(payload):
+    """(next trans id, redo lsn, active, dirty, aborted) of a checkpoint record"""
+    next_trans_id, redo_lsn, num_active, num_dirty, num_aborted = \
+        struct.unpack_from(LOG_CHECKPOINT_HEAD_FORMAT, payload, 0)
+    offset = struct.calcsize(LOG_CHECKPOINT_HEAD_FORMAT)
+    active = []
+    for _ in range(num_active):
+        active.append(struct.unpack_from(LOG_ACTIVE_FORMAT, payload, offset))
+        offset += struct.calcsize(LOG_ACTIVE_FORMAT)
+    dirty = []
+    for _ in range(num_dirty):
+        name_len = struct.unpack_from(LOG_NAME_LEN_FORMAT, payload, offset)[0]
+        offset += struct.calcsize(LOG_NAME_LEN_FORMAT)
+        table_name = payload[offset:offset + name_len].decode('utf-8')
+        offset += name_len
+        dirty.append((table_name,) + struct.unpack_from(LOG_DIRTY_FORMAT, payload, offset))
+        offset += struct.calcsize(LOG_DIRTY_FORMAT)
+    aborted = [struct.unpack_from(LOG_ABORTED_FORMAT, payload, offset + i * struct.calcsize(LOG_ABORTED_FORMAT))[0]
+               for i in range(num_aborted)]
+    return next_trans_id, redo_lsn, active, dirty, aborted
+
+
+class CheckpointThread(threading.Thread):
+    """The thread which writes back the old dirty blocks and takes the checkpoints in the background"""
+
+    def __init__(self, manager, interval=common_db.CHECKPOINT_INTERVAL):
+        threading.Thread.__init__(self, name='checkpoint', daemon=True)
+        self.manager = manager
+        self.interval = interval
+        self.wakeup = threading.Event()
+        self.stopped = False
+
+    def notify(self):
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+    def run(self):
+        while not self.stopped:
+            self.wakeup.wait(self.interval or None)
+            self.wakeup.clear()
+            if self.stopped:
+                break
+            # the blocks dirty since the last checkpoint are written back a few at a time,
+            # so that the foreground transactions only wait for the buffer pool shortly
+            while not self.stopped and global_buffer_pool.flush_old_pages(
+                    self.manager.checkpoint_lsn, common_db.CHECKPOINT_FLUSH_BLOCKS):
+                pass
+            try:
+                self.manager.checkpoint()
+            except (OSError, ValueError) as e:
+                print(f"checkpoint failed: {e}")
+
 
 class TransactionManager:
-    def __init__(self):
+    def __init__(self, log_file=wal_db.WAL_FILE_NAME, recover=True):
         self.current_transaction_id = 0
         self.active_transactions = {}  # trans_id -> transaction_info
         self.committed_transactions = set()
-        
-        # Initialize log files
-        self.before_image_file = "before_images.log"
-        self.after_image_file = "after_images.log"
-        self.transaction_log_file = "transaction.log"
-        
-        self._init_log_files()
-        
-    def _init_log_files(self):
-        """Initialize log files if they don't exist"""
-        for filename in [self.before_image_file, self.after_image_file, self.transaction_log_file]:
-            if not os.path.exists(filename):
-                with open(filename, 'wb') as f:
-                    # Write empty header block
-                    header = ctypes.create_string_buffer(BLOCK_SIZE)
-                    struct.pack_into('!ii', header, 0, 0, 0)  # next_block_id, num_records
-                    f.write(header)
-    
+        self.snapshot_readers = 0  # the snapshots of the queries without transaction, see get_snapshot()
+        self.rollback_listeners = []  # called with {table file: block ids} of the blocks an abort has changed
+        self.lock = threading.Lock()  # the transaction tables are shared by the threads
+        self.checkpoint_lock = threading.Lock()  # one checkpoint at a time
+        self.checkpoint_lsn = 0  # the end of the log when the last checkpoint began
+        self.redo_lsn = 0  # the recovery begins its redo here, the log before it is recycled
+        self.checkpoints = 0
+        self.checkpoint_thread = None
+
+        # the worker processes of a parallel scan only read the tables, they never recover them
+        recover = recover and multiprocessing.parent_process() is None
+        self.background = recover  # only the main process takes checkpoints
+        end_lsn = None
+        if recover:
+            losers, loser_records, changes, end_lsn = self._analyze(log_file)
+
+        # the log is opened once and kept open, a logged block is written back only after its log records
+        self.wal = wal_db.WalWriter(log_file, end_lsn=end_lsn)
+        global_buffer_pool.set_log(self.wal)
+
+        if recover and (changes or losers):
+            redone = self._redo(changes)
+            undone = self._undo(losers, loser_records)
+            global_buffer_pool.flush_all()
+            if redone or losers:
+                print(f"Recovery: {redone} changes redone, "
+                      f"{undone} changes of {len(losers)} unfinished transactions undone")
+                self.checkpoint()
+        self.checkpoint_lsn = self.wal.end_lsn
+
+    def _analyze(self, log_file):
+        """Analysis pass: find the unfinished transactions and collect the changes to be redone"""
+        losers = {}  # trans_id -> last lsn of the transactions which have neither committed nor aborted
+        loser_records = {}  # trans_id -> {lsn: (type, prev lsn, payload)}
+        changes = []  # (lsn, table name, block id, ranges) of all the changes, in the order of the log
+        segments = wal_db.list_segments(log_file)
+        end_lsn = segments[-1][0] if segments else None
+        for (lsn, log_type, trans_id, prev_lsn, payload, end) in wal_db.read_records(log_file):
+            end_lsn = end
+            self.current_transaction_id = max(self.current_transaction_id, trans_id)
+            if log_type == LOG_CHECKPOINT:
+                # the transactions before it may be in the removed segments
+                next_trans_id, self.redo_lsn, active, dirty, aborted = unpack_checkpoint(payload)
+                self.current_transaction_id = max(self.current_transaction_id, next_trans_id - 1)
+                continue
+            if log_type in (LOG_COMMIT, LOG_ABORT):
+                losers.pop(trans_id, None)
+                loser_records.pop(trans_id, None)
+                if log_type == LOG_COMMIT:
+                    self.committed_transactions.add(trans_id)
+                continue
+
+            losers[trans_id] = lsn
+            loser_records.setdefault(trans_id, {})[lsn] = (log_type, prev_lsn, payload)
+            if log_type in (LOG_UPDATE, LOG_SLOT_UPDATE):
+                changes.append((lsn,) + unpack_update(payload))
+            elif log_type == LOG_CLR:
+                changes.append((lsn,) + unpack_clr(payload)[1:])
+        # the changes before the redo lsn of the last checkpoint are on the disk
+        changes = [change for change in changes if change[0] >= self.redo_lsn]
+        return losers, loser_records, changes, end_lsn
+
+    def _redo(self, changes):
+        """Redo pass: apply the changes which are not in their blocks on the disk yet, file by file"""
+        files = {}  # table name -> block id -> [(lsn, ranges)] in the order of the log
+        for (lsn, table_name, block_id, ranges) in changes:
+            files.setdefault(table_name, {}).setdefault(block_id, []).append((lsn, ranges))
+
+        redone = 0
+        for (table_name, blocks) in files.items():
+            if not os.path.exists(table_name):  # the table has been dropped
+                continue
+            lsn_map = global_buffer_pool.track_page_lsns(table_name)
+            file_redone = 0
+            for block_id in sorted(blocks):
+                page_lsn = lsn_map.get(block_id)
+                todo = [ranges for (lsn, ranges) in blocks[block_id] if lsn >= page_lsn]
+                if not todo:
+                    continue
+                block_buf = global_buffer_pool.pin(table_name, block_id)
+                for ranges in todo:
+                    apply_delta(block_buf, ranges)
+                global_buffer_pool.unpin(table_name, block_id, dirty=True)  # its records are already on the disk
+                file_redone += len(todo)
+            if file_redone:
+                global_buffer_pool.flush_file(table_name)
+                redone += file_redone
+            # a block may have been written back before the maps of the table, even if nothing is redone
+            self._drop_table_maps(table_name)
+        return redone
+
+    def _undo(self, losers, loser_records):
+        """Undo pass: take back the changes of the unfinished transactions, the last change first"""
+        undone = 0
+        last_lsns = dict(losers)
+        heap = [(-lsn, trans_id) for (trans_id, lsn) in losers.items()]
+        heapq.heapify(heap)
+        while heap:
+            lsn, trans_id = heapq.heappop(heap)
+            log_type, prev_lsn, payload = loser_records[trans_id][-lsn]
+            next_lsn = prev_lsn
+            if log_type in (LOG_UPDATE, LOG_SLOT_UPDATE):
+                table_name = unpack_update(payload)[0]
+                if os.path.exists(table_name):
+                    last_lsns[trans_id] = self._undo_change(trans_id, last_lsns[trans_id], log_type, prev_lsn, payload)
+                    self._drop_table_maps(table_name)
+                    undone += 1
+            elif log_type == LOG_CLR:
+                next_lsn = unpack_clr(payload)[0]  # the changes before it have been undone already
+
+            if next_lsn:
+                heapq.heappush(heap, (-next_lsn, trans_id))
+            else:
+                self.wal.append(LOG_ABORT, trans_id, last_lsns[trans_id], struct.pack(LOG_TIME_FORMAT, time.time()))
+        self.wal.flush()
+        return undone
+
+    def _undo_change(self, trans_id, last_lsn, log_type, prev_lsn, payload):
+        """Take back one logged change in its block and log the compensation record, return the LSN of it;
+        the block is latched like a block which a transaction changes, its free space map entry is updated"""
+        if log_type == LOG_SLOT_UPDATE:
+            table_name, block_id, ranges, slots = unpack_slot_update(payload)
+        else:
+            table_name, block_id, ranges = unpack_update(payload)
+        with global_lock_manager.latch(table_name, block_id):
+            block_buf = global_buffer_pool.pin(table_name, block_id)
+            try:
+                before = bytes(block_buf)
+                if log_type == LOG_SLOT_UPDATE:
+                    undo_slots(block_buf, block_id, slots)
+                else:
+                    apply_delta(block_buf, ranges, undo=True)
+                clr_lsn = self.wal.append(LOG_CLR, trans_id, last_lsn,
+                                          pack_clr(prev_lsn, table_name, block_id, page_delta(before, block_buf)))
+                if block_id > 0:
+                    fsm = page_db.FreeSpaceMap(os.fsencode(os.path.splitext(table_name)[0] + '.fsm'))
+                    if fsm.exists():
+                        fsm.set(block_id, page_db.free_space(block_buf))
+            except Exception:
+                global_buffer_pool.unpin(table_name, block_id)
+                raise
+            global_buffer_pool.unpin(table_name, block_id, dirty=True, lsn=clr_lsn)
+        return clr_lsn
+
+    def _rollback(self, trans_id):
+        """Take back the changes of an active transaction from its last record on, as the undo pass does,
+        return the number of undone changes and the blocks in which they were: {table file: block ids}"""
+        info = self.active_transactions[trans_id]
+        lsn = info['last_lsn']
+        if lsn:
+            self.wal.flush(lsn)  # the records are read back from the log
+        undone = 0
+        tables = {}
+        while lsn:
+            log_type, _, prev_lsn, payload = wal_db.read_record(self.wal.file_name, lsn)
+            next_lsn = prev_lsn
+            if log_type in (LOG_UPDATE, LOG_SLOT_UPDATE):
+                table_name = unpack_update(payload)[0]
+                if os.path.exists(table_name):
+                    with self.lock:
+                        last_lsn = info['last_lsn']
+                    clr_lsn = self._undo_change(trans_id, last_lsn, log_type, prev_lsn, payload)
+                    with self.lock:
+                        info['last_lsn'] = clr_lsn
+                    tables.setdefault(table_name, set()).add(unpack_update(payload)[1])
+                    undone += 1
+            elif log_type == LOG_CLR:
+                next_lsn = unpack_clr(payload)[0]
+            lsn = next_lsn
+        return undone, tables
+
+    def _drop_table_maps(self, table_name):
+        """The free space map and the zone map of a recovered table are built again when it is opened"""
+        base = os.path.splitext(table_name)[0]
+        for suffix in ('.fsm', '.zmp'):
+            global_buffer_pool.close_file(base + suffix, discard=True)
+            if os.path.exists(base + suffix):
+                os.remove(base + suffix)
+
+    def _append_log(self, trans_id, log_type, payload=b''):
+        """Append a log record of the transaction, return its LSN"""
+        with self.lock:
+            info = self.active_transactions[trans_id]
+            lsn = self.wal.append(log_type, trans_id, info['last_lsn'], payload)
+            info['last_lsn'] = lsn
+            if not info['first_lsn']:
+                info['first_lsn'] = lsn
+            return lsn
+
+    def checkpoint(self):
+        """Take a fuzzy checkpoint and remove the log segments which the recovery no longer needs"""
+        with self.checkpoint_lock:
+            begin_lsn = self.wal.end_lsn
+            # the active transactions are taken before the dirty blocks: a change which is logged in between
+            # belongs to one of them, so the redo lsn is never after it
+            with self.lock:
+                next_trans_id = self.current_transaction_id + 1
+                active = [(trans_id, info['first_lsn'], info['last_lsn'])
+                          for (trans_id, info) in self.active_transactions.items() if info['first_lsn']]
+            dirty = global_buffer_pool.dirty_pages()
+            redo_lsn = min([begin_lsn] + [entry[1] for entry in active] + [entry[2] for entry in dirty])
+
+            # the blocks which are not dirty any more must be on the disk before the checkpoint is,
+            # and so must the maps of the tables, which are not logged: the recovery only builds again
+            # the maps of the tables changed after the redo lsn
+            global_buffer_pool.flush_unlogged()
+            global_buffer_pool.sync_files()
+            lsn = self.wal.append(LOG_CHECKPOINT, 0, 0, pack_checkpoint(next_trans_id, redo_lsn, active, dirty))
+            self.wal.flush(lsn)
+            self.wal.recycle(redo_lsn)
+            self.checkpoint_lsn = begin_lsn
+            self.redo_lsn = redo_lsn
+            self.checkpoints += 1
+            return lsn
+
+    def _request_checkpoint(self):
+        """Wake the checkpoint thread up if the log has grown enough since the last checkpoint"""
+        if not self.background:
+            return
+        if self.checkpoint_thread is None or not self.checkpoint_thread.is_alive():
+            if not common_db.CHECKPOINT_LOG_BYTES and not common_db.CHECKPOINT_INTERVAL:
+                return
+            self.checkpoint_thread = CheckpointThread(self)
+            self.checkpoint_thread.start()
+        if common_db.CHECKPOINT_LOG_BYTES and \
+                self.wal.end_lsn - self.checkpoint_lsn >= common_db.CHECKPOINT_LOG_BYTES:
+            self.checkpoint_thread.notify()
+
+    def shutdown(self):
+        """Stop the checkpoint thread, write all the blocks back and take a last checkpoint"""
+        if self.checkpoint_thread is not None:
+            self.checkpoint_thread.stop()
+            self.checkpoint_thread.join()
+            self.checkpoint_thread = None
+        if self.background:
+            global_buffer_pool.flush_all()
+            self.checkpoint()
+
     def begin_transaction(self):
         """Begin a new transaction"""
-        self.current_transaction_id += 1
-        trans_id = self.current_transaction_id
-        
-        self.active_transactions[trans_id] = {
-            'start_time': time.time(),
-            'state': TRANS_ACTIVE,
-            'operations': []
-        }
-        
+        with self.lock:
+            self.current_transaction_id += 1
+            trans_id = self.current_transaction_id
+
+            self.active_transactions[trans_id] = {
+                'start_time': time.time(),
+                'state': TRANS_ACTIVE,
+                'operations': [],
+                'first_lsn': 0,
+                'last_lsn': 0,
+                'snapshot_active': frozenset(self.active_transactions)  # the transactions it does not see
+            }
+
         # Log transaction begin
-        self._write_transaction_log(trans_id, LOG_BEGIN, None)
+        self._append_log(trans_id, LOG_BEGIN)
         print(f"Transaction {trans_id} started")
         return trans_id
     
@@ -69,16 +545,18 @@ class TransactionManager:
             print(f"Error: Transaction {trans_id} not found")
             return False
             
-        # Write all after-images to ensure durability (Commit Rule)
-        self._flush_after_images(trans_id)
-        
-        # Log transaction commit
-        self._write_transaction_log(trans_id, LOG_COMMIT, None)
-        
+        # Log transaction commit and wait until the log is on the disk (Commit Rule),
+        # the transactions which commit at the same time share one fsync
+        lsn = self._append_log(trans_id, LOG_COMMIT, struct.pack(LOG_TIME_FORMAT, time.time()))
+        self.wal.flush(lsn)
+
         # Move to committed transactions
-        self.committed_transactions.add(trans_id)
-        del self.active_transactions[trans_id]
-        
+        with self.lock:
+            self.committed_transactions.add(trans_id)
+            del self.active_transactions[trans_id]
+        global_lock_manager.release_all(trans_id)  # strict two-phase locking: the locks are kept until now
+        self._request_checkpoint()
+
         print(f"Transaction {trans_id} committed")
         return True
     
@@ -88,106 +566,65 @@ class TransactionManager:
             print(f"Error: Transaction {trans_id} not found")
             return False
         
-        # Log transaction abort
-        self._write_transaction_log(trans_id, LOG_ABORT, None)
-        
-        # Remove from active transactions
-        self.active_transactions[trans_id]['state'] = TRANS_ABORTED
-        del self.active_transactions[trans_id]
-        
-        print(f"Transaction {trans_id} aborted")
-        return True
-    
-    def log_before_image(self, trans_id, table_name, block_id, old_data):
-        """Log before-image (Write-Ahead Logging Rule)"""
-        if trans_id not in self.active_transactions:
-            print(f"Error: Transaction {trans_id} not active")
-            return False
-        
-        log_entry = {
-            'trans_id': trans_id,
-            'table_name': table_name,
-            'block_id': block_id,
-            'data': old_data,
-            'timestamp': time.time()
-        }
-        
-        self._write_to_log_file(self.before_image_file, log_entry)
-        self.active_transactions[trans_id]['operations'].append(('before', log_entry))
-        print(f"Before-image logged for transaction {trans_id}")
+        # Take back its changes while it still holds its locks, then log transaction abort
+        undone, tables = self._rollback(trans_id)
+        self._append_log(trans_id, LOG_ABORT, struct.pack(LOG_TIME_FORMAT, time.time()))
+
+        # Remove from active transactions, none of its records is left in the tables
+        with self.lock:
+            self.active_transactions[trans_id]['state'] = TRANS_ABORTED
+            del self.active_transactions[trans_id]
+        for listener in self.rollback_listeners:  # the tables are still locked
+            listener(tables)
+        global_lock_manager.release_all(trans_id)
+
+        print(f"Transaction {trans_id} aborted, {undone} changes undone")
         return True
     
-    def log_after_image(self, trans_id, table_name, block_id, new_data):
-        """Log after-image"""
+    def log_page_update(self, trans_id, table_name, block_id, old_data, new_data, redo_only=False):
+        """Log the change of a block (Write-Ahead Logging Rule), return the LSN of the record, 0 if nothing changed;
+        a redo-only change is logged as a compensation record, it is kept when the transaction is undone"""
         if trans_id not in self.active_transactions:
             print(f"Error: Transaction {trans_id} not active")
             return False
-        
-        log_entry = {
-            'trans_id': trans_id,
-            'table_name': table_name,
-            'block_id': block_id,
-            'data': new_data,
-            'timestamp': time.time()
-        }
-        
-        self._write_to_log_file(self.after_image_file, log_entry)
-        self.active_transactions[trans_id]['operations'].append(('after', log_entry))
-        print(f"After-image logged for transaction {trans_id}")
-        return True
-    
-    def _write_to_log_file(self, filename, log_entry):
-        """Write log entry to specified log file"""
-        with open(filename, 'r+b') as f:
-            # Read header to get next available position
-            f.seek(0)
-            header_data = f.read(8)
-            next_block_id, num_records = struct.unpack('!ii', header_data)
-            
-            # Serialize log entry
-            table_name_bytes = log_entry['table_name'].encode('utf-8')[:50]  # Limit table name
-            table_name_bytes = table_name_bytes.ljust(50, b'\0')
-            
-            data_bytes = log_entry['data'][:BLOCK_SIZE-100]  # Leave space for metadata
-            data_len = len(data_bytes)
-            
-            entry_size = 50 + 4 + 4 + 8 + 4 + data_len  # table_name + trans_id + block_id + timestamp + data_len + data
-            
-            # Find position to write
-            write_pos = BLOCK_SIZE + num_records * BLOCK_SIZE
-            f.seek(write_pos)
-            
-            # Write log entry
-            entry_buffer = ctypes.create_string_buffer(BLOCK_SIZE)
-            struct.pack_into('!50siid i', entry_buffer, 0, 
-                           table_name_bytes, 
-                           log_entry['trans_id'],
-                           log_entry['block_id'], 
-                           log_entry['timestamp'],
-                           data_len)
-            
-            struct.pack_into(f'!{data_len}s', entry_buffer, 70, data_bytes)
-            f.write(entry_buffer)
-            
-            # Update header
-            f.seek(0)
-            struct.pack_into('!ii', header_data, 0, next_block_id, num_records + 1)
-            f.write(header_data)
-            f.flush()
-    
-    def _write_transaction_log(self, trans_id, log_type, data):
-        """Write transaction state change to transaction log"""
-        with open(self.transaction_log_file, 'a+b') as f:
-            log_entry = struct.pack('!iid', trans_id, log_type, time.time())
-            f.write(log_entry)
-            f.flush()
-    
-    def _flush_after_images(self, trans_id):
-        """Ensure all after-images for transaction are written to disk"""
-        # In a real implementation, this would ensure all after-images
-        # are written to non-volatile storage before commit
-        print(f"Flushing after-images for transaction {trans_id}")
-    
+
+        ranges = page_delta(old_data, new_data)
+        if not ranges:
+            return 0
+        if redo_only:
+            undo_next_lsn = self.active_transactions[trans_id]['last_lsn']
+            lsn = self._append_log(trans_id, LOG_CLR, pack_clr(undo_next_lsn, table_name, block_id, ranges))
+        elif block_id > 0:  # a data block, block 0 is the head of the table
+            if struct.unpack_from('!i', old_data, 0)[0] != block_id:  # a new block
+                old_data = bytes(len(old_data))
+            payload = pack_slot_update(table_name, block_id, ranges, page_db.changed_slots(old_data, new_data))
+            lsn = self._append_log(trans_id, LOG_SLOT_UPDATE, payload)
+        else:
+            lsn = self._append_log(trans_id, LOG_UPDATE, pack_update(table_name, block_id, ranges))
+        self.active_transactions[trans_id]['operations'].append(('update', lsn))
+        return lsn
+
+    def get_snapshot(self, trans_id=None):
+        """The snapshot of the transaction taken at its BEGIN, a new snapshot for a reader without transaction,
+        which must be given back by release_snapshot()"""
+        with self.lock:
+            info = self.active_transactions.get(trans_id)
+            if info is not None:
+                return page_db.Snapshot(trans_id, trans_id + 1, info['snapshot_active'])
+            self.snapshot_readers += 1
+            return page_db.Snapshot(None, self.current_transaction_id + 1, self.active_transactions)
+
+    def release_snapshot(self, snapshot):
+        """The reader without transaction has finished, see get_snapshot()"""
+        if snapshot.trans_id is None:
+            with self.lock:
+                self.snapshot_readers -= 1
+
+    def has_snapshot_readers(self, exclude=None):
+        """Whether a transaction other than exclude or a query may still read the deleted records"""
+        with self.lock:
+            return any(trans_id != exclude for trans_id in self.active_transactions) or self.snapshot_readers > 0
+
     def is_transaction_active(self, trans_id):
         """Check if transaction is active"""
         return trans_id in self.active_transactions
@@ -204,5 +641,13 @@ class TransactionManager:
         """Get list of committed transaction IDs"""
         return list(self.committed_transactions)
 
+    def get_log_stats(self):
+        """Counters of the write-ahead log, e.g. the number of fsyncs"""
+        stats = self.wal.get_stats()
+        stats['checkpoints'] = self.checkpoints
+        stats['redo_lsn'] = self.redo_lsn
+        return stats
+
 # Global transaction manager instance
 global_transaction_manager = TransactionManager()
+atexit.register(global_transaction_manager.shutdown)
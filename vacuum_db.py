@@ -0,0 +1,172 @@
+# -----------------------------------------------------------------------
+# vacuum_db.py
+# -----------------------------------------------------------------------
+# the module gives back the space of the deleted records of the tables
+# a delete only sets the tombstone bit of the record (see page_db.py) and tells
+# the table to the vacuum thread, which purges the blocks of the table one by one
+# and sleeps after each block, so the foreground work is hardly slowed down.
+# the thread only purges inside each block, the slots of the other records do not change;
+# Storage.vacuum() also moves the records of half-empty blocks and cuts the table
+# -----------------------------------------------------------------------
+
+import os
+import struct
+import threading
+import time
+import common_db
+import page_db
+from buffer_db import global_buffer_pool
+from transaction_db import global_transaction_manager
+from lock_db import global_lock_manager
+
+TABLE_OPTIONS_MAGIC = 0x54424f50  # the same as in storage_db.py
+TABLE_FLAG_COMPRESSED = 0x4
+
+
+# ------------------------------
+# give back the space of the deleted records in the data blocks of a table
+# each block is purged under its latch like a block which a transaction changes (see Storage._acquire_block()),
+# the purge is logged as a redo-only change of a transaction of its own, so the recovery redoes the
+# changes logged after it on the purged block; the blocks which are latched or pinned by someone else
+# are left for the next round, and the purge stops when another transaction begins, which may delete
+# records in the blocks
+# input:
+#       file_name: the table file, e.g. b'student.dat'
+#       throttle: the seconds to sleep after each purged block
+# output:
+#       (number of removed records, True if some blocks have been left)
+# -------------------------------------
+def purge_table(file_name, throttle=0.0):
+    fsm_file = file_name[:-len(b'.dat')] + b'.fsm'
+    with global_buffer_pool.lock:
+        if global_buffer_pool.num_blocks(file_name) == 0:
+            return 0, False
+        dir_buf = global_buffer_pool.read_block(file_name, 0)
+    data_block_num, num_of_fields = struct.unpack_from('!iii', dir_buf, 0)[1:]
+    options_offset = struct.calcsize('!iii') + num_of_fields * struct.calcsize('!10sii')
+    if options_offset + struct.calcsize('!ii') <= len(dir_buf):  # see the table options in storage_db.py
+        magic, flags = struct.unpack_from('!ii', dir_buf, options_offset)
+        if magic == TABLE_OPTIONS_MAGIC and flags & TABLE_FLAG_COMPRESSED:
+            return 0, False  # the blocks of a compressed table are not pages in the file
+    fsm = page_db.FreeSpaceMap(fsm_file)
+    has_fsm = fsm.exists()  # a table without one gets it when it is written, see Storage._ensure_maps()
+
+    removed = 0
+    left = False
+    trans_id = global_transaction_manager.begin_transaction()
+    try:
+        for block_id in range(1, data_block_num + 1):
+            if global_transaction_manager.has_snapshot_readers(exclude=trans_id):
+                left = True
+                break
+            latch = global_lock_manager.latch(file_name, block_id)
+            if not latch.acquire(blocking=False):
+                left = True
+                continue
+            try:
+                with global_buffer_pool.lock:
+                    if global_buffer_pool.is_pinned(file_name, block_id):
+                        left = True
+                        continue
+                    block_buf = global_buffer_pool.pin(file_name, block_id)
+                    count = 0
+                    lsn = 0
+                    if page_db.num_tombstones(block_buf):
+                        before = bytes(block_buf)
+                        count = page_db.purge_page(block_buf)
+                        lsn = global_transaction_manager.log_page_update(trans_id, os.fsdecode(file_name), block_id,
+                                                                         before, block_buf, redo_only=True)
+                        if has_fsm:
+                            fsm.set(block_id, page_db.free_space(block_buf))
+                    global_buffer_pool.unpin(file_name, block_id, dirty=count > 0, lsn=lsn or 0)
+            finally:
+                latch.release()
+            if count:
+                removed += count
+                if throttle:
+                    time.sleep(throttle)
+    finally:
+        global_transaction_manager.commit_transaction(trans_id)
+    fsm.flush()  # before the data blocks, see Storage.insert_many()
+    global_buffer_pool.flush_file(file_name)
+    return removed, left
+
+
+# --------------------------------------------
+# the thread which purges the tables with deleted records in the background
+# --------------------------------------------
+class VacuumThread(threading.Thread):
+
+    # ------------------------------
+    # constructor of the class
+    # input:
+    #       interval: the seconds to wait before the pending tables are looked at again
+    #       throttle: see purge_table()
+    # -------------------------------------
+    def __init__(self, interval=common_db.VACUUM_INTERVAL, throttle=common_db.VACUUM_THROTTLE):
+        threading.Thread.__init__(self, name='vacuum', daemon=True)
+        self.interval = interval
+        self.throttle = throttle
+        self.pending = set()  # the table files with deleted records
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.removed = 0
+
+    # ------------------------------
+    # the table has deleted records
+    # -------------------------------------
+    def notify(self, file_name):
+        with self.lock:
+            self.pending.add(os.fsencode(file_name))
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+    def run(self):
+        while not self.stopped:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            # a tombstone is kept while a transaction is active, so it can still be aborted,
+            # and while a query reads a snapshot in which the record was not deleted yet
+            if self.stopped or global_transaction_manager.has_snapshot_readers():
+                continue
+            with self.lock:
+                tables = sorted(self.pending)
+                self.pending.clear()
+            for file_name in tables:
+                try:
+                    removed, left = purge_table(file_name, self.throttle)
+                except (OSError, ValueError, struct.error) as e:  # e.g. the table has been dropped
+                    print(f"vacuum of {os.fsdecode(file_name)} failed: {e}")
+                    continue
+                self.removed += removed
+                if left:
+                    self.notify(file_name)
+
+
+_vacuum_thread = None
+
+
+# ------------------------------
+# tell the table with deleted records to the vacuum thread, it is started at the first call
+# nothing is done if BACKGROUND_VACUUM is False, the space is then given back by Storage.vacuum()
+# -------------------------------------
+def notify(file_name):
+    global _vacuum_thread
+    if not common_db.BACKGROUND_VACUUM:
+        return
+    if _vacuum_thread is None or not _vacuum_thread.is_alive():
+        _vacuum_thread = VacuumThread()
+        _vacuum_thread.start()
+    _vacuum_thread.notify(file_name)
+
+
+def shutdown():
+    global _vacuum_thread
+    if _vacuum_thread is not None:
+        _vacuum_thread.stop()
+        _vacuum_thread.join()
+        _vacuum_thread = None
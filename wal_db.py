@@ -0,0 +1,538 @@
+# -----------------------------------------------------------------------
+# wal_db.py
+# -----------------------------------------------------------------------
+# the module implements the write-ahead log of the transaction manager.
+# The log is a sequence of segment files which are only appended, the last one
+# is opened once and kept open; a transaction only appends its records to a buffer
+# in main memory and gets their LSNs, the disk is written by a log writer thread.
+# A committing transaction waits until the durable end of the log has passed its
+# commit record: the log writer writes and fsyncs the whole buffer for all the
+# waiters (group commit), so that the transactions which commit at the same time
+# share one fsync and the others never wait for the disk. A new segment is begun
+# when the last one has grown beyond WAL_SEGMENT_SIZE, the segments before the oldest
+# LSN still needed by the recovery are removed after a checkpoint (see transaction_db.py)
+# -----------------------------------------------------------------------
+
+# structure of one segment file, e.g. wal.0000000000000001.log for the segment which begins at LSN 1
+# ----------------------------------------
+# magic, version, start lsn     # WAL_SEGMENT_HEAD_FORMAT
+# record_0
+# record_1
+# ...
+# -------------------------------------------
+# structure of one log record
+# ----------------------------------------
+# length of the stored payload  # WAL_RECORD_HEAD_FORMAT
+# crc32                         # of the rest of the head and the stored payload
+# flags                         # WAL_FLAG_ZLIB if the payload is compressed
+# type                          # LOG_BEGIN, LOG_COMMIT, ... see transaction_db.py
+# transaction id
+# prev lsn                      # the previous record of the same transaction, 0 for the first one
+# payload                       # compressed with zlib if it is at least WAL_COMPRESS_MIN bytes and gets smaller
+# -------------------------------------------
+# a torn record or a record whose crc does not match is taken as the torn end of the log only if
+# it is the last record of the last segment, anywhere else the log is corrupted and it is not read on;
+# the segments of version 1 and 2 have records without crc and flags ('!iiiq'),
+# they are still read, but a new segment is begun instead of appending to them
+# -------------------------------------------
+# the LSN (log sequence number) of a record is the start lsn of its segment plus its offset
+# after the segment head; a segment begins at the end of the one before it,
+# so the LSNs grow with the log and a record is never at LSN 0
+# -------------------------------------------
+# structure of the page LSN file of a table, e.g. student.lsn for student.dat
+# ----------------------------------------
+# floor                     # the records before it are older than the content of the table file
+# page lsn of block_0       # the records before it are in the block on the disk
+# page lsn of block_1
+# ...
+# -------------------------------------------
+# the buffer pool writes the durable end of the log as the page LSN of every block it writes back,
+# so the recovery redoes only the records at or after the page LSN of their block (see transaction_db.py);
+# the page LSNs are kept in main memory until the table file has been fsynced, so a page LSN on the disk
+# is never ahead of its block. An older page LSN only makes the recovery redo more, the changed byte
+# ranges can be applied again to a block which already has them
+# -------------------------------------------
+
+import os
+import re
+import struct
+import threading
+import zlib
+import common_db
+
+WAL_FILE_NAME = 'wal.log'  # the segments are named after it, e.g. wal.0000000000000001.log
+WAL_FILE_MAGIC = b'WAL2'
+WAL_VERSION = 3
+WAL_SEGMENT_HEAD_FORMAT = '!4siq'
+WAL_SEGMENT_HEAD_LEN = struct.calcsize(WAL_SEGMENT_HEAD_FORMAT)
+WAL_FIRST_LSN = 1
+WAL_RECORD_HEAD_FORMAT = '!iIiiiq'
+WAL_RECORD_HEAD_LEN = struct.calcsize(WAL_RECORD_HEAD_FORMAT)
+WAL_RECORD_FRAME_FORMAT = '!iI'  # length of the stored payload, crc32
+WAL_RECORD_FRAME_LEN = struct.calcsize(WAL_RECORD_FRAME_FORMAT)
+WAL_RECORD_CHECKED_FORMAT = '!iiiq'  # flags, type, transaction id, prev lsn: the rest of the head, under the crc
+WAL_OLD_RECORD_HEAD_FORMAT = '!iiiq'  # version 1 and 2: length of the payload, type, transaction id, prev lsn
+WAL_OLD_RECORD_HEAD_LEN = struct.calcsize(WAL_OLD_RECORD_HEAD_FORMAT)
+WAL_FLAG_ZLIB = 1
+WAL_COMPRESS_LEVEL = 1  # the log is compressed on the way of the commits, so fast beats small
+PAGE_LSN_FORMAT = '!q'
+PAGE_LSN_LEN = struct.calcsize(PAGE_LSN_FORMAT)
+
+
+# ------------------------------
+# the file of the segment which begins at start_lsn
+# -------------------------------------
+def segment_name(file_name, start_lsn):
+    stem, suffix = os.path.splitext(file_name)
+    return '%s.%016x%s' % (stem, start_lsn, suffix)
+
+
+# ------------------------------
+# the segments of the log
+# output:
+#       a list of (start lsn, segment file) in the order of the LSNs
+# -------------------------------------
+def list_segments(file_name=WAL_FILE_NAME):
+    stem, suffix = os.path.splitext(file_name)
+    directory = os.path.dirname(stem) or '.'
+    pattern = re.compile(re.escape(os.path.basename(stem)) + r'\.([0-9a-f]{16})' + re.escape(suffix) + '$')
+    segments = []
+    for name in os.listdir(directory):
+        matched = pattern.match(name)
+        if matched:
+            segments.append((int(matched.group(1), 16), os.path.join(os.path.dirname(stem), name)))
+    segments.sort()
+    return segments
+
+
+# ------------------------------
+# check the head of a segment file
+# output:
+#       (start lsn, version), None if the head is torn
+# -------------------------------------
+def _read_segment_head(f_handle, path):
+    head = f_handle.read(WAL_SEGMENT_HEAD_LEN)
+    if len(head) < WAL_SEGMENT_HEAD_LEN:
+        return None
+    magic, version, start_lsn = struct.unpack(WAL_SEGMENT_HEAD_FORMAT, head)
+    if magic != WAL_FILE_MAGIC or version > WAL_VERSION:
+        raise ValueError(f"{path} is not a log segment")
+    return start_lsn, version
+
+
+# ------------------------------
+# the bytes of one log record in a segment, see the structure of one log record
+# input:
+#       compress_min: the payload is compressed if it has at least this many bytes, 0 means never
+# -------------------------------------
+def pack_record(log_type, trans_id, prev_lsn, payload=b'', compress_min=0):
+    flags = 0
+    if 0 < compress_min <= len(payload):
+        compressed = zlib.compress(payload, WAL_COMPRESS_LEVEL)
+        if len(compressed) < len(payload):
+            payload, flags = compressed, WAL_FLAG_ZLIB
+    checked = struct.pack(WAL_RECORD_CHECKED_FORMAT, flags, log_type, trans_id, prev_lsn)
+    crc = zlib.crc32(payload, zlib.crc32(checked))
+    return struct.pack(WAL_RECORD_FRAME_FORMAT, len(payload), crc) + checked + payload
+
+
+# ------------------------------
+# create the segment file which begins at start_lsn
+# output:
+#       the file handle to append to the segment
+# -------------------------------------
+def _create_segment(file_name, start_lsn):
+    f_handle = open(segment_name(file_name, start_lsn), 'wb')
+    f_handle.write(struct.pack(WAL_SEGMENT_HEAD_FORMAT, WAL_FILE_MAGIC, WAL_VERSION, start_lsn))
+    f_handle.flush()
+    os.fsync(f_handle.fileno())
+    return f_handle
+
+
+# --------------------------------------------
+# the writer of the log, one object is shared by all the transactions
+# --------------------------------------------
+class WalWriter(object):
+
+    # ------------------------------
+    # constructor of the class, the first segment is created if the log does not exist,
+    # the log writer thread is started
+    # input:
+    #       file_name: the name of the log, see segment_name()
+    #       buffer_size: the log writer thread writes the buffer (without fsync) when it grows beyond it
+    #       group_commit_delay: the seconds the log writer waits for other committers before an fsync
+    #       end_lsn: the end of the last complete record, a torn record after it is cut off
+    #       segment_size: a new segment is begun when the last one has grown beyond it
+    #       buffer_limit: the appending transactions wait for the log writer when the buffer reaches it
+    # -------------------------------------
+    def __init__(self, file_name=WAL_FILE_NAME, buffer_size=common_db.WAL_BUFFER_SIZE,
+                 group_commit_delay=common_db.WAL_GROUP_COMMIT_DELAY, end_lsn=None,
+                 segment_size=common_db.WAL_SEGMENT_SIZE, buffer_limit=common_db.WAL_BUFFER_LIMIT,
+                 compress_min=common_db.WAL_COMPRESS_MIN):
+        self.file_name = file_name
+        self.buffer_size = buffer_size
+        self.group_commit_delay = group_commit_delay
+        self.segment_size = segment_size
+        self.buffer_limit = max(buffer_limit, buffer_size)
+        self.compress_min = compress_min
+        self.lock = threading.Lock()
+        self.work = threading.Condition(self.lock)  # wakes up the log writer
+        self.flushed = threading.Condition(self.lock)  # wakes up the transactions waiting for the log writer
+        self.buffer = bytearray()
+        self.flush_lsn = 0  # the log writer makes the log durable up to here
+        self.error = None  # why the log writer has stopped
+        self.stopping = False
+
+        segments = list_segments(file_name)
+        if segments:
+            self.segment_start, path = segments[-1]
+            with open(path, 'rb') as f_head:
+                head = _read_segment_head(f_head, path)
+                if head is None or head[0] != self.segment_start:
+                    raise ValueError(f"{path} does not begin at LSN {self.segment_start}")
+            if end_lsn is not None:
+                if end_lsn < self.segment_start:  # read_records() stops only in the last segment
+                    raise ValueError(f"the end of the log at LSN {end_lsn} is before the last segment {path}")
+                size = WAL_SEGMENT_HEAD_LEN + end_lsn - self.segment_start
+                if os.path.getsize(path) > size:
+                    os.truncate(path, size)
+            self.f_handle = open(path, 'ab')
+            if head[1] != WAL_VERSION:  # the new records are not appended to a segment of an older version
+                start_lsn = self.segment_start + self.f_handle.tell() - WAL_SEGMENT_HEAD_LEN
+                self.f_handle.close()
+                self.segment_start = start_lsn
+                self.f_handle = _create_segment(file_name, start_lsn)
+        else:
+            self.segment_start = WAL_FIRST_LSN
+            self.f_handle = _create_segment(file_name, WAL_FIRST_LSN)
+
+        self.written_lsn = self.segment_start + self.f_handle.tell() - WAL_SEGMENT_HEAD_LEN  # given to the file
+        self.durable_lsn = self.written_lsn  # the end of the bytes which are on the disk
+        self.end_lsn = self.written_lsn  # the end of the log, including the buffer
+
+        self.appends = 0
+        self.payload_bytes = 0
+        self.stored_bytes = 0  # the payload bytes after the compression
+        self.writes = 0
+        self.fsyncs = 0
+        self.commit_waits = 0
+        self.append_waits = 0
+        self.recycled = 0
+
+        self.writer = threading.Thread(target=self._run, name='wal-writer', daemon=True)
+        self.writer.start()
+
+    # ------------------------------
+    # append one record to the log buffer, the disk is left to the log writer thread
+    # input:
+    #       log_type, trans_id
+    #       prev_lsn: the previous record of the transaction
+    #       payload: bytes
+    # output:
+    #       the LSN of the record
+    # -------------------------------------
+    def append(self, log_type, trans_id, prev_lsn, payload=b''):
+        record = pack_record(log_type, trans_id, prev_lsn, payload, self.compress_min)
+        with self.lock:
+            while len(self.buffer) >= self.buffer_limit and self.error is None and not self.stopping:
+                self.append_waits += 1  # the log writer is behind, wait until it has taken the buffer
+                self.work.notify()
+                self.flushed.wait()
+            lsn = self.end_lsn
+            self.buffer += record
+            self.end_lsn += len(record)
+            self.appends += 1
+            self.payload_bytes += len(payload)
+            self.stored_bytes += len(record) - WAL_RECORD_HEAD_LEN
+            if len(self.buffer) >= self.buffer_size:
+                self.work.notify()
+            return lsn
+
+    # ------------------------------
+    # wait until the record at lsn and all the records before it are on the disk
+    # input:
+    #       lsn: None for the whole log
+    # -------------------------------------
+    def flush(self, lsn=None):
+        with self.lock:
+            target = self.end_lsn if lsn is None else lsn + 1
+            self.commit_waits += 1
+            while self.durable_lsn < target:
+                if self.error is not None:
+                    raise RuntimeError(f"the log writer has stopped: {self.error}")
+                if self.flush_lsn < target:
+                    self.flush_lsn = target
+                    self.work.notify()
+                self.flushed.wait()
+
+    # ------------------------------
+    # the log writer thread: it takes the buffer, writes it into the last segment and fsyncs it
+    # when a transaction waits for it; a new segment is begun once the last one has grown beyond
+    # segment_size. The lock is not held during the disk I/O, so the transactions keep appending
+    # -------------------------------------
+    def _run(self):
+        with self.lock:
+            while True:
+                while not self.stopping and self.flush_lsn <= self.durable_lsn and \
+                        len(self.buffer) < self.buffer_size:
+                    self.work.wait()
+                if self.stopping and self.durable_lsn >= self.end_lsn:
+                    self.error = 'the log is closed'
+                    self.flushed.notify_all()
+                    return
+
+                sync = self.flush_lsn > self.durable_lsn or self.stopping
+                if sync and self.group_commit_delay > 0 and not self.stopping:
+                    self.work.wait(self.group_commit_delay)  # let concurrent committers append their records
+                data, end, f_handle = self.buffer, self.end_lsn, self.f_handle
+                rotate = end - self.segment_start >= self.segment_size
+                next_handle = None
+                self.buffer = bytearray()
+                self.flushed.notify_all()  # the appending transactions waiting for room go on
+                self.lock.release()
+                try:
+                    if data:
+                        f_handle.write(data)
+                    if sync or rotate:
+                        f_handle.flush()
+                        os.fsync(f_handle.fileno())
+                    if rotate:
+                        f_handle.close()
+                        next_handle = _create_segment(self.file_name, end)
+                except Exception as e:
+                    self.lock.acquire()
+                    self.buffer[0:0] = data  # the records stay in the buffer
+                    self.error = e
+                    self.flushed.notify_all()
+                    print(f"Error: the log writer has stopped: {e}")
+                    return
+                self.lock.acquire()
+                self.written_lsn = end
+                self.writes += 1 if data else 0
+                if sync or rotate:
+                    self.durable_lsn = end
+                    self.fsyncs += 1
+                if next_handle is not None:
+                    self.segment_start, self.f_handle = end, next_handle
+                self.flushed.notify_all()
+
+    # ------------------------------
+    # remove the segments which end at or before oldest_lsn, the last segment is always kept
+    # output:
+    #       the number of removed segments
+    # -------------------------------------
+    def recycle(self, oldest_lsn):
+        with self.lock:
+            segments = list_segments(self.file_name)
+            removed = 0
+            for ((start, path), (next_start, next_path)) in zip(segments, segments[1:]):
+                if next_start > oldest_lsn or start >= self.segment_start:
+                    break
+                os.remove(path)
+                removed += 1
+            self.recycled += removed
+            return removed
+
+    # ------------------------------
+    # return the counters of the log
+    # -------------------------------------
+    def get_stats(self):
+        with self.lock:
+            return {
+                'end_lsn': self.end_lsn,
+                'durable_lsn': self.durable_lsn,
+                'buffered_bytes': len(self.buffer),
+                'records': self.appends,
+                'payload_bytes': self.payload_bytes,
+                'stored_payload_bytes': self.stored_bytes,
+                'writes': self.writes,
+                'fsyncs': self.fsyncs,
+                'commit_waits': self.commit_waits,
+                'append_waits': self.append_waits,
+                'segments': len(list_segments(self.file_name)),
+                'recycled_segments': self.recycled,
+            }
+
+    # ------------------------------
+    # make the whole log durable, stop the log writer thread and close the last segment
+    # -------------------------------------
+    def close(self):
+        with self.lock:
+            self.stopping = True
+            self.work.notify()
+        self.writer.join()
+        with self.lock:
+            self.f_handle.close()
+
+
+# ------------------------------
+# read the records of the log one by one, segment by segment
+# output:
+#       a generator of (lsn, type, trans_id, prev_lsn, payload, end of the record),
+#       the payload is decompressed; it stops at the torn end of the log, i.e. a torn record
+#       or one whose crc does not match after which nothing follows in the last segment;
+#       ValueError is raised for such a record anywhere else and for a gap between the segments
+# -------------------------------------
+def read_records(file_name=WAL_FILE_NAME):
+    segments = list_segments(file_name)
+    for (number, (start_lsn, path)) in enumerate(segments):
+        last = number == len(segments) - 1
+        with open(path, 'rb') as f_handle:
+            segment_head = _read_segment_head(f_handle, path)
+            if segment_head is None:
+                if last:
+                    return
+                raise ValueError(f"{path} has a torn segment head, the log is corrupted")
+            checked = segment_head[1] >= WAL_VERSION
+            head_len = WAL_RECORD_HEAD_LEN if checked else WAL_OLD_RECORD_HEAD_LEN
+            lsn = start_lsn
+            while True:
+                head = f_handle.read(head_len)
+                if not head:
+                    break
+                length = -1
+                if len(head) == head_len:
+                    if checked:
+                        length, crc, flags, log_type, trans_id, prev_lsn = struct.unpack(WAL_RECORD_HEAD_FORMAT, head)
+                    else:
+                        length, log_type, trans_id, prev_lsn = struct.unpack(WAL_OLD_RECORD_HEAD_FORMAT, head)
+                        flags = 0
+                payload = f_handle.read(max(length, 0))
+                if length < 0 or len(payload) < length or \
+                        checked and zlib.crc32(payload, zlib.crc32(head[WAL_RECORD_FRAME_LEN:])) != crc:
+                    if last and not f_handle.read(1):  # nothing follows it: the torn end of the log
+                        return
+                    raise ValueError(f"the log record at LSN {lsn} in {path} is torn or its crc does not match, "
+                                     f"the log is corrupted")
+                end = lsn + head_len + length
+                if flags & WAL_FLAG_ZLIB:
+                    payload = zlib.decompress(payload)
+                yield (lsn, log_type, trans_id, prev_lsn, payload, end)
+                lsn = end
+            if not last and segments[number + 1][0] != lsn:
+                raise ValueError(f"{path} ends at LSN {lsn}, but the next segment begins at LSN "
+                                 f"{segments[number + 1][0]}, the log is corrupted")
+
+
+# ------------------------------
+# read the record at lsn, e.g. to undo the changes of a transaction which aborts;
+# the record must be in a segment file already (see WalWriter.flush())
+# output:
+#       (type, trans_id, prev_lsn, payload), the payload is decompressed
+# -------------------------------------
+def read_record(file_name, lsn):
+    segments = [(start_lsn, path) for (start_lsn, path) in list_segments(file_name) if start_lsn <= lsn]
+    if not segments:
+        raise ValueError(f"the log record at LSN {lsn} has been recycled")
+    start_lsn, path = segments[-1]
+    with open(path, 'rb') as f_handle:
+        segment_head = _read_segment_head(f_handle, path)
+        checked = segment_head is not None and segment_head[1] >= WAL_VERSION
+        head_len = WAL_RECORD_HEAD_LEN if checked else WAL_OLD_RECORD_HEAD_LEN
+        f_handle.seek(WAL_SEGMENT_HEAD_LEN + lsn - start_lsn)
+        head = f_handle.read(head_len)
+        if len(head) < head_len:
+            raise ValueError(f"no log record at LSN {lsn}")
+        if checked:
+            length, crc, flags, log_type, trans_id, prev_lsn = struct.unpack(WAL_RECORD_HEAD_FORMAT, head)
+        else:
+            length, log_type, trans_id, prev_lsn = struct.unpack(WAL_OLD_RECORD_HEAD_FORMAT, head)
+            flags = 0
+        payload = f_handle.read(max(length, 0))
+    if length < 0 or len(payload) < length or \
+            checked and zlib.crc32(payload, zlib.crc32(head[WAL_RECORD_FRAME_LEN:])) != crc:
+        raise ValueError(f"the log record at LSN {lsn} is damaged")
+    if flags & WAL_FLAG_ZLIB:
+        payload = zlib.decompress(payload)
+    return log_type, trans_id, prev_lsn, payload
+
+
+# ------------------------------
+# the page LSN file of a table file, e.g. 'student.lsn' for b'student.dat'
+# -------------------------------------
+def page_lsn_file(file_name):
+    return os.path.splitext(os.fsdecode(file_name))[0] + '.lsn'
+
+
+# --------------------------------------------
+# the page LSNs of the blocks of one table file
+# --------------------------------------------
+class PageLsnMap(object):
+
+    # ------------------------------
+    # constructor of the class
+    # input:
+    #       file_name: the table file
+    #       floor: the floor of a new page LSN file, i.e. the records before it are not redone
+    # -------------------------------------
+    def __init__(self, file_name, floor=0):
+        self.file_name = page_lsn_file(file_name)
+        self.pending = {}  # block id -> page lsn of the blocks which may not be on the disk yet
+        self.f_handle = None  # the file is created when it is needed, see create()
+        if os.path.exists(self.file_name) and os.path.getsize(self.file_name) >= PAGE_LSN_LEN:
+            self.f_handle = open(self.file_name, 'rb+', buffering=0)
+            self.floor = struct.unpack(PAGE_LSN_FORMAT, self.f_handle.read(PAGE_LSN_LEN))[0]
+        else:
+            self.reset(floor)
+
+    # ------------------------------
+    # create the file with the floor if the table has none yet, before the first change of the table is logged,
+    # so that a table which is only read gets no page LSN file
+    # -------------------------------------
+    def create(self):
+        if self.f_handle is None:
+            self.f_handle = open(self.file_name, 'wb+', buffering=0)
+            self.f_handle.write(struct.pack(PAGE_LSN_FORMAT, self.floor))
+        return self.f_handle
+
+    def get(self, block_id):
+        if block_id in self.pending:
+            return max(self.floor, self.pending[block_id])
+        if self.f_handle is None:
+            return self.floor
+        self.f_handle.seek((block_id + 1) * PAGE_LSN_LEN)
+        entry = self.f_handle.read(PAGE_LSN_LEN)
+        if len(entry) < PAGE_LSN_LEN:
+            return self.floor
+        return max(self.floor, struct.unpack(PAGE_LSN_FORMAT, entry)[0])
+
+    def set(self, block_id, lsn):
+        self.pending[block_id] = lsn
+
+    # ------------------------------
+    # the blocks may not be on the disk, e.g. their file is rewritten: their page LSNs are not written
+    # -------------------------------------
+    def drop_pending(self):
+        self.pending.clear()
+
+    # ------------------------------
+    # forget the page LSNs, e.g. the table file has been rewritten: no record before floor is redone
+    # -------------------------------------
+    def reset(self, floor):
+        self.floor = floor
+        self.pending.clear()
+        if self.f_handle is None:  # the file is created with the new floor
+            return
+        self.f_handle.seek(0)
+        self.f_handle.truncate()
+        self.f_handle.write(struct.pack(PAGE_LSN_FORMAT, floor))
+        self.f_handle.flush()
+
+    # ------------------------------
+    # write the page LSNs of the blocks which have been fsynced, see BufferPool.sync_files()
+    # -------------------------------------
+    def sync(self):
+        if self.f_handle is None and not self.pending:
+            return
+        if self.f_handle is not None and self.f_handle.closed:
+            return  # the program is exiting, an older page LSN only makes the recovery redo more
+        f_handle = self.create()
+        for (block_id, lsn) in sorted(self.pending.items()):
+            f_handle.seek((block_id + 1) * PAGE_LSN_LEN)
+            f_handle.write(struct.pack(PAGE_LSN_FORMAT, lsn))
+        self.pending.clear()
+        os.fsync(f_handle.fileno())
+
+    def close(self):
+        if self.f_handle is not None:
+            self.f_handle.close()
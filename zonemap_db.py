@@ -0,0 +1,182 @@
+# -----------------------------------------------------------------------
+# zonemap_db.py
+# -----------------------------------------------------------------------
+# the module keeps the zone map of a table, i.e. the smallest and the largest
+# value of each column in each data block. A scan with a range condition skips
+# the blocks whose values are all out of the range without decoding them.
+# the bounds are only widened by insert and update, a delete leaves them as they are,
+# so they always contain the values of the block (and of the blocks restored by an abort)
+# -----------------------------------------------------------------------
+
+# structure of the zone map file <table>.zmp, one entry per data block
+# ----------------------------------------
+# state                               # ZONE_UNKNOWN, ZONE_EMPTY or ZONE_VALID
+# valid_0, min_0, max_0               # valid_i is False if the bounds of column i are unknown
+# ...
+# valid_n, min_n, max_n
+# -------------------------------------------
+# int and bool values are stored as '!q', str and varstr values in field_length bytes
+# an entry never crosses the border of a block of the file
+
+import struct
+from common_db import BLOCK_SIZE
+from buffer_db import global_buffer_pool
+
+ZONE_UNKNOWN = 0  # the block must be read
+ZONE_EMPTY = 1  # no record has been put into the block
+ZONE_VALID = 2
+
+
+# ------------------------------
+# whether a value in [min_value, max_value] can satisfy "value operator_str constant"
+# -------------------------------------
+def range_may_match(min_value, max_value, operator_str, constant):
+    if operator_str in ('=', 'EQX'):
+        return min_value <= constant <= max_value
+    if operator_str == '<':
+        return min_value < constant
+    if operator_str == '<=':
+        return min_value <= constant
+    if operator_str == '>':
+        return max_value > constant
+    if operator_str == '>=':
+        return max_value >= constant
+    return True  # e.g. '!=', the block is read
+
+
+# --------------------------------------------
+# the zone map of a table
+# --------------------------------------------
+class ZoneMap(object):
+
+    # ------------------------------
+    # constructor of the class
+    # input:
+    #       file_name: the name of the map file, e.g. b'student.zmp'
+    #       field_list: list of (field name, field type, field length)
+    # -------------------------------------
+    def __init__(self, file_name, field_list):
+        self.file_name = file_name
+        self.field_list = list(field_list)
+        self.str_fields = [i for (i, field) in enumerate(self.field_list) if field[1] in (0, 1)]
+
+        fmt = '!B'
+        for (field_name, field_type, field_length) in self.field_list:
+            if field_type in (2, 3):
+                fmt += '?qq'
+            else:
+                fmt += '?' + str(field_length) + 's' + str(field_length) + 's'
+        self.entry = struct.Struct(fmt)
+        self.enabled = self.entry.size <= BLOCK_SIZE  # a table with very long fields has no zone map
+        self.entries_per_block = BLOCK_SIZE // self.entry.size
+
+    def exists(self):
+        return global_buffer_pool.num_blocks(self.file_name) > 0
+
+    def _locate(self, block_id):
+        return divmod(block_id - 1, self.entries_per_block)
+
+    # ------------------------------
+    # the entry of the data block
+    # output:
+    #       (state, bounds), bounds is a list with [min, max] or None for each column
+    # -------------------------------------
+    def get(self, block_id):
+        if not self.enabled:
+            return ZONE_UNKNOWN, None
+        zmp_block, index = self._locate(block_id)
+        if zmp_block >= global_buffer_pool.num_blocks(self.file_name):
+            return ZONE_UNKNOWN, None
+        zmp_buf = global_buffer_pool.pin(self.file_name, zmp_block)
+        try:
+            values = self.entry.unpack_from(zmp_buf, index * self.entry.size)
+        finally:
+            global_buffer_pool.unpin(self.file_name, zmp_block)
+
+        bounds = []
+        for i in range(len(self.field_list)):
+            valid, min_value, max_value = values[1 + 3 * i:4 + 3 * i]
+            if not valid:
+                bounds.append(None)
+                continue
+            if i in self.str_fields:
+                min_value = min_value.rstrip(b'\0').decode('utf-8')
+                max_value = max_value.rstrip(b'\0').decode('utf-8')
+            bounds.append([min_value, max_value])
+        return values[0], bounds
+
+    def _put(self, block_id, state, bounds):
+        values = [state]
+        for (i, field) in enumerate(self.field_list):
+            bound = bounds[i] if bounds else None
+            if bound is None:
+                values.extend([False, 0, 0] if field[1] in (2, 3) else [False, b'', b''])
+            elif i in self.str_fields:
+                values.extend([True, bound[0].encode('utf-8'), bound[1].encode('utf-8')])
+            else:
+                values.extend([True, int(bound[0]), int(bound[1])])
+
+        zmp_block, index = self._locate(block_id)
+        zmp_buf = global_buffer_pool.pin(self.file_name, zmp_block)
+        self.entry.pack_into(zmp_buf, index * self.entry.size, *values)
+        global_buffer_pool.unpin(self.file_name, zmp_block, dirty=True)
+
+    # ------------------------------
+    # the data block has been initialized and holds no record
+    # -------------------------------------
+    def set_empty(self, block_id):
+        if self.enabled:
+            self._put(block_id, ZONE_EMPTY, None)
+
+    # ------------------------------
+    # widen the bounds of the data block by the records which have been put into it
+    # input:
+    #       records: list of tuples of field values
+    # -------------------------------------
+    def extend(self, block_id, records):
+        if not self.enabled or not records:
+            return
+        state, bounds = self.get(block_id)
+        if state == ZONE_UNKNOWN:
+            return  # the block is always read
+        if state == ZONE_EMPTY:
+            bounds = [[records[0][i], records[0][i]] for i in range(len(self.field_list))]
+
+        for (i, field) in enumerate(self.field_list):
+            bound = bounds[i]
+            if bound is None:
+                continue
+            column = [record[i] for record in records]
+            bound[0] = min(bound[0], min(column))
+            bound[1] = max(bound[1], max(column))
+            if i in self.str_fields and max(len(bound[0].encode('utf-8')),
+                                            len(bound[1].encode('utf-8'))) > field[2]:
+                bounds[i] = None  # the value does not fit into the entry
+        self._put(block_id, ZONE_VALID, bounds)
+
+    # ------------------------------
+    # compute the entry of the data block from all of its records
+    # -------------------------------------
+    def rebuild(self, block_id, records):
+        self.set_empty(block_id)
+        self.extend(block_id, records)
+
+    # ------------------------------
+    # whether a record of the data block can satisfy all the predicates
+    # input:
+    #       predicates: list of (field index, operator, typed constant), they are ANDed
+    # -------------------------------------
+    def may_match(self, block_id, predicates):
+        state, bounds = self.get(block_id)
+        if state == ZONE_UNKNOWN:
+            return True
+        if state == ZONE_EMPTY:
+            return False
+        for (field_index, operator_str, constant) in predicates:
+            bound = bounds[field_index]
+            if bound is not None and not range_may_match(bound[0], bound[1], operator_str, constant):
+                return False
+        return True
+
+    def flush(self):
+        global_buffer_pool.flush_file(self.file_name)